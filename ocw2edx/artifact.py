@@ -0,0 +1,90 @@
+#!/usr/bin/python
+#
+# Intermediate course artifact: a converted course, saved so that it can be
+# written out in any output format ("ocw2edx emit") without re-parsing the
+# OCW content.
+#
+# The artifact is a zip file containing:
+#
+#   xbundle.xml    the course and its metadata (policies, about files), in xbundle format
+#   static/...     the static files for the course, at their edX static paths
+#   artifact.json  course id, default output filename, and conversion counts
+
+import json
+import shutil
+import zipfile
+import tempfile
+
+from lxml import etree
+from path import path	# needs path.py
+
+from xbundle import XBundle
+from writer import write_output
+from log import get_logger
+
+log = get_logger("artifact")
+
+#-----------------------------------------------------------------------------
+
+ARTIFACT_VERSION = 1
+
+def save_artifact(fn, xb, files_to_copy, info):
+    '''
+    Save XBundle xb, with static files files_to_copy (dict of source filename -> edX static destination),
+    to artifact zip file fn.  info = dict of extra information (cid, outfn, counts) to save with it.
+    '''
+    xml = etree.Element('xbundle')
+    xml.append(xb.metadata)
+    xml.append(xb.course)
+    zf = zipfile.ZipFile(fn, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        zf.writestr('xbundle.xml', etree.tostring(xml))
+        static = {}
+        for src, dst in files_to_copy.items():
+            if dst not in static:
+                zf.write(src, dst)
+                static[dst] = src
+        info = dict(info, version=ARTIFACT_VERSION, static=sorted(static))
+        zf.writestr('artifact.json', json.dumps(info, indent=4))
+    finally:
+        zf.close()
+
+
+def load_artifact(fn, static_dir):
+    '''
+    Load artifact zip file fn, extracting its static files to static_dir.
+    Returns (XBundle, files_to_copy, info)
+    '''
+    zf = zipfile.ZipFile(fn)
+    try:
+        info = json.loads(zf.read('artifact.json'))
+        if info.get('version') != ARTIFACT_VERSION:
+            raise Exception("[load_artifact] %s has artifact version %s, expected %s" % (fn, info.get('version'), ARTIFACT_VERSION))
+        xb = XBundle(force_studio_format=True)
+        xb.load(zf.open('xbundle.xml'))
+        files_to_copy = {}
+        for dst in info['static']:
+            zf.extract(dst, static_dir)
+            files_to_copy[path(static_dir) / dst] = dst
+    finally:
+        zf.close()
+    return xb, files_to_copy, info
+
+
+def emit(fn, outfn=None, verbose=True, compact_olx=False):
+    '''
+    Write the course in artifact file fn to outfn (default: the output filename the conversion would have used).
+    compact_olx = if True, write html and problem files compactly (see XBundle.compact_xml)
+    Returns the output filename.
+    '''
+    tempd = tempfile.mkdtemp(prefix="tmp_ocw2edx_emit")
+    try:
+        xb, files_to_copy, info = load_artifact(fn, tempd)
+        xb.compact_olx = compact_olx
+        outfn = outfn or info['outfn']
+        write_output(xb, files_to_copy, outfn, verbose=verbose)
+    finally:
+        shutil.rmtree(tempd)
+    if verbose:
+        log.info("Emitted %s from %s", outfn, fn)
+    return outfn
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+#
+# Benchmarks for ocw2edx.
+#
+# Run all benchmarks with
+#
+#   python -m ocw2edx.benchmarks
+#
+# or some of them, by name, e.g. "python -m ocw2edx.benchmarks import_time".
+# Each benchmark returns a dict of measurements, and the results are printed
+# as JSON, so they can be recorded and compared between versions.
+
+import os
+import sys
+import json
+import subprocess
+
+#-----------------------------------------------------------------------------
+
+# modules which are slow to import, and only needed for some conversions
+HEAVY_MODULES = ['requests', 'jinja2', 'BeautifulSoup', 'bs4', 'lxml.html.soupparser', 'PIL']
+
+# ocw2edx modules whose import time is measured
+IMPORT_TIME_MODULES = ['ocw2edx.main', 'ocw2edx.ocw2xbundle', 'ocw2edx.xbundle', 'ocw2edx.srt2sjson']
+
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# shape of the synthetic course for bench_structure: chapters, sequentials per chapter, verticals per
+# sequential, and html components per vertical (101021 elements, 21021 of them structural)
+STRUCTURE_COURSE_SHAPE = (20, 50, 20, 4)
+
+def run_python(code, *options):
+    '''
+    Run code in a fresh python interpreter which can import ocw2edx, and return its stdout and stderr
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGE_PARENT] + [x for x in [env.get('PYTHONPATH')] if x])
+    cmd = [sys.executable] + list(options) + ['-c', code]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise Exception("[benchmarks] %s failed: %s" % (' '.join(cmd), err))
+    return out, err
+
+def import_profile(module):
+    '''
+    Import module in a fresh interpreter.  Returns dict with the wall-clock import time (seconds),
+    and which of the HEAVY_MODULES it imported.  Where the interpreter supports "python -X importtime"
+    (3.7 and later), also returns the cumulative import time of the slowest modules, in microseconds.
+    '''
+    code = ("import sys, time, json; t0 = time.time(); import %s; t1 = time.time(); "
+            "print(json.dumps({'seconds': t1 - t0, 'heavy': [x for x in %r if x in sys.modules]}))"
+            % (module, HEAVY_MODULES))
+    options = ['-X', 'importtime'] if sys.version_info >= (3, 7) else []
+    out, err = run_python(code, *options)
+    result = json.loads(out.strip().splitlines()[-1])
+    if options:
+        cumulative = []
+        for line in err.splitlines():		# "import time: self [us] | cumulative | imported package"
+            fields = line.split('|')
+            if line.startswith('import time:') and len(fields)==3 and fields[1].strip().isdigit():
+                cumulative.append((int(fields[1]), fields[2].strip()))
+        result['slowest'] = sorted(cumulative, reverse=True)[:10]
+    return result
+
+def rss():
+    '''
+    Resident memory of this process, in bytes (None if not available)
+    '''
+    if not os.path.exists("/proc/self/statm"):
+        return None
+    return int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def make_course(shape=STRUCTURE_COURSE_SHAPE, model='lxml'):
+    '''
+    Make a synthetic course of the given shape, as an lxml tree (model='lxml'), or as a structure.Node
+    tree with html payloads as bytes (model='nodes')
+    '''
+    if model=='lxml':
+        from lxml import etree
+        course = etree.Element('course', semester='2013_Spring')
+        def add(parent, tag, name):
+            return etree.SubElement(parent, tag, display_name=name)
+        def add_html(parent, name, text):
+            etree.SubElement(parent, 'html', display_name=name).text = text
+    else:
+        from ocw2edx.structure import Node
+        course = Node('course', {'semester': '2013_Spring'})
+        def add(parent, tag, name):
+            return parent.append(Node(tag, {'display_name': name}))
+        def add_html(parent, name, text):
+            parent.append(Node('html', payload='<html display_name="%s">%s</html>' % (name, text)))
+
+    nchapters, nsequentials, nverticals, nhtml = shape
+    for c in range(nchapters):
+        chapter = add(course, 'chapter', 'Chapter %d' % c)
+        for s in range(nsequentials):
+            seq = add(chapter, 'sequential', 'Sequential %d.%d' % (c, s))
+            for v in range(nverticals):
+                vert = add(seq, 'vertical', 'Unit %d.%d.%d' % (c, s, v))
+                for h in range(nhtml):
+                    add_html(vert, 'Text %d' % h, 'Some text of unit %d.%d.%d, part %d' % (c, s, v, h))
+    return course
+
+def structure_profile(model, shape=STRUCTURE_COURSE_SHAPE, repeat=3):
+    '''
+    Build a synthetic course as model ('lxml' or 'nodes', see make_course) in this process, and return
+    dict with the resident memory it takes (bytes), the time to build it, and the time for structural
+    traversals (best of repeat runs, in seconds): walk = visit each structural node, with its parent's
+    display_name (as url_name assignment does); findall = find all verticals.
+    '''
+    import gc
+    import time
+    from ocw2edx.structure import STRUCTURE_TAGS
+
+    gc.collect()
+    before = rss()
+    t0 = time.time()
+    course = make_course(shape, model)
+    result = {'build_seconds': time.time() - t0}
+    gc.collect()
+    after = rss()
+    result['rss_bytes'] = after - before if after is not None else None
+
+    if model=='lxml':
+        def walk():
+            return sum(1 for x in course.iter(*STRUCTURE_TAGS) if x.getparent() is None or x.getparent().get('display_name'))
+        def findall():
+            return len(course.findall('.//vertical'))
+        result['elements'] = sum(1 for x in course.iter())
+    else:
+        def walk():
+            return sum(1 for x in course.structure() if x.parent is None or x.parent.get('display_name'))
+        def findall():
+            return len(course.findall('vertical'))
+        result['elements'] = sum(1 for x in course.iter())
+    for name, func in [('walk', walk), ('findall', findall)]:
+        times = []
+        for k in range(repeat):
+            t0 = time.time()
+            result[name] = func()
+            times.append(time.time() - t0)
+        result[name + '_seconds'] = min(times)
+    return result
+
+#-----------------------------------------------------------------------------
+# benchmarks
+
+def bench_import_time(repeat=5):
+    '''
+    Import time of the main ocw2edx modules, each in a fresh interpreter (best of repeat runs)
+    '''
+    results = {}
+    for module in IMPORT_TIME_MODULES:
+        runs = [import_profile(module) for k in range(repeat)]
+        best = min(runs, key=lambda x: x['seconds'])
+        results[module] = best
+    return results
+
+def bench_structure(shape=STRUCTURE_COURSE_SHAPE):
+    '''
+    Memory and structural traversal time of a synthetic course (see STRUCTURE_COURSE_SHAPE) held as an
+    lxml tree, and as a structure.Node tree with bytes payloads, each measured in a fresh interpreter
+    '''
+    results = {}
+    for model in ['lxml', 'nodes']:
+        code = ("import json; from ocw2edx.benchmarks import structure_profile; "
+                "print(json.dumps(structure_profile(%r, %r)))" % (model, tuple(shape)))
+        out, err = run_python(code)
+        results[model] = json.loads(out.strip().splitlines()[-1])
+    return results
+
+BENCHMARKS = {'import_time': bench_import_time,
+              'structure': bench_structure,
+              }
+
+def run_benchmarks(names=None):
+    results = {}
+    for name in names or sorted(BENCHMARKS):
+        results[name] = BENCHMARKS[name]()
+    return results
+
+#-----------------------------------------------------------------------------
+# tests
+
+def test_lazy_imports():
+    '''
+    Importing the converter does not import the heavy modules; they are imported on first use.
+    '''
+    for module in IMPORT_TIME_MODULES:
+        assert import_profile(module)['heavy']==[], module
+
+def test_structure_benchmark():
+    '''
+    The structure benchmark visits the same nodes in both models
+    '''
+    results = bench_structure(shape=(2, 3, 4, 2))
+    for key in ['elements', 'walk', 'findall']:
+        assert results['lxml'][key]==results['nodes'][key], key
+    assert results['nodes']['elements']==1 + 2 + 6 + 24 + 48 and results['nodes']['findall']==24
+
+#-----------------------------------------------------------------------------
+
+if __name__=='__main__':
+    print json.dumps(run_benchmarks(sys.argv[1:]), indent=4)
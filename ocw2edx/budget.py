@@ -0,0 +1,214 @@
+#!/usr/bin/python
+#
+# Time and memory budgets for the conversion of one course in a batch.
+#
+# A Watchdog runs each conversion in a child process, in its own process
+# group (so processes it starts, like chapter workers, go with it), and
+# follows the conversion's stage and current OCW page through conversion
+# events sent back over a pipe.  If the conversion runs longer than the
+# time limit, or the resident memory of its process group exceeds the
+# memory limit, the whole group is killed, and the report names the stage
+# and page being converted when the limit was hit.  The rest of the batch
+# carries on.
+
+import os
+import time
+import signal
+import multiprocessing
+
+from log import get_logger
+
+log = get_logger("budget")
+
+#-----------------------------------------------------------------------------
+
+def group_rss(pgid):
+    '''
+    Total resident memory (bytes) of the processes in process group pgid, from /proc (None if not available)
+    '''
+    if not os.path.exists("/proc/self/statm"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            stat = open("/proc/%s/stat" % pid).read()
+            fields = stat[stat.rindex(')') + 2:].split()	# fields after "pid (command)"
+            if int(fields[2])==pgid:
+                total += int(fields[21]) * page_size		# rss, in pages
+        except (IOError, OSError, ValueError, IndexError):
+            continue						# process went away, or is not ours to read
+    return total
+
+def run_child(conn, func, args, kwargs):
+    '''
+    Child process: run func(*args, listeners=[...], **kwargs), sending its stage and page
+    events, and then its outcome, to the watchdog over conn
+    '''
+    os.setpgrp()
+    def listener(event, data):
+        if event=='stage_started':
+            conn.send(('stage', data['stage']))
+        elif event=='page_started':
+            conn.send(('page', data['fn']))
+    kwargs = dict(kwargs, listeners=list(kwargs.get('listeners') or []) + [listener])
+    try:
+        func(*args, **kwargs)
+        conn.send(('done', None))
+    except Exception as err:
+        conn.send(('failed', "%s: %s" % (type(err).__name__, err)))
+    finally:
+        conn.close()
+
+
+class Watchdog(object):
+    '''
+    Run conversions, each in a child process, killing any which runs over its time or memory budget.
+    '''
+    def __init__(self, time_limit=None, memory_limit=None, interval=0.5):
+        '''
+        time_limit = maximum wall-clock seconds per conversion (default None: unlimited)
+        memory_limit = maximum resident memory in bytes per conversion, for all its processes (default
+                       None: unlimited; only enforced where /proc is available)
+        interval = seconds between checks of the limits
+        '''
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.interval = interval
+        self.reports = []
+
+    def run(self, name, func, *args, **kwargs):
+        '''
+        Run func(*args, **kwargs) in a child process, under the budget, and return a report (dict):
+
+          input     name (e.g. the OCW zip file)
+          status    "done", "failed" (func raised an exception: see error), or "killed" (see limit)
+          limit     for status "killed", the limit hit: "time" or "memory"
+          stage     conversion stage running at the end (e.g. "chapters"; "start" if none began)
+          page      OCW page (relative to the course directory) being converted at the end, or None
+          seconds   wall-clock run time
+          peak_rss  highest resident memory of the conversion's processes, in bytes, as sampled every
+                    interval (None if the conversion ended before the first sample)
+          error     for status "failed", the exception
+
+        func is called with a listeners keyword argument (list of OCWCourse event listeners), which
+        it must pass on to OCWCourse, for the stage and page to be known.  The report is also
+        appended to self.reports.
+        '''
+        report = {'input': name, 'status': None, 'limit': None, 'stage': 'start', 'page': None,
+                  'seconds': None, 'peak_rss': None, 'error': None}
+        recv, send = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(target=run_child, args=(send, func, args, kwargs))
+        start = time.time()
+        proc.start()
+        send.close()
+        try:
+            next_check = start
+            while report['status'] is None:
+                try:
+                    # take events until the next check of the limits is due (however often they come)
+                    if recv.poll(max(next_check - time.time(), 0)):
+                        self.receive(recv.recv(), report)
+                        while report['status'] is None and time.time() < next_check and recv.poll():
+                            self.receive(recv.recv(), report)
+                except EOFError:				# child exited without reporting
+                    proc.join()
+                    report['status'] = 'failed'
+                    report['error'] = "conversion process exited with code %s" % proc.exitcode
+                    break
+                if report['status'] is not None or time.time() < next_check:
+                    continue
+                next_check = time.time() + self.interval
+                rss = group_rss(proc.pid)
+                if rss is not None:
+                    report['peak_rss'] = max(report['peak_rss'] or 0, rss)
+                if self.time_limit and time.time() - start > self.time_limit:
+                    report['limit'] = 'time'
+                elif self.memory_limit and rss and rss > self.memory_limit:
+                    report['limit'] = 'memory'
+                if report['limit']:
+                    report['status'] = 'killed'
+        finally:
+            if report['status']!='done':
+                self.kill(proc)
+            proc.join()
+            recv.close()
+        report['seconds'] = time.time() - start
+
+        self.reports.append(report)
+        if report['status']=='killed':
+            log.error("Killed conversion of %s: over %s limit (%s) in stage %s, page %s, after %.1f s, RSS %s bytes",
+                      name, report['limit'], self.time_limit if report['limit']=='time' else self.memory_limit,
+                      report['stage'], report['page'], report['seconds'], report['peak_rss'])
+        elif report['status']=='failed':
+            log.error("Conversion of %s failed in stage %s, page %s: %s", name, report['stage'], report['page'],
+                      report['error'])
+        return report
+
+    @staticmethod
+    def receive(msg, report):
+        kind, value = msg
+        if kind=='stage':
+            report['stage'] = value
+        elif kind=='page':
+            report['page'] = value
+        elif kind=='done':
+            report['status'] = 'done'
+        elif kind=='failed':
+            report['status'] = 'failed'
+            report['error'] = value
+
+    @staticmethod
+    def kill(proc):
+        '''
+        Kill the child process and its process group
+        '''
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass					# already gone, or not yet in its own group
+        if proc.is_alive():
+            proc.terminate()
+
+#-----------------------------------------------------------------------------
+# tests
+
+def slow_conversion(pages, seconds, listeners=None, memory=0):
+    '''
+    Stand-in for a conversion, sending stage and page events like OCWCourse (see test1)
+    '''
+    for listener in listeners:
+        listener('stage_started', {'stage': 'chapters'})
+    hog = []
+    for fn in pages:
+        for listener in listeners:
+            listener('page_started', {'fn': fn})
+        hog.append(' ' * memory)
+        time.sleep(max(seconds, 0))
+    if seconds < 0:
+        raise ValueError("negative time")
+
+def test1():
+    watchdog = Watchdog(time_limit=1, interval=0.05)
+    report = watchdog.run("fast.zip", slow_conversion, ["a.htm", "b.htm"], 0.01)
+    assert (report['status'], report['stage'], report['page'])==('done', 'chapters', 'b.htm')
+
+    report = watchdog.run("slow.zip", slow_conversion, ["a.htm", "contents/sec2/index.htm", "c.htm"], 0.6)
+    assert (report['status'], report['limit'])==('killed', 'time') and report['seconds'] < 2
+    assert (report['stage'], report['page'])==('chapters', 'contents/sec2/index.htm')
+
+    busy = Watchdog(time_limit=0.5, interval=0.2)		# events come more often than the checks
+    report = busy.run("busy.zip", slow_conversion, ["p%d.htm" % k for k in range(60)], 0.05)
+    assert (report['status'], report['limit'])==('killed', 'time') and report['seconds'] < 1.5, report
+
+    report = watchdog.run("bad.zip", slow_conversion, ["a.htm"], -1)
+    assert report['status']=='failed' and report['error']=="ValueError: negative time"
+    assert [x['status'] for x in watchdog.reports]==['done', 'killed', 'failed']
+
+    if group_rss(os.getpid()) is not None:
+        watchdog = Watchdog(memory_limit=200 * 1024 * 1024, interval=0.05)
+        report = watchdog.run("big.zip", slow_conversion, ["p%d.htm" % k for k in range(40)], 0.1, memory=20 * 1024 * 1024)
+        assert (report['status'], report['limit'])==('killed', 'memory'), report
+        assert report['page'] in ["p%d.htm" % k for k in range(4, 14)] and report['peak_rss'] > 200 * 1024 * 1024
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+#
+# Whole-conversion result cache.
+#
+# Conversion results are cached in a local directory, keyed by a digest of
+# the input OCW zip file, the effective conversion options, and the
+# converter version.  Each cache entry is a directory holding a copy of the
+# output files (the xbundle .xml file and its static files, the .tar.gz
+# file, or the output directory), plus entry.json describing them.
+#
+# The cache is limited in total size; least recently used entries are
+# evicted first.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+from path import path	# needs path.py
+from log import get_logger
+
+log = get_logger("cache")
+
+#-----------------------------------------------------------------------------
+
+class ResultCache(object):
+    '''
+    Local cache of complete conversion outputs.
+    '''
+    DefaultMaxBytes = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, cache_dir, max_bytes=None, verbose=True):
+        self.dir = path(cache_dir).abspath()
+        if not self.dir.exists():
+            os.makedirs(self.dir)
+        self.max_bytes = max_bytes or self.DefaultMaxBytes
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def output_format(outfn):
+        '''
+        Return output format for output filename: "xml", "tar.gz", or "dir"
+        '''
+        if outfn.endswith(".xml"):
+            return "xml"
+        if outfn.endswith(".tar.gz") or outfn.endswith(".tgz"):
+            return "tar.gz"
+        return "dir"
+
+    @staticmethod
+    def make_key(zfn, options, version):
+        '''
+        Digest of input zip file contents, conversion options (dict), and converter version
+        '''
+        sha = hashlib.sha1()
+        with open(zfn, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                sha.update(chunk)
+        sha.update(json.dumps(options, sort_keys=True))
+        sha.update(version)
+        return sha.hexdigest()
+
+    def entry_dir(self, key):
+        return self.dir / key
+
+    @staticmethod
+    def dir_size(dpath):
+        return sum(os.path.getsize(fn) for fn in path(dpath).walkfiles())
+
+    #----------------------------------------
+
+    def lookup(self, key):
+        '''
+        Return entry description (dict) for key, or None if not in cache
+        '''
+        efn = self.entry_dir(key) / 'entry.json'
+        if not efn.exists():
+            return None
+        try:
+            return json.load(open(efn))
+        except Exception as err:
+            log.warning("Bad cache entry %s, ignoring; error=%s", efn, err)
+            return None
+
+    def restore(self, key, outfn=None):
+        '''
+        Copy cached output for key to outfn (defaults to the name of the output file when it was stored).
+        Static files for xbundle .xml output go into the static directory next to it, as for a conversion.
+        Returns output filename, or None on a cache miss.
+        '''
+        entry = self.lookup(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        outfn = self.copy_out(key, entry, outfn)
+        self.hits += 1
+        return outfn
+
+    def restore_all(self, keys, outfns):
+        '''
+        Restore all the outputs of one conversion (keys and outfns: lists, one per output file), if all
+        are cached, and return True; otherwise restore none, and return False.  Counts one hit or miss.
+        '''
+        entries = [self.lookup(key) for key in keys]
+        if not all(entries):
+            self.misses += 1
+            return False
+        for key, entry, outfn in zip(keys, entries, outfns):
+            self.copy_out(key, entry, outfn)
+        self.hits += 1
+        return True
+
+    def copy_out(self, key, entry, outfn=None):
+        '''
+        Copy cached output for key (with entry description entry) to outfn; returns output filename
+        '''
+        outfn = outfn or entry['outfn']
+        edir = self.entry_dir(key)
+        if entry['format']=='dir':
+            self.copy_tree(edir / 'output', outfn)
+        else:
+            self.copy_file(edir / 'output' / entry['format'], outfn)
+            outdir = os.path.dirname(os.path.abspath(outfn))
+            for rel in entry['static']:
+                self.copy_file(edir / 'output' / rel, os.path.join(outdir, rel))
+        os.utime(edir, None)		# mark as recently used
+        if self.verbose:
+            log.info("Result cache hit %s -> %s", key, outfn)
+        return outfn
+
+    def store(self, key, outfn, static_files=None):
+        '''
+        Store conversion output outfn in the cache under key.
+        static_files = list of static files written (relative to the directory of outfn), for .xml output;
+                       other output formats include their static files.
+        '''
+        fmt = self.output_format(outfn)
+        tmpd = path(tempfile.mkdtemp(prefix="tmp_entry", dir=self.dir))
+        try:
+            if fmt=='dir':
+                self.copy_tree(outfn, tmpd / 'output')
+            else:
+                self.copy_file(outfn, tmpd / 'output' / fmt)
+            static_files = sorted(static_files or []) if fmt=='xml' else []
+            outdir = os.path.dirname(os.path.abspath(outfn))
+            for rel in static_files:
+                self.copy_file(os.path.join(outdir, rel), tmpd / 'output' / rel)
+            entry = {'format': fmt,
+                     'outfn': os.path.basename(outfn.rstrip('/')),
+                     'static': static_files,
+                     'created': time.time(),
+                     }
+            json.dump(entry, open(tmpd / 'entry.json', 'w'), indent=4)
+            edir = self.entry_dir(key)
+            if edir.exists():
+                shutil.rmtree(edir)
+            os.rename(tmpd, edir)
+        except Exception:
+            shutil.rmtree(tmpd, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the cache is within max_bytes.
+        '''
+        entries = []
+        for edir in self.dir.dirs():
+            if edir.basename().startswith('tmp_'):
+                continue
+            entries.append((os.path.getmtime(edir), edir, self.dir_size(edir)))
+        total = sum(x[2] for x in entries)
+        for mtime, edir, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self.verbose:
+                log.info("Result cache evicting %s (%d bytes)", edir.basename(), size)
+            shutil.rmtree(edir)
+            total -= size
+
+    def summary(self):
+        return "Result cache %s: %d hits, %d misses" % (self.dir, self.hits, self.misses)
+
+    #----------------------------------------
+
+    @staticmethod
+    def copy_file(src, dst):
+        dst = path(dst)
+        if dst.dirname() and not dst.dirname().exists():
+            os.makedirs(dst.dirname())
+        shutil.copy2(src, dst)
+
+    @staticmethod
+    def copy_tree(src, dst):
+        src = path(src)
+        for fn in src.walkfiles():
+            ResultCache.copy_file(fn, path(dst) / src.relpathto(fn))
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    tdir = path(tempfile.mkdtemp(prefix="tmp_cache_test"))
+    curdir = os.getcwd()
+    try:
+        os.chdir(tdir)
+        cache = ResultCache(tdir / "cache", max_bytes=1200, verbose=False)
+        open("in.zip", "w").write("zip data")
+        key = cache.make_key("in.zip", {"include_media": True}, "0.1")
+        assert key != cache.make_key("in.zip", {"include_media": False}, "0.1")
+        assert cache.restore(key, "out.tar.gz") is None
+
+        open("out.tar.gz", "w").write("x" * 1000)		# most of the cache size limit
+        cache.store(key, "out.tar.gz")
+        assert cache.restore(key, "copy.tar.gz")=="copy.tar.gz"
+        assert open("copy.tar.gz").read()=="x" * 1000
+        assert (cache.hits, cache.misses)==(1, 1)
+
+        os.mkdir("static")
+        open("static/a.pdf", "w").write("y" * 10)
+        open("out.xml", "w").write("<xbundle/>")
+        key2 = cache.make_key("in.zip", {"include_media": False}, "0.1")
+        os.utime(cache.entry_dir(key), (1, 1))		# make first entry least recently used
+        cache.store(key2, "out.xml", ["static/a.pdf"])
+        assert cache.lookup(key) is None		# evicted to make room
+        os.remove("static/a.pdf")
+        assert cache.restore(key2)=="out.xml"
+        assert open("static/a.pdf").read()=="y" * 10
+
+        cache.hits = cache.misses = 0
+        assert not cache.restore_all([key2, key], ["a.xml", "b.tar.gz"])	# key was evicted
+        assert not os.path.exists("a.xml")
+        assert cache.restore_all([key2, key2], ["a.xml", "b.xml"])
+        assert os.path.exists("a.xml") and os.path.exists("b.xml")
+        assert (cache.hits, cache.misses)==(1, 1)			# once per conversion, not per output
+    finally:
+        os.chdir(curdir)
+        shutil.rmtree(tdir)
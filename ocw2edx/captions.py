@@ -0,0 +1,69 @@
+#!/usr/bin/python
+#
+# In-memory cache of srt caption files retrieved from OCW.
+#
+# A long-running conversion service shares one CaptionCache between all its
+# conversion jobs, so a caption file used by many courses (or by successive
+# updates of one course) is only downloaded once.  The cache is limited in
+# total size; least recently used captions are dropped first.
+
+import threading
+
+from collections import OrderedDict
+
+#-----------------------------------------------------------------------------
+
+class CaptionCache(object):
+    '''
+    Thread-safe LRU cache of caption file contents, keyed by URL.
+    '''
+    DefaultMaxBytes = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or self.DefaultMaxBytes
+        self.captions = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, fetch):
+        '''
+        Return contents of caption file at url, calling fetch(url) to retrieve it if not cached.
+        '''
+        with self.lock:
+            content = self.captions.pop(url, None)
+            if content is not None:
+                self.captions[url] = content		# now most recently used
+                self.hits += 1
+                return content
+            self.misses += 1
+        content = fetch(url)		# not holding the lock, so other jobs are not held up
+        with self.lock:
+            if url not in self.captions and len(content) <= self.max_bytes:
+                self.captions[url] = content
+                self.nbytes += len(content)
+                while self.nbytes > self.max_bytes:
+                    old_url, old = self.captions.popitem(last=False)
+                    self.nbytes -= len(old)
+        return content
+
+    def summary(self):
+        return "Caption cache: %d files, %d bytes, %d hits, %d misses" % (len(self.captions), self.nbytes,
+                                                                       self.hits, self.misses)
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    fetched = []
+    def fetch(url):
+        fetched.append(url)
+        return "x" * 40
+    cc = CaptionCache(max_bytes=100)
+    assert cc.get("a.srt", fetch)=="x" * 40
+    cc.get("b.srt", fetch)
+    cc.get("a.srt", fetch)
+    assert fetched==["a.srt", "b.srt"]
+    cc.get("c.srt", fetch)			# evicts b.srt, the least recently used
+    assert cc.captions.keys()==["a.srt", "c.srt"]
+    assert (cc.hits, cc.misses, cc.nbytes)==(1, 3, 80)
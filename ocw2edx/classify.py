@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+# Rule-based classification of the top-level elements of OCW page content.
+#
+# Each element within an OCW section page (e.g. the children of
+# <div id="parent-fieldname-text">) is classified by the first rule which
+# matches it, looking only at its tag, class, text, and child shape; the
+# element is never serialized.  The rules are defined once, here, and shared
+# by all the code paths which walk OCW page content.
+
+from collections import defaultdict, namedtuple
+
+#-----------------------------------------------------------------------------
+# actions
+
+SKIP = 'skip'			# drop element
+CONTAINER = 'container'		# page structure (<main>, <nav>), not content
+LINK = 'link'			# embedded link (video or PDF) - goes in its own vertical
+VIDEO = 'video'			# embedded video <div>
+INTRO = 'intro'			# ordinary content
+
+Rule = namedtuple('Rule', ['name', 'action', 'match'])
+
+NAV_CLASSES = ['sc_nav', 'sc_nav_bottom']
+CONTAINER_TAGS = ['main', 'nav']
+VIDEO_CLASSES = ['embedbg', 'inline-video']
+NBSP = u'\xa0'
+
+def is_nav(elem):
+    return elem.get('class','') in NAV_CLASSES
+
+def is_container(elem):
+    return elem.tag in CONTAINER_TAGS
+
+def is_empty_paragraph(elem):
+    '''
+    True for <p>&#160;</p>, ie a paragraph with no attributes, no children, and only a nbsp
+    '''
+    return elem.tag=='p' and elem.text==NBSP and len(elem)==0 and not elem.attrib
+
+def is_blockquote(elem):
+    return elem.tag=='blockquote'
+
+def is_single_link(elem):
+    return elem.tag=='p' and len(elem)==1 and elem[0].tag=='a'
+
+def is_video_div(elem):
+    return elem.tag=='div' and elem.get('class','') in VIDEO_CLASSES
+
+# ordered: the first matching rule wins
+OCW_CONTENT_RULES = [
+    Rule('nav', SKIP, is_nav),
+    Rule('container', CONTAINER, is_container),
+    Rule('empty_paragraph', SKIP, is_empty_paragraph),
+    Rule('blockquote', LINK, is_blockquote),
+    Rule('single_link', LINK, is_single_link),
+    Rule('video_div', VIDEO, is_video_div),
+    ]
+
+DEFAULT_RULE = Rule('content', INTRO, None)
+
+#-----------------------------------------------------------------------------
+
+class ElementClassifier(object):
+    '''
+    Classify OCW page content elements using an ordered list of rules, keeping
+    count of how many elements each rule matched.
+    '''
+    def __init__(self, rules=None):
+        self.rules = rules or OCW_CONTENT_RULES
+        self.counts = defaultdict(int)
+
+    def classify(self, elem):
+        '''
+        Return the action (SKIP, CONTAINER, LINK, VIDEO, or INTRO) for elem
+        '''
+        return self.match(elem).action
+
+    def match(self, elem):
+        '''
+        Return the first Rule matching elem
+        '''
+        for rule in self.rules:
+            if rule.match(elem):
+                break
+        else:
+            rule = DEFAULT_RULE
+        self.counts[rule.name] += 1
+        return rule
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    from lxml import etree
+    div = etree.fromstring('''<div><p class="sc_nav">nav</p><main/><p>&#160;</p><p class="x">&#160;</p>
+<p>&#160;<b>x</b></p><blockquote>q</blockquote><p><a href="x.pdf">x</a></p><div class="embedbg"/>
+<table><tr><td>cell</td></tr></table></div>''', parser=etree.HTMLParser()).find('.//div')
+    ec = ElementClassifier()
+    actions = [ec.classify(x) for x in div]
+    assert actions==[SKIP, CONTAINER, SKIP, INTRO, INTRO, LINK, LINK, VIDEO, INTRO]
+    assert ec.counts['empty_paragraph']==1
+    assert ec.counts['content']==3
+    for x in div:
+        assert is_empty_paragraph(x)==etree.tostring(x).startswith('<p>&#160;</p>')
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+#
+# Recognize OCW video embeds, and extract the youtube id, start and end times,
+# and caption file URL from them.
+#
+# OCW pages embed videos using javascript calls like
+#
+#   ocw_embed_chapter_media('embed1', 'https://www.youtube.com/v/<ytid>', 'youtube',
+#                           '/courses/...', 'https://img...', 30, 90, '/courses/.../<ytid>.srt');
+#
+# in <script> elements and onclick popups.  The patterns are compiled once, and
+# a cheap substring test picks which of them can possibly match, so the
+# regular expressions are only run where they can succeed.
+
+import re
+from collections import namedtuple
+
+#-----------------------------------------------------------------------------
+
+EmbedInfo = namedtuple('EmbedInfo', ['ytid', 'start', 'end', 'caption_url', 'call'])
+
+OCW_URL = "https://ocw.mit.edu"
+
+YOUTUBE_ID_PREFIX = "www.youtube.com/v/"
+YOUTUBE_ID_PAT = re.compile("http[s]*://www.youtube.com/v/([^']+)'")
+
+CAPTION_EMBED_MARKER = "caption_embed"
+CAPTION_LINK_PAT = re.compile("'(/courses/[^ ]+.srt)'")
+
+# javascript media calls, in the order in which they are tried
+MEDIA_CALLS = ['load_multiple_media_chapter', 'scholar_video_popup', 'ocw_embed_chapter_media']
+
+MEDIA_CALL_PATS = [(name, re.compile(name + '\(.*,\s*([ 0-9]+),\s*([ 0-9]+),\s*(null|.*\.srt\')\);*'))
+                   for name in MEDIA_CALLS]
+
+GENERIC_CALL_PAT = re.compile('[a-z]+\(.*,\s*([ 0-9]+),\s*([ 0-9]+),\s*(null|.*\.srt\')\);')
+
+#-----------------------------------------------------------------------------
+
+def match_media_call(text):
+    '''
+    Return (call name, match object) for the javascript media call in text, or (None, None).
+    Only patterns whose function name (or, for the generic pattern, closing ");")
+    appears in the text are tried.
+    '''
+    if not text or ("null" not in text and ".srt'" not in text):
+        return None, None
+    for name, pat in MEDIA_CALL_PATS:
+        if name in text:
+            m = pat.search(text)
+            if m:
+                return name, m
+    if ");" in text:
+        m = GENERIC_CALL_PAT.search(text)
+        if m:
+            return 'generic', m
+    return None, None
+
+
+def fix_caption_url(caption_url):
+    '''
+    Turn a (possibly quoted, possibly site-relative) caption URL from a media call into
+    an absolute URL.  Returns None for "null".
+    '''
+    if caption_url.startswith("'"):
+        caption_url = caption_url[1:-1]
+    if caption_url=="null":
+        return None
+    if not caption_url.startswith("http"):
+        caption_url = OCW_URL + caption_url
+    return caption_url
+
+
+def recognize_embed(text):
+    '''
+    Recognize an OCW video embed in text (script text or onclick attribute).
+
+    Returns an EmbedInfo, whose fields are None where not found:
+      ytid        = youtube id
+      start, end  = start and end times in seconds (None if the embed gives end time 0)
+      caption_url = absolute URL of srt caption file
+      call        = name of the javascript call which matched
+    '''
+    text = text or ""
+    ytid = None
+    if YOUTUBE_ID_PREFIX in text:
+        m = YOUTUBE_ID_PAT.search(text)
+        if m:
+            ytid = m.group(1)
+
+    start = end = caption_url = None
+    call, m = match_media_call(text)
+    if m:
+        if m.group(2) != "0":
+            start = int(m.group(1).strip())
+            end = int(m.group(2).strip())
+        caption_url = fix_caption_url(m.group(3))
+    return EmbedInfo(ytid, start, end, caption_url, call)
+
+
+def find_caption_link(text):
+    '''
+    Find a caption file link, as used by the caption_embed script on OCW media pages.
+    Returns absolute URL, or None if the text has no caption_embed, or it has no srt link.
+    '''
+    if not text or CAPTION_EMBED_MARKER not in text:
+        return None
+    m = CAPTION_LINK_PAT.search(text)
+    if not m:
+        return None
+    return OCW_URL + m.group(1)
+
+
+def sec2code(sec):
+    '''
+    Convert integer seconds to HH:MM:SS
+    '''
+    return '%02d:%02d:%02d' % (sec/3600, (sec/60)%60, sec%60)
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    text = ("ocw_embed_chapter_media('embed1', 'https://www.youtube.com/v/QI13S04w8dM', 'youtube', "
+            "'/courses/x', 'https://img', 30, 90, '/courses/physics/x/QI13S04w8dM.srt');")
+    info = recognize_embed(text)
+    assert info.ytid=="QI13S04w8dM"
+    assert (info.start, info.end)==(30, 90)
+    assert info.caption_url=="https://ocw.mit.edu/courses/physics/x/QI13S04w8dM.srt"
+    assert info.call=="ocw_embed_chapter_media"
+    assert sec2code(info.end)=="00:01:30"
+
+def test2():
+    text = "javascript:scholar_video_popup('https://www.youtube.com/v/abc', 'title', 0, 0, null);"
+    info = recognize_embed(text)
+    assert info.ytid=="abc"
+    assert info.start is None and info.end is None
+    assert info.caption_url is None
+    assert info.call=="scholar_video_popup"
+
+def test3():
+    info = recognize_embed("other_media('https://www.youtube.com/v/abc', 1, 2, null);")
+    assert info.call=="generic"
+    assert (info.start, info.end)==(1, 2)
+    assert recognize_embed("no video here")==EmbedInfo(None, None, None, None, None)
+
+def test4():
+    assert find_caption_link("caption_embed('/courses/a/b/c.srt')")=="https://ocw.mit.edu/courses/a/b/c.srt"
+    assert find_caption_link("'/courses/a/b/c.srt'") is None
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+#
+# Optional image optimisation for the static files of a converted course.
+#
+# OCW pages often include multi-megabyte PNG scans and uncompressed
+# diagrams, which students download on every page view.  An ImageOptimizer
+# recompresses (and, if larger than a maximum dimension, downscales) the
+# JPEG and PNG images above a size threshold, on a pool of processes.  The
+# optimised images keep their edX static filenames and formats; an image is
+# only replaced if its optimised version is smaller.  The course image is
+# always resized to fit the size at which Studio displays it.
+#
+# Needs Pillow (imported only when images are optimised: it is slow to
+# import); without it, images are copied unchanged.
+
+import os
+import multiprocessing
+
+from log import get_logger
+
+log = get_logger("images")
+
+#-----------------------------------------------------------------------------
+
+COURSE_IMAGE = "static/images/course_image.jpg"
+COURSE_IMAGE_SIZE = (378, 225)		# course card image size shown in Studio and the LMS
+
+FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+
+def load_pil():
+    '''
+    Return the PIL Image module, or None if Pillow is not installed
+    '''
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+def optimize_image(job):
+    '''
+    Optimise one image.  job = (src, dst, box, quality, always), with box = (width, height) to fit
+    the image in, and always = True to keep the result even if it is not smaller (e.g. to resize).
+    Returns (filename of image to use, bytes before, bytes after, error message or None).
+    '''
+    src, dst, box, quality, always = job
+    before = os.path.getsize(src)
+    Image = load_pil()
+    try:
+        img = Image.open(src)
+        img.load()
+        fmt = FORMATS[os.path.splitext(dst)[1].lower()]
+        if img.size[0] > box[0] or img.size[1] > box[1]:
+            img.thumbnail(box, Image.LANCZOS)
+        if fmt=='JPEG':
+            if img.mode not in ['RGB', 'L']:
+                img = img.convert('RGB')
+            options = dict(quality=quality, optimize=True, progressive=True)
+        else:
+            options = dict(optimize=True)
+        dd = os.path.dirname(dst)
+        if not os.path.exists(dd):
+            os.makedirs(dd)
+        img.save(dst, fmt, **options)
+    except Exception as err:
+        return src, before, before, str(err)
+    after = os.path.getsize(dst)
+    if after >= before and not always:
+        os.unlink(dst)
+        return src, before, before, None
+    return dst, before, after, None
+
+
+class ImageOptimizer(object):
+    '''
+    Recompress and downscale large images among a course's static files, on a pool of processes.
+    '''
+    def __init__(self, threshold=200 * 1024, max_dimension=1600, quality=85, nworkers=None):
+        '''
+        threshold = images of at least this many bytes are optimised
+        max_dimension = images wider or taller than this many pixels are downscaled
+        quality = JPEG quality for recompressed images
+        nworkers = number of processes (default: number of CPUs)
+        '''
+        self.threshold = threshold
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.nworkers = nworkers or multiprocessing.cpu_count()
+
+    def jobs(self, files_to_copy, outdir):
+        jobs = []
+        for src, dst in sorted(files_to_copy.items(), key=lambda x: x[1]):
+            if os.path.splitext(dst)[1].lower() not in FORMATS or not os.path.exists(src):
+                continue
+            odst = os.path.join(outdir, dst)
+            if dst==COURSE_IMAGE:
+                jobs.append((src, odst, COURSE_IMAGE_SIZE, self.quality, True))
+            elif os.path.getsize(src) >= self.threshold:
+                jobs.append((src, odst, (self.max_dimension, self.max_dimension), self.quality, False))
+        return jobs
+
+    def optimize(self, files_to_copy, outdir):
+        '''
+        Optimise images in files_to_copy (dict of source filename -> edX static destination), writing
+        the optimised images under outdir.  Returns (new files_to_copy, with the optimised images as
+        sources, report dict with numbers of images and their bytes before and after).
+        '''
+        report = {'available': load_pil() is not None, 'images': 0, 'optimized': 0, 'errors': 0,
+                  'bytes_before': 0, 'bytes_after': 0}
+        if not report['available']:
+            log.warning("Pillow is not installed: images not optimized")
+            return dict(files_to_copy), report
+        jobs = self.jobs(files_to_copy, outdir)
+        if len(jobs) > 1 and self.nworkers > 1:
+            pool = multiprocessing.Pool(min(self.nworkers, len(jobs)))
+            try:
+                results = pool.map(optimize_image, jobs)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            results = [optimize_image(job) for job in jobs]
+
+        new_files = dict(files_to_copy)
+        for (src, odst, box, quality, always), (fn, before, after, error) in zip(jobs, results):
+            dst = files_to_copy[src]
+            report['images'] += 1
+            report['bytes_before'] += before
+            report['bytes_after'] += after
+            if error:
+                report['errors'] += 1
+                log.warning("Cannot optimize image %s: %s", src, error)
+            elif fn != src:
+                report['optimized'] += 1
+                del new_files[src]
+                new_files[fn] = dst
+                log.debug("    image %s: %d -> %d bytes", dst, before, after)
+        return new_files, report
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    import shutil
+    import tempfile
+    tdir = tempfile.mkdtemp(prefix="tmp_images_test")
+    try:
+        small = os.path.join(tdir, "small.png")
+        big = os.path.join(tdir, "big.png")
+        notes = os.path.join(tdir, "notes.pdf")
+        for fn in [small, big, notes]:
+            open(fn, 'w').write("x")
+        files = {small: "static/images/small.png", big: "static/images/big.png", notes: "static/notes.pdf"}
+        optimizer = ImageOptimizer(threshold=1024, nworkers=2)
+        Image = load_pil()
+        if Image is None:
+            new_files, report = optimizer.optimize(files, os.path.join(tdir, "out"))
+            assert new_files==files and not report['available']
+            return
+
+        Image.new('RGB', (3000, 2000), (255, 255, 255)).save(big, 'PNG')
+        Image.new('RGB', (10, 10), (0, 0, 0)).save(small, 'PNG')
+        files[big] = "static/images/course_image.jpg"
+        files[os.path.join(tdir, "scan.png")] = "static/images/scan.png"
+        Image.effect_noise((2400, 2400), 64).save(os.path.join(tdir, "scan.png"), 'PNG')
+        new_files, report = optimizer.optimize(files, os.path.join(tdir, "out"))
+        assert sorted(new_files.values())==sorted(files.values())	# same static filenames
+        course_image = [k for k, v in new_files.items() if v=="static/images/course_image.jpg"][0]
+        assert Image.open(course_image).format=='JPEG'
+        assert max(Image.open(course_image).size[0] / 378.0, Image.open(course_image).size[1] / 225.0) <= 1
+        scan = [k for k, v in new_files.items() if v=="static/images/scan.png"][0]
+        assert max(Image.open(scan).size)==1600 and scan.startswith(os.path.join(tdir, "out"))
+        assert new_files[small]=="static/images/small.png"			# below threshold: unchanged
+        assert report['images']==2 and report['bytes_after'] < report['bytes_before']
+    finally:
+        shutil.rmtree(tdir)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+#
+# Logging for ocw2edx.
+#
+# All ocw2edx messages go through the standard logging module, under the
+# "ocw2edx" logger, so they are gated by level: at the default level (INFO)
+# only per-course progress is logged, and per-element messages (DEBUG) cost
+# nothing beyond the level check.  Message arguments which are expensive to
+# compute (e.g. serializing an XML element) are wrapped in Lazy, and only
+# computed if the message is actually emitted.
+#
+# Each OCWCourse logs through a CourseLogger, which adds per-course context
+# fields (course id, input file) to every message.  setup_logging() sends
+# messages to a stream, as text, or as one JSON object per line.
+
+import sys
+import json
+import logging
+
+#-----------------------------------------------------------------------------
+
+LOGGER_NAME = "ocw2edx"
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())	# silent unless setup_logging is called
+
+class Lazy(object):
+    '''
+    Log message argument computed as func(*args, **kwargs), only when the message is formatted.
+    '''
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+class CourseLogger(logging.LoggerAdapter):
+    '''
+    Logger which adds context fields (e.g. course, input) to each message, and which can
+    be limited to messages at min_level and above (e.g. for a quiet conversion).
+    '''
+    def __init__(self, logger, min_level=logging.NOTSET, **context):
+        logging.LoggerAdapter.__init__(self, logger, context)
+        self.min_level = min_level
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {'context': dict(self.extra)}
+        return msg, kwargs
+
+    def isEnabledFor(self, level):
+        return level >= self.min_level and self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.isEnabledFor(level):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+
+def get_logger(name=None, min_level=logging.NOTSET, **context):
+    '''
+    Return CourseLogger for the ocw2edx logger (or its child logger name), with context fields given
+    '''
+    logger = logging.getLogger(LOGGER_NAME + ("." + name if name else ""))
+    return CourseLogger(logger, min_level, **context)
+
+#-----------------------------------------------------------------------------
+
+class TextFormatter(logging.Formatter):
+    '''
+    Plain message, prefixed by the course id, if known (so interleaved output from several
+    conversions can be told apart), and by the level, for warnings and errors.
+    '''
+    def format(self, record):
+        msg = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            msg = "%s: %s" % (record.levelname, msg.strip())
+        course = getattr(record, 'context', {}).get('course')
+        if course:
+            msg = "[%s] %s" % (course, msg)
+        if record.exc_info:
+            msg += "\n" + self.formatException(record.exc_info)
+        return msg
+
+
+class JSONFormatter(logging.Formatter):
+    '''
+    One JSON object per message, with the context fields as keys
+    '''
+    def format(self, record):
+        data = {'time': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage().strip(),
+                }
+        data.update(getattr(record, 'context', {}))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, sort_keys=True)
+
+
+def setup_logging(verbosity=1, json_output=False, stream=None):
+    '''
+    Send ocw2edx log messages to stream (default stdout).
+    verbosity = 0 for warnings and errors only, 1 for progress (default), 2 or more for everything
+    json_output = if True, log one JSON object per line, instead of text
+    '''
+    levels = {0: logging.WARNING, 1: logging.INFO}
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        if not isinstance(handler, logging.NullHandler):
+            logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JSONFormatter() if json_output else TextFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(levels.get(verbosity, logging.DEBUG))
+    logger.propagate = False
+    return logger
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    import StringIO
+    calls = []
+    def expensive(x):
+        calls.append(x)
+        return x * 2
+    stream = StringIO.StringIO()
+    logger = setup_logging(verbosity=1, json_output=True, stream=stream)
+    try:
+        log = get_logger("test", course="8.01", input="course.zip")
+        log.debug("detail %s", Lazy(expensive, "a"))
+        assert calls==[] and stream.getvalue()==""		# below level: nothing formatted
+        log.info("progress %s", Lazy(expensive, "b"))
+        assert calls==["b"]
+        data = json.loads(stream.getvalue())
+        assert data['message']=="progress bb"
+        assert (data['course'], data['input'], data['level'])==("8.01", "course.zip", "INFO")
+
+        quiet = get_logger("test", min_level=logging.WARNING)
+        quiet.info("not shown")
+        quiet.warning("shown")
+        assert json.loads(stream.getvalue().splitlines()[-1])['message']=="shown"
+    finally:
+        for handler in list(logger.handlers):
+            if not isinstance(handler, logging.NullHandler):
+                logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
@@ -2,24 +2,256 @@
 Convert MIT OpenCourseWare content download file to OLX format for import into edX-platform instance
 '''
 
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import shutil
 import argparse
-from ocw2xbundle import OCWCourse
+import tempfile
+from ocw2edx.ocw2xbundle import OCWCourse
+from ocw2edx.cache import ResultCache
+from ocw2edx.artifact import emit
+from ocw2edx.log import setup_logging, get_logger
+from ocw2edx.progress import ProgressReporter
+from ocw2edx.images import ImageOptimizer
+from ocw2edx.budget import Watchdog
+
+log = get_logger("main")
+
+def add_logging_options(parser):
+    parser.add_argument("-v", "--verbose", action="count", default=1, help="more detailed logging (may be given twice)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only log warnings and errors")
+    parser.add_argument("--log-json", action="store_true", help="log one JSON object per line, instead of text")
+
+def start_logging(args):
+    setup_logging(0 if args.quiet else args.verbose, json_output=args.log_json)
 
 def CommandLine(args=None, arglist=None):
     '''
     Main command line.  Accepts args, to allow for simple unit testing.
+
+    "ocw2edx emit ..." makes output from an intermediate course artifact; see EmitCommandLine.
+    "ocw2edx serve ..." runs a conversion service; see ServeCommandLine.
     '''
+    if not args:
+        arglist = sys.argv[1:] if arglist is None else arglist
+        if arglist and arglist[0]=='emit':
+            return EmitCommandLine(arglist=arglist[1:])
+        if arglist and arglist[0]=='serve':
+            return ServeCommandLine(arglist=arglist[1:])
 
     # Read arguments from command line
     parser = argparse.ArgumentParser()
-    parser.add_argument("ocw_zip_file_name", help="name of zip file with OCW course data", type=str, nargs='+')
-    parser.add_argument("-o", "--output-file", type=str, help="filename for output file (single-file if ends with .xml, directory otherwise)")
+    parser.add_argument("ocw_zip_file_name", help="name of zip file with OCW course data", type=str, nargs='*')
+    parser.add_argument("-o", "--output-file", type=str, action="append",
+                        help="filename for output file (single-file if ends with .xml, .tar.gz file, directory otherwise); may be given several times")
     parser.add_argument("--suppress-media", help="do not include media, like videos", action="store_true")
+    parser.add_argument("--compact-olx", action="store_true", help="write html and problem files without insignificant whitespace and comments")
+    parser.add_argument("--manifest", type=str, help="input manifest file: reuse sections unchanged since the run which wrote it, then rewrite it")
+    parser.add_argument("--cache-dir", type=str, help="directory for cache of conversion results, reused for the same zip file and options")
+    parser.add_argument("--cache-size", type=int, default=2048, help="maximum size of the result cache, in MB (default 2048)")
+    parser.add_argument("--artifact", type=str, help="also save converted course to this intermediate artifact file, for use with 'ocw2edx emit'")
+    parser.add_argument("--scratch-dir", type=str, help="directory for temporary files (unpacked zip file, staged output), e.g. on a tmpfs")
+    parser.add_argument("--scratch-quota", type=int, help="maximum scratch space used per course, in MB (default unlimited)")
+    parser.add_argument("--watch", type=str, help="watch this directory, converting zip files as they arrive, to .tar.gz files")
+    parser.add_argument("--watch-output", type=str, help="output directory for --watch, with status ledger.json (default <watch dir>/ocw2edx_output)")
+    parser.add_argument("--progress", action="store_true", help="show a progress line, with ETA, on stderr")
+    parser.add_argument("--progress-file", type=str, help="keep conversion progress (JSON) in this file, updated every second")
+    parser.add_argument("--workers", type=int, default=2, help="number of conversions run at once for --watch (default 2)")
+    parser.add_argument("--chapter-workers", type=int, default=1,
+                        help="number of processes converting the chapters of a course in parallel (default 1)")
+    parser.add_argument("--prefetch-threads", type=int, default=4,
+                        help="number of threads parsing OCW pages ahead of their conversion (default 4; 0 for none)")
+    parser.add_argument("--optimize-images", action="store_true",
+                        help="recompress and downscale large images, and resize the course image (needs Pillow)")
+    parser.add_argument("--image-threshold", type=int, default=200, help="with --optimize-images, optimize images of at least this many KB (default 200)")
+    parser.add_argument("--image-max-size", type=int, default=1600, help="with --optimize-images, downscale images larger than this many pixels (default 1600)")
+    parser.add_argument("--time-limit", type=float,
+                        help="stop converting a course after this many seconds, and go on to the next one (default no limit)")
+    parser.add_argument("--memory-limit", type=int,
+                        help="stop converting a course when it uses more than this many MB of memory, and go on to the next one (default no limit)")
+    parser.add_argument("--budget-report", type=str,
+                        help="with --time-limit or --memory-limit, write a JSON report of each course's conversion (status, and stage and page where stopped) to this file")
+    parser.add_argument("--stats-dir", type=str,
+                        help="write course statistics (counts, and static bytes per chapter and sequential) to <zip file name>_stats.json in this directory")
+    add_logging_options(parser)
 
     if not args:
         args = parser.parse_args(arglist)
+        if not args.ocw_zip_file_name and not args.watch:
+            parser.error("no OCW zip file given")
+        if args.manifest and len(args.ocw_zip_file_name) > 1:
+            parser.error("--manifest is for one course: give only one OCW zip file")
+        if args.artifact and len(args.ocw_zip_file_name) > 1:
+            parser.error("--artifact is for one course: give only one OCW zip file")
+    start_logging(args)
+
+    if args.watch:
+        return WatchCommandLine(args)
+
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
     
+    scratch_quota = args.scratch_quota * 1024 * 1024 if args.scratch_quota else None
+    watchdog = None
+    if args.time_limit or args.memory_limit:
+        watchdog = Watchdog(time_limit=args.time_limit,
+                            memory_limit=args.memory_limit * 1024 * 1024 if args.memory_limit else None)
     for zfn in args.ocw_zip_file_name:
-        ocwc = OCWCourse(fn=zfn, ofn=args.output_file, include_media=(not args.suppress_media))
-        ocwc.process()
-        
+        options = dict(include_media=(not args.suppress_media), video_start_offset=0)
+        if args.compact_olx:
+            options['compact_olx'] = True		# only when set, so cache keys of other runs are unchanged
+        if args.optimize_images:
+            options.update(optimize_images=True, image_threshold=args.image_threshold, image_max_size=args.image_max_size)
+        progress = ProgressReporter(args.progress_file, terminal=args.progress)
+        stats_fn = None
+        if args.stats_dir:
+            stats_fn = os.path.join(args.stats_dir, "%s_stats.json" % os.path.splitext(os.path.basename(zfn.rstrip('/')))[0])
+        kwargs = dict(cache=cache, manifest_fn=args.manifest, artifact_fn=args.artifact,
+                      scratch_dir=args.scratch_dir, scratch_quota=scratch_quota, progress=progress,
+                      chapter_workers=args.chapter_workers, prefetch_threads=args.prefetch_threads,
+                      stats_fn=stats_fn)
+        if watchdog is not None:
+            run_with_watchdog(watchdog, zfn, args.output_file, options, **kwargs)
+        else:
+            convert(zfn, args.output_file, options, **kwargs)
+
+    if watchdog is not None:
+        stopped = [x for x in watchdog.reports if x['status']!='done']
+        log.info("%d of %d courses converted within budget", len(watchdog.reports) - len(stopped), len(watchdog.reports))
+        if args.budget_report:
+            with open(args.budget_report, 'w') as fp:
+                json.dump(watchdog.reports, fp, indent=2, sort_keys=True)
+    if cache is not None:
+        log.info("%s", cache.summary())
+
+
+def run_with_watchdog(watchdog, zfn, output_files=None, options=None, scratch_dir=None, **kwargs):
+    '''
+    Convert one OCW zip file, like convert, in a child process run by watchdog (a budget.Watchdog),
+    which kills it if over its time or memory limit.  The conversion's scratch space is made in a
+    directory of its own, which is removed afterwards, as a killed conversion cannot clean up.
+
+    The result cache is looked up here, so its hits and misses are counted in this process; the
+    child only stores its outputs.  Returns the watchdog's report, or None if the outputs were
+    restored from the cache.
+    '''
+    cache = kwargs.get('cache')
+    keys = cache_keys(zfn, output_files, options or {}, cache, kwargs.get('artifact_fn'))
+    if keys and cache.restore_all(keys, output_files or [None]):
+        return None
+    workdir = tempfile.mkdtemp(prefix="ocw2edx_budget", dir=scratch_dir)
+    try:
+        return watchdog.run(zfn, convert, zfn, output_files, options, scratch_dir=workdir, keys=keys, **kwargs)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def cache_keys(zfn, output_files, options, cache, artifact_fn=None):
+    '''
+    Result cache keys for the outputs of converting zfn (one per output file), or [] if the cache is not
+    used (no cache, input not a zip file, or an artifact is wanted, which needs a conversion)
+    '''
+    if cache is None or not zfn.endswith(".zip") or artifact_fn:
+        return []
+    return [cache.make_key(zfn, dict(options, output_format=ResultCache.output_format(ofn or ".xml")), OCWCourse.Version)
+            for ofn in output_files or [None]]
+
+
+def convert(zfn, output_files=None, options=None, cache=None, keys=None, **kwargs):
+    '''
+    Convert one OCW zip file (or content directory) to output_files (list of output filenames; default
+    is an xbundle file named after the course), or restore all the outputs from the result cache, if
+    it has them.
+
+    options = dict of conversion options (include_media, video_start_offset, compact_olx, and optimize_images
+              with image_threshold in KB and image_max_size in pixels), part of the cache key
+    keys = result cache keys of the outputs, if the cache was already looked up (see run_with_watchdog):
+           the outputs are then only stored in the cache
+    kwargs = further OCWCourse arguments
+
+    Returns the OCWCourse instance, or None if the outputs were restored from the cache.
+    '''
+    options = options or {}
+    if keys is None:
+        keys = cache_keys(zfn, output_files, options, cache, kwargs.get('artifact_fn'))
+        if keys and cache.restore_all(keys, output_files or [None]):
+            return None
+    course_options = dict(options)
+    if course_options.pop('optimize_images', None):
+        course_options['optimize_images'] = ImageOptimizer(threshold=course_options.pop('image_threshold', 200) * 1024,
+                                                           max_dimension=course_options.pop('image_max_size', 1600))
+    ocwc = OCWCourse(fn=zfn, ofn=output_files, **dict(course_options, **kwargs))
+    ocwc.process()
+    for key, outfn in zip(keys, ocwc.outfns):
+        cache.store(key, outfn, static_files=ocwc.files_to_copy.values())
+    return ocwc
+
+
+def WatchCommandLine(args):
+    '''
+    Watch a directory, converting OCW zip files which arrive in it (ocw2edx --watch DIR)
+    '''
+    from ocw2edx.service import ConversionService
+    from ocw2edx.watch import FolderWatcher
+
+    cache_size = args.cache_size * 1024 * 1024
+    service = ConversionService(nworkers=args.workers, cache_dir=args.cache_dir, cache_size=cache_size,
+                                scratch_dir=args.scratch_dir)
+    FolderWatcher(args.watch, args.watch_output, service=service).run()
+
+
+def EmitCommandLine(args=None, arglist=None):
+    '''
+    "ocw2edx emit" command line: write output (in any format) from an intermediate course artifact
+    saved by a conversion run with --artifact.
+    '''
+    parser = argparse.ArgumentParser(prog="ocw2edx emit")
+    parser.add_argument("artifact_file_name", help="name of intermediate course artifact file", type=str)
+    parser.add_argument("-o", "--output-file", type=str, help="filename for output file (single-file if ends with .xml, .tar.gz file, directory otherwise)")
+    parser.add_argument("--compact-olx", action="store_true", help="write html and problem files without insignificant whitespace and comments")
+    add_logging_options(parser)
+
+    if not args:
+        args = parser.parse_args(arglist)
+    start_logging(args)
+
+    emit(args.artifact_file_name, args.output_file, compact_olx=args.compact_olx)
+
+
+def ServeCommandLine(args=None, arglist=None):
+    '''
+    "ocw2edx serve" command line: run a long-lived conversion service, accepting jobs over localhost HTTP.
+    '''
+    from ocw2edx.service import ConversionService, is_loopback
+
+    parser = argparse.ArgumentParser(prog="ocw2edx serve")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="loopback address to listen on (default 127.0.0.1); jobs are not authenticated, so other addresses are refused")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default 8765)")
+    parser.add_argument("--workers", type=int, default=2, help="number of conversion jobs run at once (default 2)")
+    parser.add_argument("--cache-dir", type=str, help="directory for cache of conversion results, reused for the same zip file and options")
+    parser.add_argument("--cache-size", type=int, default=2048, help="maximum size of the result cache, in MB (default 2048)")
+    parser.add_argument("--scratch-dir", type=str, help="directory for temporary files (unpacked zip file, staged output), e.g. on a tmpfs")
+    add_logging_options(parser)
+
+    if not args:
+        args = parser.parse_args(arglist)
+        if not is_loopback(args.host):
+            parser.error("--host must be a loopback address (like 127.0.0.1), as jobs are not authenticated")
+    start_logging(args)
+
+    service = ConversionService(nworkers=args.workers, cache_dir=args.cache_dir,
+                                cache_size=args.cache_size * 1024 * 1024, scratch_dir=args.scratch_dir)
+    server = service.make_server(args.host, args.port)
+    log.info("ocw2edx conversion service listening on http://%s:%d/", *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
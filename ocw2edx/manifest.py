@@ -0,0 +1,191 @@
+#!/usr/bin/python
+#
+# Input manifest for incremental reconversion of an OCW course.
+#
+# The manifest is a JSON file recording, for each section of the course
+# (keyed by the section's href in the syllabus), the content hashes of the
+# OCW pages and static assets the section consumed, and the outputs it
+# produced: the edX <sequential> XML, the static files to copy, generated
+# files (caption srt.sjson), and the de-duplication and count bookkeeping.
+#
+# When the course is converted again with the same manifest file, a section
+# whose inputs are unchanged (and which is reached with the same
+# de-duplication state) is restored from the manifest instead of being
+# reconverted.  The manifest also records the conversion options and the
+# converter version; if either differs, nothing in it is reused.
+
+import os
+import json
+import hashlib
+
+from path import path	# needs path.py
+from log import get_logger
+
+log = get_logger("manifest")
+
+#-----------------------------------------------------------------------------
+
+class InputManifest(object):
+    '''
+    Per-course record of section inputs and outputs, for incremental reconversion.
+    '''
+    VERSION = 1
+
+    def __init__(self, fn, course_dir, verbose=True, options=None):
+        '''
+        fn = manifest JSON filename (read if it exists, and written by save())
+        course_dir = OCW course content directory (paths are recorded relative to this)
+        options = dict of the conversion options which affect section outputs, including the
+                  converter version; the previous manifest is only used if they are the same
+        '''
+        self.fn = fn
+        self.course_dir = path(course_dir).abspath()
+        self.verbose = verbose
+        self.options = json.loads(json.dumps(options or {}))	# as it is read back from the file
+        self.previous = {}
+        if fn and os.path.exists(fn):
+            try:
+                data = json.load(open(fn))
+                if data.get('version')==self.VERSION and data.get('options')==self.options:
+                    self.previous = data.get('sections', {})
+                elif data.get('version')==self.VERSION:
+                    log.info("Conversion options or converter version changed since manifest %s was written, "
+                             "converting everything", fn)
+            except Exception as err:
+                log.warning("Cannot read manifest %s, converting everything; error=%s", fn, err)
+        self.sections = {}
+        self.section = None
+        self.n_reused = 0
+        self.n_converted = 0
+
+    @staticmethod
+    def file_digest(fn):
+        sha = hashlib.sha1()
+        with open(fn, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def relpath(self, fn):
+        '''
+        Return fn relative to the course directory, or None if it is outside the course directory
+        '''
+        fn = path(fn).abspath()
+        if not fn.startswith(self.course_dir + os.sep):
+            return None
+        return str(self.course_dir.relpathto(fn))
+
+    def abspath(self, rel):
+        '''
+        Inverse of relpath (absolute paths are returned unchanged)
+        '''
+        if os.path.isabs(rel):
+            return path(rel)
+        return self.course_dir / rel
+
+    def state_digest(self, processed_files, processed_pdf_files, link=None):
+        '''
+        Digest of the state a section starts from: its syllabus link (list of href and text), and
+        the de-duplication state.  A section is only reused if it is reached with the same state
+        as when it was recorded.
+        '''
+        state = [[self.relpath(x) or x for x in processed_files], list(processed_pdf_files), link]
+        return hashlib.sha1(json.dumps(state)).hexdigest()
+
+    #----------------------------------------
+    # recording
+
+    def begin_section(self, key, state):
+        self.section = {'state': state, 'inputs': {}}
+        self.sections[key] = self.section
+
+    def record_input(self, fn):
+        '''
+        Record that the current section read the file fn, or looked for it, if it does not exist
+        (recorded with digest None, so the section is converted again if it appears)
+        '''
+        if self.section is None:
+            return
+        rel = self.relpath(fn)
+        if rel:
+            self.section['inputs'][rel] = self.file_digest(fn) if os.path.exists(fn) else None
+
+    def end_section(self, olx, files, processed_files, processed_pdf_files, counts):
+        '''
+        Record the outputs of the current section.
+
+        olx = XML string for the edX sequential
+        files = dict of static files (source filename -> edX static destination) added by the section
+        processed_files, processed_pdf_files = de-duplication entries added by the section
+        counts = dict of (counter name -> dict of count increments)
+        '''
+        section = self.section
+        section['olx'] = olx
+        section['files'] = []
+        section['generated'] = {}
+        for src, dst in files.items():
+            rel = self.relpath(src)
+            if rel is None:
+                section['files'].append(['lib', str(src), dst])		# part of ocw2edx itself
+            elif rel.startswith('captions/'):
+                section['files'].append(['generated', rel, dst])
+                section['generated'][rel] = open(src).read()
+            else:
+                section['files'].append(['input', rel, dst])
+                self.record_input(src)
+        section['processed_files'] = [self.relpath(x) or x for x in processed_files]
+        section['processed_pdf_files'] = list(processed_pdf_files)
+        section['counts'] = counts
+        self.section = None
+        self.n_converted += 1
+
+    #----------------------------------------
+    # reuse
+
+    def find_reusable(self, key, state):
+        '''
+        Return the previous record for section key, if it can be reused: it was reached with the
+        same de-duplication state, and all its inputs are unchanged (including those which were
+        missing, and must still be missing).  Else return None.
+        '''
+        entry = self.previous.get(key)
+        if not entry or entry.get('state')!=state or 'olx' not in entry:
+            return None
+        for rel, digest in entry['inputs'].items():
+            fn = self.abspath(rel)
+            if digest is None:
+                if os.path.exists(fn):
+                    return None
+            elif not os.path.exists(fn) or self.file_digest(fn)!=digest:
+                return None
+        return entry
+
+    def reuse_section(self, key, entry):
+        '''
+        Carry a reusable previous record forward, and write out its generated files.
+        Returns dict of static files (source filename -> edX static destination) for the section.
+        '''
+        files = {}
+        for kind, src, dst in entry['files']:
+            if kind=='lib':
+                files[path(src)] = dst
+                continue
+            fn = self.abspath(src)
+            if kind=='generated':
+                if not fn.dirname().exists():
+                    os.makedirs(fn.dirname())
+                open(fn, 'w').write(entry['generated'][src])
+            files[fn] = dst
+        self.sections[key] = entry
+        self.n_reused += 1
+        return files
+
+    def save(self):
+        data = {'version': self.VERSION,
+                'options': self.options,
+                'sections': self.sections,
+                }
+        with open(self.fn, 'w') as fp:
+            json.dump(data, fp, indent=1)
+        if self.verbose:
+            log.info("Wrote input manifest %s (%d sections reused, %d converted)", self.fn, self.n_reused, self.n_converted)
@@ -8,96 +8,252 @@ import sys
 import json
 import re
 import codecs
+import logging
 import zipfile
 import shutil
+import time
 import tempfile
-import requests
+import subprocess
+import multiprocessing
+
+from copy import deepcopy
+from contextlib import contextmanager
 
 from srt2sjson import convert2sjson
+from classify import ElementClassifier, SKIP, CONTAINER, LINK
+from embeds import recognize_embed, find_caption_link, sec2code, CAPTION_EMBED_MARKER
+from manifest import InputManifest
+from writer import write_output, copy_static_files
+from artifact import save_artifact
+from scratch import ScratchSpace
+from log import get_logger, Lazy
+from progress import ProgressReporter
+from prefetch import PagePrefetcher
+from images import ImageOptimizer
+from stats import course_statistics
 from lxml import etree
-from lxml.html.soupparser import fromstring as fsbs
 from path import path	# needs path.py
-from jinja2 import Template
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from xml.sax.saxutils import quoteattr
 
 from xbundle import XBundle, DEF_POLICY_JSON, DEF_GRADING_POLICY_JSON
 
 #-----------------------------------------------------------------------------
 
+class CheckedList(list):
+    '''
+    List which logs membership tests, as (name, item, found), and appends, as (name, item, None), to
+    the list checks.  Used for the de-duplication state of a chapter converted in a worker process,
+    so the merge can tell whether the chapter would have come out the same in a serial conversion.
+    '''
+    def __init__(self, items, checks, name):
+        list.__init__(self, items)
+        self.checks = checks
+        self.name = name
+
+    def __contains__(self, item):
+        found = list.__contains__(self, item)
+        self.checks.append((self.name, item, found))
+        return found
+
+    def append(self, item):
+        self.checks.append((self.name, item, None))
+        list.append(self, item)
+
+_chapter_job = None	# in a chapter worker process only: (OCWCourse, chapters, section start indexes,
+			# total sections, state before each chapter), set by _init_chapter_worker
+
+def _init_chapter_worker(job):
+    global _chapter_job
+    _chapter_job = job
+
+def _convert_chapter(k):
+    ocwc, chapters, starts, total, states = _chapter_job
+    return ocwc.convert_chapter(k, chapters, starts, total, states[k])
+
+#-----------------------------------------------------------------------------
+
+ConversionResult = namedtuple('ConversionResult', ['xbundle', 'assets', 'counts'])
+
+#-----------------------------------------------------------------------------
+
 class OCWCourse(object):
     '''
     Convert OpenCourseWare course content data download dump into an edX course XML ("OLX").
     '''
     DefaultSemester = 'course'
     DefaultOrg = "OCW"
+    Version = "0.2"			# part of result cache keys: change whenever the output changes
+    PdfHrefPattern = re.compile(r'''href\s*=\s*["']([^"']+\.pdf)["']''', re.IGNORECASE)
     # DefaultVideoStartPoint = '00:00:20'
     DefaultVideoStartPoint = '00:00:04'
 
     LIBDIR = path(__file__).dirname() / "lib" 
 
-    def __init__(self, fn=None, ofn=None, verbose=True, include_media=True, video_start_offset=0):
+    def __init__(self, fn=None, ofn=None, verbose=True, include_media=True, video_start_offset=0, manifest_fn=None,
+                 artifact_fn=None, scratch_dir=None, scratch_quota=None, caption_cache=None, progress=None,
+                 listeners=None, chapter_workers=1, prefetch_threads=4, optimize_images=False, compact_olx=False,
+                 stats_fn=None):
         '''
         fn = directory of input OCW content files, or input zip filename
-        ofn = edX XML output directory name, or output xbundle XML filename (*.xml), or output .tar.gz filename
+        ofn = edX XML output directory name, or output xbundle XML filename (*.xml), or output .tar.gz filename;
+              or a list of these, to produce several outputs from one conversion
         include_media = boolean: if False, then skip inclusion of media gallery sections (default True)
         video_start_offset = int: number of seconds to skip at start of each video (default 0)
-
-        After instantiating, call process() to generate the output.
+        manifest_fn = input manifest JSON filename: sections whose inputs are unchanged since the
+                      run which wrote the manifest are reused, and the manifest is then rewritten (default None)
+        artifact_fn = filename for intermediate course artifact, from which other output formats can be
+                      made with "ocw2edx emit" (default None)
+        scratch_dir = directory in which to make the scratch space for the unpacked zip file and
+                      staged .tar.gz output, e.g. on a tmpfs (default: system temporary directory)
+        scratch_quota = maximum scratch space usage in bytes (default None: unlimited)
+        caption_cache = CaptionCache shared with other conversions, so caption files are only
+                        retrieved once (default None: always retrieve)
+        progress = ProgressReporter to which conversion progress is reported (default None: not reported)
+        listeners = list of callbacks for conversion events (see add_listener)
+        chapter_workers = number of worker processes converting chapters in parallel (default 1: serial);
+                          the output is the same as for a serial conversion.  Not used with manifest_fn.
+        prefetch_threads = number of threads reading and parsing section and media pages ahead of their
+                           conversion (default 4; 0 to parse each page only when it is converted)
+        optimize_images = if True, or an ImageOptimizer, recompress and downscale large images, and resize
+                          the course image (needs Pillow; default False)
+        compact_olx = if True, write html and problem files without insignificant whitespace and comments
+        stats_fn = filename to which course statistics (element counts, and static bytes, PDFs, videos, and
+                   caption bytes of each chapter and sequential; see stats.py) are written, as JSON (default None)
+
+        After instantiating, call process() to generate the output.  The scratch space is removed
+        when process() returns or fails; if process() is not called, call cleanup(), or use the
+        instance as a context manager.
+
+        To use the converted course in memory, without writing any output, call convert() instead
+        of process(), within a with block (see convert).
         '''
         self.verbose = verbose
+        self.curdir = os.path.abspath(os.curdir)	# relative filenames are relative to this
         self.include_media = include_media
         self.DefaultVideoStartPoint = "00:00:%02d" % int(video_start_offset)
-
-        if self.verbose:
-            print "=" * 77
-            print "Processing input OCW course data file %s" % fn
-            sys.stdout.flush()
-        self.do_delete_dir = False
+        self.manifest_fn = self.abspath(manifest_fn)
+        self.manifest = None
+        self.artifact_fn = self.abspath(artifact_fn)
+        self.caption_cache = caption_cache
+        self.progress = progress or ProgressReporter()
+        self.listeners = [(callback, None) for callback in listeners or []]
+        self.chapter_workers = chapter_workers
+        self.prefetch_threads = prefetch_threads
+        self.prefetcher = None
+        self.optimize_images = optimize_images
+        self.compact_olx = compact_olx
+        self.image_report = None
+        self.stats_fn = self.abspath(stats_fn)
+        self.stats = None
+        self.log = get_logger("convert", min_level=(logging.NOTSET if verbose else logging.WARNING), input=str(fn))
+
+        self.log.info("Processing input OCW course data file %s", fn)
+        self.scratch = ScratchSpace(self.abspath(scratch_dir), quota=scratch_quota)
 
         if fn.endswith(".zip"):
             self.dir = None
-            tmp_dpath = tempfile.mkdtemp(prefix="tmp_ocw2edx")
-            zf = zipfile.ZipFile(fn)
-            zf.extractall(tmp_dpath)
-            # get course directory within zipfile
-            for dfn in os.listdir(tmp_dpath):
-                if os.path.isdir(path(tmp_dpath) / dfn):
-                    self.dir = path(tmp_dpath) / dfn
-            if not self.dir:
-                raise Exception("[OCWCourse] Failed to get course directory for unpacked ZIP file %s, located in %s" % (fn, tmp_dpath))
-            self.do_delete_dir = True
+            try:
+                tmp_dpath = self.scratch.root
+                with self.stage('unpack'):
+                    zf = zipfile.ZipFile(self.abspath(fn))
+                    self.scratch.reserve(sum(x.file_size for x in zf.infolist()))
+                    zf.extractall(tmp_dpath)
+                # get course directory within zipfile
+                for dfn in os.listdir(tmp_dpath):
+                    if os.path.isdir(path(tmp_dpath) / dfn):
+                        self.dir = path(tmp_dpath) / dfn
+                if not self.dir:
+                    raise Exception("[OCWCourse] Failed to get course directory for unpacked ZIP file %s, located in %s" % (fn, tmp_dpath))
+            except Exception:
+                self.cleanup()
+                raise
+        else:
+            self.dir = path(self.abspath(fn))
+        if isinstance(ofn, (list, tuple)):
+            self.output_fns = [self.abspath(x) for x in ofn]
         else:
-            self.dir = path(dir)
-        self.output_fn = ofn
+            self.output_fns = [self.abspath(ofn)] if ofn else []
+
+    def abspath(self, fn):
+        '''
+        Absolute filename for fn, taken relative to the directory current when this instance was made
+        '''
+        if fn is None:
+            return None
+        return os.path.join(self.curdir, fn)
+
+    def cleanup(self):
+        '''
+        Remove the scratch space (including the unpacked zip file), reporting its high water mark
+        '''
+        if self.scratch.root is None:
+            return
+        self.scratch.close()
+        self.log.info("Scratch space high water mark: %d bytes", self.scratch.high_water)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
 
     def process(self):
         '''
         Process input file, and generate output xbundle or OLX in directory
         '''
-        if not os.path.exists(self.dir / 'contents/Syllabus'):
-            if os.path.exists(self.dir / 'contents/syllabus'):
-                os.symlink('syllabus', self.dir / 'contents/Syllabus')
-                print "Made a symlink from contents/syllabus to contents/Syllabus"
-
-        self.indexfn = self.dir / 'contents/Syllabus/index.htm'
-        if self.verbose:
-            print "...Parsing index.htm.xml"
-            sys.stdout.flush()
-        self.index_xml = etree.parse(self.dir / 'contents/index.htm.xml').getroot()
-        if self.verbose:
-            print "...Parsing metadata"
-            sys.stdout.flush()
-        self.meta = self.get_metadata()
-        if self.verbose:
-            print "...Constructing policies"
-            sys.stdout.flush()
-        self.policies = self.get_policies(self.meta)
-        if self.verbose:
-            print "...Exporting OLX data"
-            sys.stdout.flush()
+        try:
+            self.do_process()
+        except Exception:
+            self.progress.failed()
+            raise
+        finally:
+            self.cleanup()
+
+    def do_process(self):
+        self.convert()
         self.export()
 
+    def add_listener(self, callback, events=None):
+        '''
+        Register callback(event, data) to be called for conversion events (all of them, or just those
+        in the list events).  The events, and the keys of their data dicts, are:
+
+          section_started   chapter, display_name, href, index, total
+          asset_discovered  source, path   (static file source filename, and edX static path "static/...";
+                                            the source file exists when the event is sent, and a later event
+                                            for the same source supersedes an earlier one)
+          caption_fetched   url, ytid, source, path
+          stage_started     stage
+          stage_timing      stage, seconds
+          page_started      fn   (OCW page about to be converted, relative to the course directory)
+        '''
+        self.listeners.append((callback, events))
+
+    def emit(self, event, **data):
+        for callback, events in self.listeners:
+            if events is None or event in events:
+                callback(event, data)
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager timing a stage of the conversion, reported as stage_started and stage_timing events
+        '''
+        self.emit('stage_started', stage=name)
+        start = time.time()
+        yield
+        self.emit('stage_timing', stage=name, seconds=time.time() - start)
+
+    def add_asset(self, src, dst):
+        '''
+        Add static file src, to be copied to edX static path dst
+        '''
+        if self.files_to_copy.get(src)!=dst:
+            self.files_to_copy[src] = dst
+            if self.listeners:
+                self.emit('asset_discovered', source=src, path=dst)
+
     @staticmethod
     def parse_broken_html(xmlstr=None, fn=None, parser_type='html', parser=None):
         '''
@@ -110,11 +266,57 @@ class OCWCourse(object):
                 raise Exception("ERROR!  Missing OCW content file %s" % fn)
         xmlstr = xmlstr or open(fn).read()
         if parser_type=="bs":
+            from lxml.html.soupparser import fromstring as fsbs	# imports BeautifulSoup: only when needed
             return fsbs(xmlstr)
         elif parser_type=="html":
             parser = parser or etree.HTMLParser()
             return etree.fromstring(xmlstr, parser=parser)
 
+    def parse_page(self, fn):
+        '''
+        Parse an OCW content page, recording it as an input of the current section if keeping a manifest.
+        '''
+        if self.manifest is not None:
+            self.manifest.record_input(fn)
+        if self.listeners:
+            self.emit('page_started', fn=os.path.relpath(fn, self.dir))
+        if self.prefetcher is not None:
+            return self.prefetcher.get(fn)
+        return self.parse_broken_html(fn=fn)
+
+    @contextmanager
+    def prefetching(self, atags):
+        '''
+        Context manager prefetching the section pages linked by atags (and the media pages of their
+        media galleries, as they are reached), in a PagePrefetcher, while they are converted
+        '''
+        if not self.prefetch_threads:
+            yield
+            return
+        self.prefetcher = PagePrefetcher(lambda fn: self.parse_broken_html(fn=fn), nthreads=self.prefetch_threads)
+        try:
+            self.prefetcher.prefetch([self.get_xml_fn_from_href(atag.get('href')) for atag in atags])
+            yield
+        finally:
+            self.log.debug("Prefetched pages: %d used, %d parsed on demand", self.prefetcher.hits, self.prefetcher.misses)
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    @staticmethod
+    def fetch_caption(url):
+        '''
+        Retrieve srt caption file from url, and return its contents
+        '''
+        import requests		# slow to import, and not needed by conversions without captions
+        try:
+            ret = requests.get(url)
+        except Exception as err:
+            get_logger("convert").error("Failed to get caption file from url %s, error=%s", url, err)
+            raise
+        if not ret.status_code==200:
+            raise Exception("[OCWCourse.get_caption_file] Failed to retrieve %s" % url)
+        return ret.content
+
     def get_caption_file(self, url, ytid=None):
         '''
         Retrieve srt caption file from OCW, convert to sjson, and store in static
@@ -125,31 +327,28 @@ class OCWCourse(object):
         '''
         srtfn = os.path.basename(url)
         file_ytid = srtfn[:-4]
-        try:
-            ret = requests.get(url)
-        except Exception as err:
-            print "ERROR!  Faild to get caption file from url %s" % url
-            print "Error=%s" % str(err)
-            raise
-        if not ret.status_code==200:
-            raise Exception("[OCWCourse.get_caption_file] Failed to retrieve %s" % url)
+        if self.caption_cache is not None:
+            content = self.caption_cache.get(url, self.fetch_caption)
+        else:
+            content = self.fetch_caption(url)
         sdir = self.dir / "captions"
         if not sdir.exists():
             os.mkdir(sdir)
         srtfn = sdir / srtfn
         with open(srtfn, 'w') as fp:
-            fp.write(ret.content)
+            fp.write(content)
+        self.progress.caption_fetched()
         convert2sjson(srtfn, verbose=False)	# generate srt.sjson 
         sjfn = srtfn + ".sjson"        
         efn = "static/subs_%s" % sjfn.basename()
         if ytid is not None:
             yt_efn = "static/subs_%s.srt.sjson" % ytid
             if efn != yt_efn:
-                print "        Caption file is named %s, but has ytid %s, so using for edx %s" % (sjfn.basename(), ytid, yt_efn)
+                self.log.debug("        Caption file is named %s, but has ytid %s, so using for edx %s", sjfn.basename(), ytid, yt_efn)
                 efn = yt_efn
-        self.files_to_copy[sjfn] = efn
-        if self.verbose:
-            print "        Got caption file %s -> %s" % (sjfn, efn)
+        self.add_asset(sjfn, efn)
+        self.emit('caption_fetched', url=url, ytid=ytid, source=sjfn, path=efn)
+        self.log.debug("        Got caption file %s -> %s", sjfn, efn)
         return efn
 
     def fix_static(self, s):
@@ -162,11 +361,11 @@ class OCWCourse(object):
         if '#' in s and s.count('#')==1:
             sclean = s.split('#')[0]
         if s.startswith("/static"):
-            print "        URL %s already is in /static, not fixing" % s
+            self.log.debug("        URL %s already is in /static, not fixing", s)
             return s
         m = re.match('[\./]+/(contents|common|[^/ ]+)/.*', sclean)
         if not m:
-            print "      WARNING: unknown static file path %s" % s
+            self.log.warning("unknown static file path %s", s)
             return s
         prefix = m.group(1)
         newpath = re.sub('[\./]+/%s/' % prefix, '/static/', sclean)
@@ -174,12 +373,14 @@ class OCWCourse(object):
             spath = self.dir / prefix + newpath[7:]
             epath = newpath[1:]
             if not os.path.exists(spath):	# source path doesn't exist!
-                print "      ERROR: missing file %s (for %s)" % (spath, epath)
+                self.log.error("missing file %s (for %s)", spath, epath)
+                if self.manifest is not None:
+                    self.manifest.record_input(spath)	# so the section is converted again if it appears
                 return ""
-            self.files_to_copy[spath] = epath
+            self.add_asset(spath, epath)
             return newpath
         else:
-            print "    ERROR: failed static path %s -> new path %s" % (s, newpath)
+            self.log.error("failed static path %s -> new path %s", s, newpath)
         return s
 
 
@@ -190,13 +391,11 @@ class OCWCourse(object):
 
         Also fix any src in <script> elements
         '''
-        #print "elem: %s" % elem
         for a in elem.findall('.//a'):
             href = self.fix_static(a.get('href',''))
             if href:
                 a.set('href',href)
         for img in elem.findall('.//img'):
-            print "      img: %s" % etree.tostring(img)
             src = self.fix_static(img.get('src',''))
             if src:
                 img.set('src',src)
@@ -210,16 +409,16 @@ class OCWCourse(object):
             src = self.fix_static(script.get('src',''))
             for pat in js_to_drop:
                 if re.match(pat, src):
-                    print "        WARNING: <script> asks for src=%s, which breaks things - dropping!" % (src)
+                    self.log.warning("<script> asks for src=%s, which breaks things - dropping!", src)
                     script.getparent().remove(script)
                     ndrop += 1
                     continue
             if src:
                 script.set('src', src)
             if script.text and '\r' in script.text:
-                print "        WARNING: javascript has ^M in it - trying to fix"
+                self.log.warning("javascript has ^M in it - trying to fix")
                 script.text = script.text.replace('\r', '')
-        print "        Found and fixed %d javascript sections; dropped %d sections" % (njs, ndrop)
+        self.log.debug("        Found and fixed %d javascript sections; dropped %d sections", njs, ndrop)
     
     def add_video_to_vert_from_popup(self, vxml, vert):
         '''
@@ -245,8 +444,7 @@ class OCWCourse(object):
         aelem = etree.SubElement(html, 'a')
         aelem.set('href', newpath)
         aelem.text = text
-        if self.verbose:
-            print "      html link: %s = %s" % (dn, newpath)
+        self.log.debug("      html link: %s = %s", dn, newpath)
 
     def add_text_to_vert(self, text_elem, vert):
         '''
@@ -254,8 +452,7 @@ class OCWCourse(object):
         '''
         textstr = etree.tostring(text_elem)
         html = etree.XML('<html>%s</html>' % (textstr))
-        if self.verbose:
-            print "      short html: %s" % (textstr)
+        self.log.debug("      short html: %s", textstr)
         vert.append(html)
 
     def add_contents_to_vert(self, vxml, vert):
@@ -273,7 +470,7 @@ class OCWCourse(object):
         # otherwise follow the href link and process the file
         href = vxml.get('href')
         if href is None or not href:
-            print "        ERROR: missing link in content %s" % etree.tostring(vxml)
+            self.log.error("missing link in content %s", Lazy(etree.tostring, vxml))
             return self.add_text_to_vert(vxml, vert)
 
         if href.startswith('http://www.youtube.com/watch') or href.startswith('https://www.yotube.com/watch'):
@@ -287,7 +484,7 @@ class OCWCourse(object):
             aelem = etree.SubElement(html, 'a')
             aelem.set('href', href)
             aelem.text = vxml.text
-            print "        External link %s -> %s" % (aelem.text, href)
+            self.log.debug("        External link %s -> %s", aelem.text, href)
             return
 
         vfn = re.sub('[\./]+/contents/','contents/', href)
@@ -298,8 +495,7 @@ class OCWCourse(object):
                 else:
                     self.add_pdf_vertical(vxml.text, href, None, None, vert=vert)	# use viewer, not just a link
             except Exception as err:
-                print "Error adding pdf link in vertical, vfn=%s, text=%s" % (vfn, vxml.text)
-                print "error=%s" % str(err)
+                self.log.error("Error adding pdf link in vertical, vfn=%s, text=%s, error=%s", vfn, vxml.text, err)
             return
 
         if vfn.endswith('.srt'):
@@ -308,9 +504,9 @@ class OCWCourse(object):
         # process html file
         try:
             fn = self.dir / vfn
-            vcontents = self.parse_broken_html(fn=fn)
+            vcontents = self.parse_page(fn)
         except Exception as err:
-            print "      ERROR reading %s: %s" % (fn, err)
+            self.log.error("reading %s: %s", fn, err)
             return
         html = etree.SubElement(vert,'html')
         html.set('display_name',vert.get('display_name','Page'))
@@ -318,18 +514,18 @@ class OCWCourse(object):
         if nav is None:
             nav = self.robust_get_main(fn, vcontents, "course_inner_section")
         if nav is None:
-            print "        ERROR: missing div parent-fieldname-text for nav in %s" % fn
+            self.log.error("missing div parent-fieldname-text for nav in %s", fn)
             return
         for p in nav:
             # print etree.tostring(p,pretty_print=True)
-            if p.get('class','') in ['sc_nav', 'sc_nav_bottom']:
-                continue
-            elif etree.tostring(p).startswith('<p>&#160;</p>'):
+            if self.classifier.classify(p)==SKIP:
                 continue
             else:
+                p = self.copy_fragment(p)
                 self.do_href(p)
                 # print etree.tostring(p)
                 html.append(p)
+        self.release_tree(vcontents)
     
         vidclasses = ['embedbg','inline-video']
         for vc in vidclasses:
@@ -354,13 +550,13 @@ class OCWCourse(object):
         else:
             title = prev.text
         if not title:
-            print "        WARNING: missing title for video for %s" % etree.tostring(embedbg)
+            self.log.warning("missing title for video for %s", Lazy(etree.tostring, embedbg))
             title = ""
         
         # get the youtube ID
         script = embedbg.find('.//script')
         if script is None:
-            print "oops, no script?  embedbg=%s" %  etree.tostring(embedbg)
+            self.log.warning("oops, no script?  embedbg=%s", Lazy(etree.tostring, embedbg))
             return
         else:
             self.add_video_from_script_element(title, script, vert)
@@ -375,23 +571,22 @@ class OCWCourse(object):
         # get the caption file from the first script
         script1 = main_elem.find('.//script')
         if script1 is None:
-            print "oops, no script?  main_elem=%s" %  etree.tostring(main_elem)
+            self.log.warning("oops, no script?  main_elem=%s", Lazy(etree.tostring, main_elem))
             return
-        stext = etree.tostring(script1)
-        if not "caption_embed" in stext:
-            print "oops, was expecting caption link in %s" % stext
+        extra_dict = {}
+        stext = script1.text or ""
+        if not CAPTION_EMBED_MARKER in stext:
+            self.log.warning("oops, was expecting caption link in %s", stext)
         else:
-            m = re.search("'(/courses/[^ ]+.srt)'", stext)
-            if not m:
-                print "missing caption for main_elem=%s" %  etree.tostring(main_elem)
-                extra_dict = {}
+            caption_url = find_caption_link(stext)
+            if not caption_url:
+                self.log.warning("missing caption for main_elem=%s", Lazy(etree.tostring, main_elem))
             else:
-                caption_url = "https://ocw.mit.edu" + m.group(1)
-                extra_dict = {'caption_url': caption_url}
+                extra_dict['caption_url'] = caption_url
 
         script = main_elem.findall('.//script')[1]
         if script is None:
-            print "oops, no script?  main_elem=%s" %  etree.tostring(main_elem)
+            self.log.warning("oops, no script?  main_elem=%s", Lazy(etree.tostring, main_elem))
             return
         else:
             self.add_video_from_script_element(title, script, vert, extra_dict)
@@ -405,45 +600,27 @@ class OCWCourse(object):
         '''
         extra_dict = extra_dict or {}
         element_text = element_text or script.text
+        embed = recognize_embed(element_text)
 
         if not ytid:
-            m = re.search("http[s]*://www.youtube.com/v/([^']+)'", element_text)
-            if not m:
-                print "oops, cannot find youtube id in %s" % element_text
+            ytid = embed.ytid
+            if not ytid:
+                self.log.warning("oops, cannot find youtube id in %s", element_text)
                 return
-            ytid = m.group(1)
 
         video = etree.SubElement(vert,'video')
         video.set('youtube','1.0:%s' % ytid)
         video.set('from', self.DefaultVideoStartPoint)
 
-        m = re.search('load_multiple_media_chapter\(.*,\s*([ 0-9]+),\s*([ 0-9]+),\s*(null|.*\.srt\')\);*', element_text)
-        if not m:
-            m = re.search('scholar_video_popup\(.*,\s*([ 0-9]+),\s*([ 0-9]+),\s*(null|.*\.srt\')\);*', element_text)
-        if not m:
-            m = re.search('ocw_embed_chapter_media\(.*,\s*([ 0-9]+),\s*([ 0-9]+),\s*(null|.*\.srt\')\);*', element_text)
-        if not m:
-            m = re.search('[a-z]+\(.*,\s*([ 0-9]+),\s*([ 0-9]+),\s*(null|.*\.srt\')\);', element_text)
-        if m:
-            # print "    ", popup
-            def sec2code(secstr):
-                sec = int(secstr.strip())
-                c = '%02d:%02d:%02d' % (sec/3600, (sec/60)%60, sec%60)
-                # print "      %s (%s) -> %s" % (secstr, sec, c)
-                return c
-            if m.group(2) != "0":
-                video.set('from',sec2code(m.group(1)))
-                video.set('to',sec2code(m.group(2)))
-            caption_url = m.group(3)
-            if caption_url.startswith("'"):
-                caption_url = caption_url[1:-1]
-            if not caption_url=="null":
-                if not caption_url.startswith("http"):
-                    caption_url = "https://ocw.mit.edu" + caption_url
-                extra_dict['caption_url'] = caption_url
+        if embed.call:
+            if embed.end is not None:
+                video.set('from',sec2code(embed.start))
+                video.set('to',sec2code(embed.end))
+            if embed.caption_url:
+                extra_dict['caption_url'] = embed.caption_url
         else:
-            if self.verbose and 'caption_url' not in extra_dict:
-                print "        no caption found in %s" % element_text
+            if 'caption_url' not in extra_dict:
+                self.log.debug("        no caption found in %s", element_text)
 
         if 'caption_url' in extra_dict:
             if extra_dict['caption_url']=="null":
@@ -457,13 +634,10 @@ class OCWCourse(object):
         #video.set('display_name','Video: ' + vert.get('display_name','Page'))
         video.set('display_name','Video: ' + title)
 
-        if self.verbose:
-            print "      video: %s = %s" % (ytid, title)
-            if 'caption_url' in extra_dict:
-                print "          captions: %s (%s)" % (srtfn, extra_dict['caption_url'])
-            if self.verbose > 1:
-                print "        (%s) %s" % (vert.get('display_name'), etree.tostring(video))
-            # print etree.tostring(html)
+        self.log.debug("      video: %s = %s", ytid, title)
+        if 'caption_url' in extra_dict:
+            self.log.debug("          captions: %s (%s)", srtfn, extra_dict['caption_url'])
+        self.log.debug("        (%s) %s", vert.get('display_name'), Lazy(etree.tostring, video))
     
     
     def get_xml_fn_from_href(self, href):
@@ -473,8 +647,12 @@ class OCWCourse(object):
         sfn = href.replace('../../','')
         xmlfn = self.dir / sfn
         if not os.path.exists(xmlfn):
+            if self.manifest is not None:
+                self.manifest.record_input(xmlfn)	# the result depends on its absence
             sfn = href.replace('../','')
             xmlfn = self.dir / sfn
+            if self.manifest is not None and not os.path.exists(xmlfn):
+                self.manifest.record_input(xmlfn)
         return xmlfn
 
     def process_media_gallery(self, title, display_name, ocw_xml, seq):
@@ -483,35 +661,45 @@ class OCWCourse(object):
         '''
         nav = ocw_xml
         self.element_counts['media_gallery'] += 1
-        for div in nav:				# include all content in the HTML as an introduction
-            if div.get('class','') in ['media_rss_link']:
-                continue
-            elif div.get('class','') in ['medialisting']:
-                # embedded media listing video
-                aelem = div.find('.//a')
-                href = aelem.get('href')
-                xmlfn = self.get_xml_fn_from_href(href)
-                if xmlfn in self.processed_files:
-                    print "--> Already processed file %s, skipping" % xmlfn
-                    return
-                self.processed_files.append(xmlfn)
-                title = aelem.get('title')
-                dn = "Video " + title
-                print "    vertical: ", dn
-                vert = etree.SubElement(seq,'vertical')
-                vert.set('display_name',dn)
-                self.process_course_inner_media(title, xmlfn, vert)
+        media_fns = []
+        if self.prefetcher is not None:
+            aelems = [div.find('.//a') for div in nav if div.get('class','')=='medialisting']
+            media_fns = [self.get_xml_fn_from_href(a.get('href')) for a in aelems if a is not None and a.get('href')]
+            self.prefetcher.prefetch(media_fns, urgent=True)
+        try:
+            for div in nav:				# include all content in the HTML as an introduction
+                if div.get('class','') in ['media_rss_link']:
+                    continue
+                elif div.get('class','') in ['medialisting']:
+                    # embedded media listing video
+                    aelem = div.find('.//a')
+                    href = aelem.get('href')
+                    xmlfn = self.get_xml_fn_from_href(href)
+                    if xmlfn in self.processed_files:
+                        self.log.debug("--> Already processed file %s, skipping", xmlfn)
+                        return
+                    self.processed_files.append(xmlfn)
+                    title = aelem.get('title')
+                    dn = "Video " + title
+                    self.log.debug("    vertical: %s", dn)
+                    vert = etree.SubElement(seq,'vertical')
+                    vert.set('display_name',dn)
+                    self.process_course_inner_media(title, xmlfn, vert)
+        finally:
+            if media_fns:
+                self.prefetcher.discard(media_fns)	# pages not used
 
     def process_course_inner_media(self, title, fn, vert):
         '''
         Digest single OCW media file and process as video for edX XML
         '''
-        cxml = self.parse_broken_html(fn=fn)
+        cxml = self.parse_page(fn)
         main = cxml.find('.//main[@id="course_inner_media"]')
         if main is None:
-            print "--> Error - no course_inner_media found in file %s" % fn
+            self.log.error("no course_inner_media found in file %s", fn)
             return
         self.add_video_to_vert_from_main(title, main, vert)
+        self.release_tree(cxml)
 
     def process_html(self, title, display_name, ocw_xml, seq, handle_broken_xml=False):
         '''
@@ -523,8 +711,7 @@ class OCWCourse(object):
         self.element_counts['course_inner_section'] += 1
         self.fix_javascript(ocw_xml)
         intro = etree.SubElement(seq, 'html')	# add HTML module in the edX xml tree (should really go in a vertical, for studio, but xbundle fixes)
-        if self.verbose:
-            print '    Adding html: %s' % title
+        self.log.debug('    Adding html: %s', title)
         intro.set('display_name', display_name)
         nav = ocw_xml
         if handle_broken_xml:
@@ -533,13 +720,10 @@ class OCWCourse(object):
                 # try grabbing all <p> from parent
                 nav = [x for x in nav.getparent() if x.tag in ['p', 'div'] ]
         for p in nav:				# include all content in the HTML as an introduction
-            if p.get('class','') in ['sc_nav', 'sc_nav_bottom']:
+            action = self.classifier.classify(p)
+            if action in [SKIP, CONTAINER]:
                 continue
-            elif p.tag in ['main', 'nav']:
-                continue
-            elif etree.tostring(p).startswith('<p>&#160;</p>'):
-                continue
-            elif (p.tag=='blockquote') or (p.tag=='p' and len(p)==1 and p[0].tag=='a'):
+            elif action==LINK:
                 # embedded video or other content ; make this a separate module
                 # if single link, likely a PDF
                 for a in p.findall('.//a'):
@@ -549,12 +733,13 @@ class OCWCourse(object):
                     toskip = ['iTunes U', 'Internet Archive', 'Removed Clips' ]
                     if any((x in dn) for x in toskip):
                         continue
-                    print "    vertical: ", dn
+                    self.log.debug("    vertical: %s", dn)
                     vert = etree.SubElement(seq,'vertical')
                     vert.set('display_name',dn)
                     self.add_contents_to_vert(a, vert)
                     self.process_edx_xml_for_local_pdf_links(vert, seq)
             else:
+                p = self.copy_fragment(p)
                 self.do_href(p)
                 intro.append(p)
         if len(intro)==0:
@@ -576,7 +761,6 @@ class OCWCourse(object):
         for aelem in xml.findall('.//a'):
             n_links += 1
             href = aelem.get('href')
-            print "           link: %s (%s)" % (aelem.text, href)
             if not href:
                 continue
             if not href.lower().endswith(".pdf"):
@@ -590,9 +774,10 @@ class OCWCourse(object):
             self.add_pdf_vertical(title, href, aelem, seq)
             aelem.set("pdf_processed", "1")				# so it isn't done again
             n_added += 1
-        if 1 or n_found:
-            print "        [%s] Found %s links, %s are local PDF, %d new ones added as vertical pages" % (dn, n_links, n_found, n_added)
-            
+        if n_found:
+            self.log.debug("        [%s] Found %s links, %s are local PDF, %d new ones added as vertical pages",
+                           dn, n_links, n_found, n_added)
+
 
     def process_html_intro_for_table_of_pdf_files(self, intro_xml, seq):
         '''
@@ -622,7 +807,7 @@ class OCWCourse(object):
             nrows += 1
             rtstrings = [x.text for x in tr.findall("td") if x.text is not None]
             if not rtstrings:
-                print "        Warning: empty row text"
+                self.log.warning("empty row text")
                 rowtext = ""
             else:
                 rowtext = (' '.join(rtstrings)).strip()
@@ -637,21 +822,21 @@ class OCWCourse(object):
                 aelem.set("pdf_processed", "1")				# so it isn't done again
                 nadded += 1
         summary = table.get('summary')
-        print "        Found table '%s' of PDFs, with %d rows: added %d pdf vertical pages" % (summary, nrows, nadded)
+        self.log.debug("        Found table '%s' of PDFs, with %d rows: added %d pdf vertical pages", summary, nrows, nadded)
 
     def add_javascript_file(self, jsfn):
         '''
         '''
         fnp = self.LIBDIR / jsfn
         if not fnp in self.files_to_copy:
-            self.files_to_copy[fnp] = "static/js/%s" % jsfn
+            self.add_asset(fnp, "static/js/%s" % jsfn)
 
     def add_css_file(self, cssfn):
         '''
         '''
         fnp = self.LIBDIR / cssfn
         if not fnp in self.files_to_copy:
-            self.files_to_copy[fnp] = "static/css/%s" % cssfn
+            self.add_asset(fnp, "static/css/%s" % cssfn)
 
     # PDF_VIEWER_TEMPLATE = path(__file__).dirname() / "lib" / "viewer.html"
     # PDF_VIEWER_TEMPLATE = path(__file__).dirname() / "lib" / "viewer_simple.html"
@@ -661,6 +846,20 @@ class OCWCourse(object):
     # PDF_VIEWER_CSS = [ "viewer2c.css"]
     PDF_VIEWER_CSS = [ "viewer2e.css"]
 
+    _templates = {}	# compiled templates, kept for the life of the process
+
+    @classmethod
+    def get_template(cls, fn):
+        '''
+        Return compiled jinja2 template from file fn; each template file is only read and compiled once
+        '''
+        tem = cls._templates.get(fn)
+        if tem is None:
+            from jinja2 import Template		# only needed for courses with PDFs
+            tem = Template(codecs.open(fn, encoding="utf8").read())
+            cls._templates[fn] = tem
+        return tem
+
     @staticmethod
     def _escape(s):
         '''
@@ -681,11 +880,11 @@ class OCWCourse(object):
         if local_url.startswith("http"):
             if vert is None:
                 vert = etree.SubElement(seq, 'vertical')
-            print "        Using link - PDF is not local: %s" % local_url
+            self.log.debug("        Using link - PDF is not local: %s", local_url)
             self.add_pdf_link_to_vert(local_url, title, vert)
             return 
         if url in self.processed_pdf_files:
-            print "        Already processed PDF file %s - skipping" % url
+            self.log.debug("        Already processed PDF file %s - skipping", url)
             return
         self.processed_pdf_files.append(url)
         self.element_counts['pdf_file'] += 1
@@ -710,30 +909,28 @@ class OCWCourse(object):
         problem.set("pdf_title", title)
 
         if 1:
-            tem = codecs.open(self.PDF_VIEWER_TEMPLATE, encoding="utf8").read()
             context = {"pdf_file_url": url,
                        "title": self._escape(title),
                        "display_name": self._escape(dn),
                        }
             try:
-                viewer_html = Template(tem).render(**context)
+                viewer_html = self.get_template(self.PDF_VIEWER_TEMPLATE).render(**context)
             except Exception as err:
-                print "Oops, cannot properly format PDF viewer template %s" % self.PDF_VIEWER_TEMPLATE
-                print "Error %s" % str(err)
-                print "context: ", json.dumps(context, indent=4)
+                self.log.error("Oops, cannot properly format PDF viewer template %s, error=%s, context=%s",
+                               self.PDF_VIEWER_TEMPLATE, err, context)
                 raise
     
             try:
                 viewer_xml = etree.fromstring(viewer_html)
             except Exception as err:
-                print "Oops, failed to properly generate PDF viewer XML from HTML, err=%s" % err
-                print "html = %s" % viewer_html
+                self.log.error("Oops, failed to properly generate PDF viewer XML from HTML, err=%s, html=%s", err, viewer_html)
                 raise
             text.append(viewer_xml)
+            self.progress.pdf_rendered()
             self.add_javascript_file(self.PDF_VIEWER_JS)
             for fn in self.PDF_VIEWER_CSS:
                 self.add_css_file(fn)
-            print "        Added PDF viewer title '%s' for file %s" % (dn, url)
+            self.log.debug("        Added PDF viewer title '%s' for file %s", dn, url)
 
     def robust_get_main(self, fn, ocw_xml, idname, tags=None):
         '''
@@ -754,15 +951,28 @@ class OCWCourse(object):
         if elem is None:
             return None
         if len(elem)==0:
-            if self.verbose:
-                print "        Warning - badly formatted XML in file %s for %s" % (fn, etree.tostring(elem))
-                sys.stdout.flush()
+            self.log.warning("badly formatted XML in file %s for %s", fn, Lazy(etree.tostring, elem))
             elem = elem.getparent()
-            if self.verbose:
-                print "            Using parent %s instead - has %d children" % (elem.tag, len(elem))
-                sys.stdout.flush()
+            self.log.debug("            Using parent %s instead - has %d children", elem.tag, len(elem))
         return elem
 
+    @staticmethod
+    def copy_fragment(elem):
+        '''
+        Return a copy of an element from a parsed OCW page, for inclusion in the edX tree.
+        Copying (rather than moving) the element means the OCW page can be released
+        as soon as the section has been converted.
+        '''
+        return deepcopy(elem)
+
+    @staticmethod
+    def release_tree(xml):
+        '''
+        Free the contents of a parsed OCW page, once all fragments needed have been copied out.
+        '''
+        if xml is not None:
+            xml.clear()
+
     def do_verticals(self, sxml, seq):
         '''
         Create vertical and fill up with contents of a section of a chapter.
@@ -775,14 +985,21 @@ class OCWCourse(object):
         href = sxml.get('href')
         xmlfn = self.get_xml_fn_from_href(href)
         if xmlfn in self.processed_files:
-            print "--> Already processed file %s, skipping" % xmlfn
+            self.log.debug("--> Already processed file %s, skipping", xmlfn)
             return
         self.processed_files.append(xmlfn)
-        display_name = "Introduction"
 
-        print "  Reading vertical from file %s" % xmlfn
-        v = self.parse_broken_html(fn=xmlfn)	# load in the section HTML file
+        self.log.debug("  Reading vertical from file %s", xmlfn)
+        v = self.parse_page(xmlfn)	# load in the section HTML file
+        try:
+            self.do_verticals_from_page(xmlfn, v, seq)
+        finally:
+            self.release_tree(v)		# nothing in the edX tree refers to the OCW page any more
 
+    def do_verticals_from_page(self, xmlfn, v, seq):
+        '''
+        Fill up the sequential seq from the parsed OCW section page v (read from file xmlfn).
+        '''
         title = v.find('.//span[@id="parent-fieldname-title"]') 
         display_name = title.text.strip()
 
@@ -802,10 +1019,75 @@ class OCWCourse(object):
                 found_elements.append("media")
 
         if not found_elements:
-            print "    Oops, no sub-elements (parent-fieldname-text or course_inner_section) found for vertical in %s" % xmlfn
+            self.log.warning("no sub-elements (parent-fieldname-text or course_inner_section) found for vertical in %s", xmlfn)
             return
 
     
+    def get_counts(self):
+        '''
+        Return snapshot of all the conversion counters
+        '''
+        return {'element_counts': dict(self.element_counts),
+                'classifier': dict(self.classifier.counts),
+                }
+
+    def add_counts(self, counts):
+        '''
+        Add count increments (as from count_changes) to the conversion counters
+        '''
+        for name, counter in [('element_counts', self.element_counts), ('classifier', self.classifier.counts)]:
+            for k, v in counts.get(name, {}).items():
+                counter[k] += v
+
+    def count_changes(self, before):
+        '''
+        Return count increments since the snapshot before
+        '''
+        changes = {}
+        for name, after in self.get_counts().items():
+            changes[name] = {k: v - before[name].get(k, 0) for k, v in after.items() if v != before[name].get(k, 0)}
+        return changes
+
+    def do_section(self, sxml, seq):
+        '''
+        Convert a section (with do_verticals).  If keeping a manifest, and this section's inputs
+        are unchanged since the run which wrote the manifest, reuse its output from there instead.
+
+        sxml = seq <a> from OCW course
+        seq = edX sequential
+        '''
+        if self.manifest is None:
+            return self.do_verticals(sxml, seq)
+
+        key = sxml.get('href')
+        state = self.manifest.state_digest(self.processed_files, self.processed_pdf_files,
+                                           link=[key, (sxml.text or '').strip()])
+        entry = self.manifest.find_reusable(key, state)
+        if entry is not None:
+            self.log.debug("  Reusing unchanged section %s", key)
+            olx = etree.fromstring(entry['olx'])
+            for name, value in olx.attrib.items():
+                if name!='display_name':			# set by do_chapter, from the current syllabus
+                    seq.set(name, value)
+            for k in list(olx):
+                seq.append(k)
+            for src, dst in self.manifest.reuse_section(key, entry).items():
+                self.add_asset(src, dst)
+            self.processed_files += [self.manifest.abspath(x) for x in entry['processed_files']]
+            self.processed_pdf_files += entry['processed_pdf_files']
+            self.add_counts(entry['counts'])
+            return
+
+        files_before = dict(self.files_to_copy)
+        nfiles = len(self.processed_files)
+        npdfs = len(self.processed_pdf_files)
+        counts_before = self.get_counts()
+        self.manifest.begin_section(key, state)
+        self.do_verticals(sxml, seq)
+        files = {k: v for k, v in self.files_to_copy.items() if files_before.get(k) != v}
+        self.manifest.end_section(etree.tostring(seq), files, self.processed_files[nfiles:],
+                                  self.processed_pdf_files[npdfs:], self.count_changes(counts_before))
+
     def do_chapters(self, ocw_xml, edxxml):
         '''
         In an OCW syllabus file, the chapter is described by a <div class="course_nav">
@@ -821,6 +1103,7 @@ class OCWCourse(object):
             raise Exception("[OCWCourse.do_chapters] (%s) Failed to find main course navigation list in syllabus index.htm" % self.dir)
         
         chapters_xml = nav_div.find('ul')
+        chapters = []
         for c in chapters_xml:
             # each c should be a <li>; take the first a that is not href="#' for the chapter name
             atags = [a for a in c.findall('.//a') if not a.get('href')=='#']
@@ -829,24 +1112,152 @@ class OCWCourse(object):
             dn = atags[0].text.strip()
             if dn=='Course Home':
                 continue
+            chapters.append((dn, atags))
+        total = sum(len(atags) for dn, atags in chapters)
+        self.progress.start(total, course=self.meta['course'])
+
+        if self.chapter_workers > 1 and self.manifest is None and len(chapters) > 1:
+            return self.do_chapters_parallel(chapters, edxxml, total)
+        index = 0
+        with self.prefetching([atag for dn, atags in chapters for atag in atags]):
+            for dn, atags in chapters:
+                index = self.do_chapter(dn, atags, edxxml, index, total)
+
+    def do_chapter(self, dn, atags, edxxml, index, total):
+        '''
+        Convert one chapter, with display name dn, and section <a> tags atags, adding it to edxxml.
+        index = number of sections in the chapters before this one; returns index after this chapter
+        '''
+        self.log.info("chapter: %s", dn)
+
+        chapter = etree.SubElement(edxxml,'chapter')
+        chapter.set('display_name',dn)
+
+        for atag in atags:
+            href = atag.get('href')
+            xmlfn = self.get_xml_fn_from_href(href)
+            index += 1
+            if xmlfn in self.processed_files:
+                self.log.debug("--> Already processed file %s, skipping", xmlfn)
+                self.progress.section_done()
+                if self.prefetcher is not None:
+                    self.prefetcher.discard([xmlfn])
+                continue
+            dn = atag.text.strip()
+            self.log.debug("  section: %s", dn)
+            self.emit('section_started', chapter=chapter.get('display_name'), display_name=dn, href=href,
+                      index=index, total=total)
+            seq = etree.SubElement(chapter,'sequential')
+            seq.set('display_name',dn)
+            self.do_section(atag, seq)
+            self.progress.section_done()
+            if self.prefetcher is not None:
+                self.prefetcher.discard([xmlfn])	# not used, if reused from the manifest
+        return index
+
+    def do_chapters_parallel(self, chapters, edxxml, total):
+        '''
+        Convert chapters in self.chapter_workers worker processes, and merge them into edxxml in syllabus order.
+
+        Each worker starts from the de-duplication state (processed_files, processed_pdf_files) which
+        the chapters before it are predicted to leave (see chapter_claims), so chapters sharing PDFs
+        are converted in parallel too, and logs its tests of that state.  The merge replays the log
+        against the state actually left by the chapters before; if any test comes out differently,
+        the prediction was wrong, and the chapter is converted again here, serially.  So the output
+        is the same as for a serial conversion.
+        '''
+        starts = [0]
+        for dn, atags in chapters:
+            starts.append(starts[-1] + len(atags))
+        files, pdfs = list(self.processed_files), list(self.processed_pdf_files)
+        states = []
+        for claimed_files, claimed_pdfs in self.chapter_claims(chapters):
+            states.append((list(files), list(pdfs), self.files_to_copy))
+            files += [x for x in claimed_files if x not in files]
+            pdfs += [x for x in claimed_pdfs if x not in pdfs]
+        job = (self, chapters, starts, total, states)
+        pool = multiprocessing.Pool(min(self.chapter_workers, len(chapters)),
+                                    initializer=_init_chapter_worker, initargs=(job,))
+        try:
+            for k, result in enumerate(pool.imap(_convert_chapter, range(len(chapters)))):
+                if not self.merge_chapter(result, edxxml):
+                    self.log.debug("Chapter %s depends on earlier chapters, converting it again", chapters[k][0])
+                    self.element_counts['chapter_reconverted'] += 1
+                    with self.prefetching(chapters[k][1]):
+                        self.do_chapter(chapters[k][0], chapters[k][1], edxxml, starts[k], total)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def chapter_claims(self, chapters):
+        '''
+        Predict the de-duplication entries each chapter adds, for do_chapters_parallel: returns list of
+        (section page filenames, PDF hrefs), one per chapter.  The PDF hrefs are found by scanning the
+        text of the section pages, without parsing them, so may include some which are not converted.
+        '''
+        claims = []
+        for dn, atags in chapters:
+            files = [self.get_xml_fn_from_href(atag.get('href')) for atag in atags]
+            pdfs = []
+            for fn in files:
+                try:
+                    pdfs += self.PdfHrefPattern.findall(open(fn).read())
+                except IOError:
+                    continue
+            claims.append((files, pdfs))
+        return claims
 
-            print "chapter: ", dn
-
-            chapter = etree.SubElement(edxxml,'chapter')
-            chapter.set('display_name',dn)
+    def convert_chapter(self, k, chapters, starts, total, state):
+        '''
+        Convert chapter k in a chapter worker process (see do_chapters_parallel), starting from state
+        (processed_files, processed_pdf_files, files_to_copy) predicted for it, and return dict with its XML, log of tests
+        of the de-duplication state, count changes, and effects (events and progress to be replayed by
+        the parent process)
+        '''
+        checks = []
+        effects = []
+        self.processed_files = CheckedList(state[0], checks, 'files')
+        self.processed_pdf_files = CheckedList(state[1], checks, 'pdfs')
+        self.files_to_copy = dict(state[2])
+        self.listeners = [(lambda event, data: effects.append(('emit', event, data)), None)]
+        self.progress = ProgressReporter(callbacks=[lambda event, progress: effects.append(('progress', event, None))])
+        counts_before = self.get_counts()
+        edxxml = etree.Element('course')
+        dn, atags = chapters[k]
+        with self.prefetching(atags):		# threads do not survive the fork: prefetch here
+            self.do_chapter(dn, atags, edxxml, starts[k], total)
+        return {'xml': etree.tostring(edxxml[0]),
+                'checks': checks,
+                'counts': self.count_changes(counts_before),
+                'effects': effects,
+                }
+
+    def merge_chapter(self, result, edxxml):
+        '''
+        Merge chapter converted by convert_chapter into edxxml, if its tests of the de-duplication state
+        come out the same against the current state.  Returns False, changing nothing, if they do not.
+        '''
+        seen = {'files': set(self.processed_files), 'pdfs': set(self.processed_pdf_files)}
+        added = {'files': [], 'pdfs': []}
+        for name, item, found in result['checks']:
+            if found is None:
+                seen[name].add(item)
+                added[name].append(item)
+            elif (item in seen[name]) != found:
+                return False
+        self.processed_files.extend(added['files'])
+        self.processed_pdf_files.extend(added['pdfs'])
+        edxxml.append(etree.fromstring(result['xml']))
+        for kind, event, data in result['effects']:
+            if kind=='progress':
+                getattr(self.progress, event)()
+            elif event=='asset_discovered':
+                self.add_asset(data['source'], data['path'])
+            else:
+                self.emit(event, **data)
+        self.add_counts(result['counts'])
+        return True
 
-            for atag in atags:
-                href = atag.get('href')
-                xmlfn = self.get_xml_fn_from_href(href)
-                if xmlfn in self.processed_files:
-                    print "--> Already processed file %s, skipping" % xmlfn
-                    continue
-                dn = atag.text.strip()
-                print "  section: ", dn
-                seq = etree.SubElement(chapter,'sequential')
-                seq.set('display_name',dn)
-                self.do_verticals(atag, seq)
-        
     def get_metadata_field(self, mseq, root=None):
         if root is None:
             root = self.index_xml
@@ -880,8 +1291,8 @@ class OCWCourse(object):
         xb.add_about_file('video.html', '')
     
     def pp_xml(self, xml):
-        os.popen('xmllint --format -o tmp.xml -','w').write(etree.tostring(xml))
-        return open('tmp.xml').read()
+        proc = subprocess.Popen(['xmllint', '--format', '-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return proc.communicate(etree.tostring(xml))[0]
 
     #-----------------------------------------------------------------------------
     
@@ -923,36 +1334,74 @@ class OCWCourse(object):
         fn = self.dir / fn
         # os.system('mkdir -p static/images')
         # os.system('cp %s static/images/course_image.jpg' % fn)
-        self.files_to_copy[fn] = "static/images/course_image.jpg"
-        print "--> course image: %s" % fn
+        self.add_asset(fn, "static/images/course_image.jpg")
+        self.log.debug("--> course image: %s", fn)
+
+    def do_optimize_images(self):
+        '''
+        Replace large images among the static files by optimised versions, made in the scratch space
+        '''
+        optimizer = self.optimize_images
+        if not isinstance(optimizer, ImageOptimizer):
+            optimizer = ImageOptimizer()
+        outdir = self.scratch.mkdtemp(prefix="tmp_images")
+        self.files_to_copy, self.image_report = optimizer.optimize(self.files_to_copy, outdir)
+        self.scratch.check()
+        report = self.image_report
+        self.log.info("Images: optimized %d of %d large images, %d -> %d bytes (%d errors)", report['optimized'],
+                      report['images'], report['bytes_before'], report['bytes_after'], report['errors'])
 
     def copy_static_files(self, destdir):
         '''
         Copy static files specified in self.files_to_copy to the destdir
         Do this all at once, because destdir may be different depending on the output format (eg .tar.gz)
         '''
-        for src, dst in self.files_to_copy.items():
-            dd = "%s/%s" % (destdir, os.path.dirname(dst))
-            if not os.path.exists(dd):
-                cmd = "mkdir -p '%s'" % dd
-                if 1 or self.verbose > 2:
-                    print "    " + cmd
-                os.system(cmd)
-            cmd = "cp '%s' '%s/%s'" % (src, destdir, dst)
-            if 1 or self.verbose > 2:
-                print "    " + cmd
-            os.system(cmd)
+        copy_static_files(self.files_to_copy, destdir, verbose=self.verbose)
 
     #-----------------------------------------------------------------------------
     
-    def export(self):
+    def convert(self):
+        '''
+        Convert the course, without writing any output, and return a ConversionResult:
+
+          xbundle = XBundle with the edX course
+          assets  = asset manifest: list of dicts, one per static file, with keys path (edX static path,
+                    e.g. "static/images/course_image.jpg"), source (filename of the file), and size (bytes)
+          counts  = dict of OCW element counts, edX XML element counts, OCW content classification counts,
+                    and course statistics (see stats.py)
+
+        The asset source files are in the OCW course directory, which for a zip file is in the
+        scratch space, so use them before the scratch space is removed, e.g.
+
+            with OCWCourse(fn="course.zip") as ocwc:
+                result = ocwc.convert()
+                for asset in result.assets:
+                    store(asset['path'], open(asset['source']))
+        '''
+        with self.stage('metadata'):
+            if not os.path.exists(self.dir / 'contents/Syllabus'):
+                if os.path.exists(self.dir / 'contents/syllabus'):
+                    os.symlink('syllabus', self.dir / 'contents/Syllabus')
+                    self.log.info("Made a symlink from contents/syllabus to contents/Syllabus")
+
+            self.indexfn = self.dir / 'contents/Syllabus/index.htm'
+            self.log.info("...Parsing index.htm.xml")
+            self.index_xml = etree.parse(self.dir / 'contents/index.htm.xml').getroot()
+            self.log.info("...Parsing metadata")
+            self.meta = self.get_metadata()
+            self.log.extra['course'] = self.meta['course']
+            self.outfns = self.output_fns or [self.abspath('%s_xbundle.xml' % self.meta['course'])]
+            self.log.info("...Constructing policies")
+            self.policies = self.get_policies(self.meta)
+
+        self.log.info("...Converting OLX data")
         meta = self.meta
-        sys.stderr.write("metadata = %s\n" % meta)
+        self.log.debug("metadata = %s", meta)
     
         fn = self.dir / 'contents/Syllabus/index.htm'
         sxml = self.parse_broken_html(fn=fn)
         edxxml = etree.Element('course')
-        edxxml.set('dirname',os.path.basename(os.getcwd()))
+        edxxml.set('dirname',os.path.basename(os.path.dirname(self.outfns[0])))
         edxxml.set('semester', self.DefaultSemester)
         for k, v in meta.items():
             edxxml.set(k,v)
@@ -961,56 +1410,461 @@ class OCWCourse(object):
         self.files_to_copy = {}			# dict of files (key=OCW source, val=edX static dest) to copy to "/static"
         self.processed_pdf_files = []
         self.element_counts = defaultdict(int)
+        self.classifier = ElementClassifier()
+        if self.manifest_fn:
+            self.manifest = InputManifest(self.manifest_fn, self.dir, verbose=self.verbose,
+                                          options=dict(include_media=self.include_media,
+                                                       video_start=self.DefaultVideoStartPoint,
+                                                       converter_version=self.Version))
 
-        self.do_chapters(sxml, edxxml)
+        with self.stage('chapters'):
+            self.do_chapters(sxml, edxxml)
+        self.scratch.check()
 
         policies = self.policies
 
         # grab course image via index.htm
-        self.get_course_image()
+        with self.stage('course_image'):
+            self.get_course_image()
+
+        if self.optimize_images:
+            with self.stage('images'):
+                self.do_optimize_images()
         
         # make xbundle 
-        xb = XBundle(force_studio_format=True)
-        xb.DefaultOrg = self.DefaultOrg
-        xb.set_course(edxxml)
-        xb.add_policies(policies)
-        self.add_about_files(xb)
-
-        def c(x):
-            return len(xb.course.findall(".//%s" % x))
-        elist = ["chapter", "sequential", "vertical", "problem", "html", "video"]
-        xbundle_counts = {x:c(x) for x in elist}
+        with self.stage('xbundle'):
+            xb = XBundle(force_studio_format=True, compact_olx=self.compact_olx)
+            xb.DefaultOrg = self.DefaultOrg
+            xb.set_course(edxxml)
+            xb.add_policies(policies)
+            self.add_about_files(xb)
+
+            assets = [{'path': dst, 'source': src, 'size': os.path.getsize(src) if os.path.exists(src) else None}
+                      for src, dst in sorted(self.files_to_copy.items(), key=lambda x: x[1])]
+            self.stats = course_statistics(xb.course, dict((x['path'], x['size'] or 0) for x in assets))
+            elist = ["chapter", "sequential", "vertical", "problem", "html", "video"]
+            self.xbundle_counts = {x: self.stats['counts'].get(x, 0) for x in elist}
         self.element_counts['n_static_files'] = len(self.files_to_copy)
         self.element_counts['n_ocw_files_processed'] = len(self.processed_files)
 
+        self.xb = xb
+        counts = {'element_counts': dict(self.element_counts),
+                  'xbundle_counts': self.xbundle_counts,
+                  'classifier': dict(self.classifier.counts),
+                  'images': self.image_report,
+                  'stats': self.stats,
+                  }
+        return ConversionResult(xb, assets, counts)
+
+    def export(self):
+        '''
+        Write the course converted by convert() to the output files
+        '''
+        xb = self.xb
+        xbundle_counts = self.xbundle_counts
+
         # save it
-        outfn = self.output_fn or ('%s_xbundle.xml' % self.cid)
-        if outfn.endswith(".xml"):
-            xb.save(outfn)
-            self.copy_static_files(".")
-        elif outfn.endswith(".tar.gz") or outfn.endswith(".tgz"):
-            tempd = tempfile.mkdtemp(prefix="tmp_ocw2xbundle")
-            cdir = path(tempd) / "course"
-            os.mkdir(cdir)
-            self.copy_static_files(cdir)
-            xb.export_to_directory(cdir, dir_include_course_id=False)
-            curdir = os.path.abspath(os.curdir)
-            cmd = "cd %s; tar czf '%s/%s' course" % (tempd, curdir, outfn)
-            print cmd
-            os.system(cmd)
-            shutil.rmtree(tempd)
-        else:
-            if not os.path.exists(outfn):
-                print "Making directory for output: %s" % outfn
-                os.mkdir(outfn)
-            self.copy_static_files(outfn)
-            xb.export_to_directory(outfn, dir_include_course_id=False)
-
-        print "OCW element counts: %s" % json.dumps(self.element_counts, indent=4)
-        print "edX XML element counts: %s" % json.dumps(xbundle_counts, indent=4)
-        print "Done, wrote to %s" % outfn
+        if self.artifact_fn:
+            with self.stage('artifact'):
+                save_artifact(self.artifact_fn, xb, self.files_to_copy,
+                              dict(cid=self.cid, outfn='%s_xbundle.xml' % self.cid,
+                                   element_counts=self.element_counts, xbundle_counts=xbundle_counts))
+        self.export_reports = {}
+        for outfn in self.outfns:
+            with self.stage('write %s' % os.path.basename(outfn)):
+                self.export_reports[outfn] = write_output(xb, self.files_to_copy, outfn, verbose=self.verbose,
+                                                          scratch=self.scratch, progress=self.progress)
+
+        self.log.info("OCW element counts: %s", Lazy(json.dumps, self.element_counts, indent=4))
+        self.log.info("edX XML element counts: %s", Lazy(json.dumps, xbundle_counts, indent=4))
+        self.log.info("OCW content classification counts: %s", Lazy(json.dumps, self.classifier.counts, indent=4))
+        self.log.info("Course statistics: max depth %d, %d static files (%d bytes), %d PDFs, %d videos",
+                      self.stats['max_depth'], self.stats['static_files'], self.stats['static_bytes'],
+                      self.stats['course']['pdfs'], self.stats['course']['videos'])
+        if self.stats_fn:
+            with open(self.stats_fn, 'w') as fp:
+                json.dump(dict(self.stats, cid=self.cid, version=self.Version), fp, indent=2, sort_keys=True)
+            self.log.info("Wrote course statistics to %s", self.stats_fn)
+        if self.manifest is not None:
+            self.manifest.save()
+        self.progress.finish()
+        self.log.info("Done, wrote to %s", ', '.join(self.outfns))
     
 
+#-----------------------------------------------------------------------------
+# tests
+
+def make_test_course(dpath, nsections=4, padding=0, shared_pdf=True):
+    '''
+    Write a minimal OCW course content directory to dpath/course, with nsections sections,
+    each having some intro text, a link to a shared PDF, and a link to a video page.
+    padding = number of extra elements of page chrome (not converted) added to each section page.
+    shared_pdf = if False, each section links to its own PDF, instead of all to the same one.
+    Returns path of the course directory.
+    '''
+    cdir = path(dpath) / "course"
+    contents = cdir / "contents"
+    for sub in ["Syllabus", "images", "lecture-notes"]:
+        os.makedirs(contents / sub)
+    open(contents / "index.htm.xml", 'w').write('''<?xml version="1.0"?>
+<lom:lom xmlns:lom="https://ocw.mit.edu/xmlns/LOM"><lom:general>
+<lom:identifier><lom:entry>8.01</lom:entry></lom:identifier>
+<lom:title><lom:string>Test Course</lom:string></lom:title>
+<lom:description><lom:string>A test course.</lom:string></lom:description>
+</lom:general></lom:lom>''')
+    open(contents / "index.htm", 'w').write('<html><body><div id="course_inner_chp">'
+                                          '<img itemprop="image" src="../contents/images/course.jpg"/></div></body></html>')
+    open(contents / "images/course.jpg", 'w').write("JPEG")
+    for k in range(1 if shared_pdf else nsections):
+        open(contents / ("lecture-notes/notes%d.pdf" % (k + 1)), 'w').write("%PDF-1.4")
+    links = ['<li><a href="../../contents/index.htm">Course Home</a></li>']
+    for k in range(nsections):
+        sdir = contents / ("sec%d" % k)
+        os.mkdir(sdir)
+        links.append('<li><a href="../../contents/sec%d/index.htm">Section %d</a></li>' % (k, k))
+        open(sdir / "index.htm", 'w').write('''<html><body>
+<div id="chrome">%s</div>
+<span id="parent-fieldname-title">Section %d </span>
+<div id="parent-fieldname-text">
+<p class="sc_nav">nav</p>
+<p>&#160;</p>
+<p>Intro text for section %d <img src="../../contents/images/course.jpg"/></p>
+<p><a href="../../contents/lecture-notes/notes%d.pdf">Lecture notes</a></p>
+<table><tr><td>cell</td></tr></table>
+<p><a href="../../contents/sec%d/video.htm">Lecture video %d</a></p>
+</div></body></html>''' % ("<span>chrome</span>" * padding, k, k, 1 if shared_pdf else k + 1, k, k))
+        open(sdir / "video.htm", 'w').write('''<html><body><div id="parent-fieldname-text">
+<p>Video intro</p>
+<h3>Video %d</h3>
+<div class="embedbg"><script type="text/javascript">ocw_embed_chapter_media('embed1', 'https://www.youtube.com/v/yt%05d', 'youtube', '/courses/x', 'https://img', 30, 90, null);</script></div>
+</div></body></html>''' % (k, k))
+    open(contents / "Syllabus/index.htm", 'w').write('<html><body><div id="course_nav"><ul>%s</ul></div></body></html>'
+                                                   % "\n".join(links))
+    return cdir
+
+def test_section_memory_released():
+    '''
+    Each OCW section page is released once converted, so resident memory stays flat as
+    the number of converted sections grows.  (tracemalloc is not available on python 2,
+    and does not see lxml allocations anyway, so this uses the process RSS.)
+    '''
+    if not os.path.exists("/proc/self/statm"):
+        return
+    def rss():
+        return int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    samples = []
+    class MeasuredCourse(OCWCourse):
+        def do_verticals(self, sxml, seq):
+            OCWCourse.do_verticals(self, sxml, seq)
+            samples.append(rss())
+
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=40, padding=20000)
+        ocwc = MeasuredCourse(fn=cdir, ofn=tdir / "out", verbose=False)
+        ocwc.process()
+        assert len(samples)==40
+        growth = samples[-1] - samples[9]
+        assert growth < 20 * 1024 * 1024, "RSS grew by %d bytes over 30 sections" % growth
+    finally:
+        shutil.rmtree(tdir)
+
+def test_budget_watchdog():
+    '''
+    A conversion stuck on a page is killed at the time limit, and the report names its stage and page
+    '''
+    from budget import Watchdog
+    class StuckCourse(OCWCourse):
+        def add_video_from_script_element(self, *args, **kwargs):
+            time.sleep(60)
+    def convert(cdir, ofn, scratch_dir, listeners=None):
+        StuckCourse(fn=cdir, ofn=ofn, verbose=False, scratch_dir=scratch_dir, listeners=listeners).process()
+
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=2)
+        watchdog = Watchdog(time_limit=3, interval=0.1)
+        scratch_dir = (tdir / "scratch").mkdir()		# a killed conversion cannot remove its scratch space
+        report = watchdog.run(cdir, convert, cdir, tdir / "out", scratch_dir)
+        assert (report['status'], report['limit'], report['stage'])==('killed', 'time', 'chapters')
+        assert report['page']=="contents/sec0/video.htm" and report['seconds'] < 10
+        assert not os.path.exists(tdir / "out")
+        assert len(os.listdir(scratch_dir))==1			# left behind, and removed with tdir
+    finally:
+        shutil.rmtree(tdir)
+
+def read_tree(dpath):
+    '''
+    Return dict of (relative filename -> contents) for all files under directory dpath
+    '''
+    dpath = path(dpath)
+    return {str(dpath.relpathto(fn)): open(fn).read() for fn in dpath.walkfiles()}
+
+def test_incremental_reconversion():
+    '''
+    After one section page changes, only that section is reconverted, and the output
+    matches a conversion from scratch.
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=4)
+        mfn = tdir / "manifest.json"
+        OCWCourse(fn=cdir, ofn=tdir / "out1", verbose=False, manifest_fn=mfn).process()
+        sfn = cdir / "contents/sec2/index.htm"
+        page = open(sfn).read()
+        open(sfn, 'w').write(page.replace("Intro text", "Changed text"))
+
+        ocwc = OCWCourse(fn=cdir, ofn=tdir / "out2", verbose=False, manifest_fn=mfn)
+        ocwc.process()
+        assert (ocwc.manifest.n_reused, ocwc.manifest.n_converted)==(3, 1)
+        OCWCourse(fn=cdir, ofn=tdir / "out3", verbose=False).process()
+        out2 = read_tree(tdir / "out2")
+        assert "Changed text" in out2["html/Section_2_html.xml"]
+        assert out2==read_tree(tdir / "out3")
+
+        ocwc = OCWCourse(fn=cdir, ofn=tdir / "out4", verbose=False, manifest_fn=mfn, video_start_offset=10)
+        ocwc.process()
+        assert (ocwc.manifest.n_reused, ocwc.manifest.n_converted)==(0, 4)	# options changed
+        OCWCourse(fn=cdir, ofn=tdir / "out5", verbose=False, video_start_offset=10).process()
+        assert read_tree(tdir / "out4")==read_tree(tdir / "out5")
+
+        sfn = cdir / "contents/Syllabus/index.htm"
+        page = open(sfn).read()
+        open(sfn, 'w').write(page.replace("Section 1</a>", "Renamed 1</a>"))
+        ocwc = OCWCourse(fn=cdir, ofn=tdir / "out6", verbose=False, manifest_fn=mfn, video_start_offset=10)
+        ocwc.process()
+        assert (ocwc.manifest.n_reused, ocwc.manifest.n_converted)==(3, 1)	# link text changed
+        OCWCourse(fn=cdir, ofn=tdir / "out7", verbose=False, video_start_offset=10).process()
+        out6 = read_tree(tdir / "out6")
+        assert any('display_name="Renamed 1"' in x for x in out6.values())
+        assert out6==read_tree(tdir / "out7")
+
+        cdir = make_test_course(tdir / "b", nsections=4, shared_pdf=False)	# a missing PDF is put back
+        mfn = tdir / "manifest_b.json"
+        pdf = cdir / "contents/lecture-notes/notes2.pdf"
+        OCWCourse(fn=cdir, ofn=tdir / "b1", verbose=False, manifest_fn=mfn).process()
+        shutil.move(pdf, tdir / "notes2.pdf")
+        OCWCourse(fn=cdir, ofn=tdir / "b2", verbose=False, manifest_fn=mfn).process()
+        shutil.move(tdir / "notes2.pdf", pdf)
+        ocwc = OCWCourse(fn=cdir, ofn=tdir / "b3", verbose=False, manifest_fn=mfn)
+        ocwc.process()
+        assert (ocwc.manifest.n_reused, ocwc.manifest.n_converted)==(1, 3)	# later sections: PDF state changed
+        b3 = read_tree(tdir / "b3")
+        assert "static/lecture-notes/notes2.pdf" in b3
+        assert b3==read_tree(tdir / "b1")
+    finally:
+        shutil.rmtree(tdir)
+
+def test_artifact_emit():
+    '''
+    Output emitted from the intermediate artifact matches the output of the conversion.
+    '''
+    from artifact import emit
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=2)
+        OCWCourse(fn=cdir, ofn=tdir / "out1", verbose=False, artifact_fn=tdir / "course.zip").process()
+        emit(tdir / "course.zip", tdir / "out2", verbose=False)
+        assert read_tree(tdir / "out1")==read_tree(tdir / "out2")
+    finally:
+        shutil.rmtree(tdir)
+
+def test_multiple_outputs():
+    '''
+    Several outputs from one conversion are the same as the output of a single conversion.
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=2)
+        OCWCourse(fn=cdir, ofn=[tdir / "out1", tdir / "out2"], verbose=False).process()
+        OCWCourse(fn=cdir, ofn=tdir / "out3", verbose=False).process()
+        out3 = read_tree(tdir / "out3")
+        assert read_tree(tdir / "out1")==out3
+        assert read_tree(tdir / "out2")==out3
+    finally:
+        shutil.rmtree(tdir)
+
+def test_scratch_cleanup():
+    '''
+    The scratch space for a zip file conversion is removed when the conversion succeeds and when it fails.
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=2)
+        def make_zip(zfn):
+            zf = zipfile.ZipFile(zfn, 'w')
+            for fn in cdir.walkfiles():
+                zf.write(fn, tdir.relpathto(fn))
+            zf.close()
+        sdir = tdir / "scratch"
+        make_zip(tdir / "course.zip")
+        ocwc = OCWCourse(fn=tdir / "course.zip", ofn=tdir / "out.tar.gz", verbose=False, scratch_dir=sdir)
+        ocwc.process()
+        assert os.path.exists(tdir / "out.tar.gz")
+        assert ocwc.scratch.high_water > 0
+        assert os.listdir(sdir)==[]
+
+        os.remove(cdir / "contents/index.htm.xml")
+        make_zip(tdir / "broken.zip")
+        try:
+            OCWCourse(fn=tdir / "broken.zip", ofn=tdir / "out2", verbose=False, scratch_dir=sdir).process()
+            assert False, "conversion of broken course should fail"
+        except IOError:
+            pass
+        assert os.listdir(sdir)==[]
+
+        try:
+            OCWCourse(fn=tdir / "course.zip", ofn=tdir / "out3", verbose=False, scratch_dir=sdir, scratch_quota=100)
+            assert False, "scratch quota should be enforced"
+        except Exception as err:
+            assert "quota exceeded" in str(err)
+        assert os.listdir(sdir)==[]
+    finally:
+        shutil.rmtree(tdir)
+
+def test_library_api():
+    '''
+    convert() returns the course in memory, with its asset manifest, writing no output; events are
+    sent to listeners as the conversion goes.
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=3)
+        events = defaultdict(list)
+        with OCWCourse(fn=cdir, ofn=tdir / "out", verbose=False) as ocwc:
+            ocwc.add_listener(lambda event, data: events[event].append(data))
+            result = ocwc.convert()
+            for asset in result.assets:
+                assert open(asset['source']).read()		# sources are readable until cleanup
+        assert not os.path.exists(tdir / "out")
+        assert [x['index'] for x in events['section_started']]==[1, 2, 3]
+        latest = dict((x['source'], x['path']) for x in events['asset_discovered'])
+        assert sorted(latest.values())==[x['path'] for x in result.assets]
+        assert 'static/lecture-notes/notes1.pdf' in [x['path'] for x in result.assets]
+        assert [x['stage'] for x in events['stage_timing']]==['metadata', 'chapters', 'course_image', 'xbundle']
+        assert result.counts['xbundle_counts']['sequential']==3
+        stats = result.counts['stats']
+        assert [len(x['sequentials']) for x in stats['chapters']]==[1, 1, 1]
+        assert [x['videos'] for x in stats['chapters']]==[1, 1, 1]
+        assert stats['chapters'][0]['sequentials'][0]['pdfs']==1		# the shared PDF is copied once
+        assert stats['course']['pdfs']==1 and stats['static_files']==len(result.assets)
+        assert len(result.xbundle.course.findall('.//sequential'))==3
+    finally:
+        shutil.rmtree(tdir)
+
+def test_parallel_chapters():
+    '''
+    Converting chapters in worker processes gives the same output as a serial conversion, when the
+    chapters are independent, when they share PDFs, and when the PDFs a chapter is predicted to
+    use are wrong (so the next chapter is converted again).
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        for variant in ['independent', 'shared', 'mispredicted']:
+            cdir = make_test_course(tdir / variant, nsections=5, shared_pdf=(variant=='shared'))
+            if variant=='mispredicted':			# a commented-out link to the PDF of the next section
+                sfn = cdir / "contents/sec0/index.htm"
+                page = open(sfn).read()
+                open(sfn, 'w').write(page.replace("</body>", '<!-- <a href="../../contents/lecture-notes/notes2.pdf"> --></body>'))
+            OCWCourse(fn=cdir, ofn=tdir / "serial", verbose=False).process()
+            events = []
+            ocwc = OCWCourse(fn=cdir, ofn=tdir / "parallel", verbose=False, chapter_workers=3,
+                             listeners=[lambda event, data: events.append(event)])
+            ocwc.process()
+            assert read_tree(tdir / "parallel")==read_tree(tdir / "serial")
+            assert ocwc.progress.sections_done==5
+            assert events.count('section_started')==5
+            assert ocwc.element_counts['chapter_reconverted']==(1 if variant=='mispredicted' else 0)
+            shutil.rmtree(tdir / "serial")
+            shutil.rmtree(tdir / "parallel")
+    finally:
+        shutil.rmtree(tdir)
+
+def test_prefetch_pages():
+    '''
+    Section pages prefetched from the syllabus give the same output as parsing each page when it is converted.
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=6)
+        OCWCourse(fn=cdir, ofn=tdir / "serial", verbose=False, prefetch_threads=0).process()
+        hits = []
+        class TestCourse(OCWCourse):
+            def parse_page(self, fn):
+                hits.append(self.prefetcher.hits)
+                return OCWCourse.parse_page(self, fn)
+        TestCourse(fn=cdir, ofn=tdir / "prefetched", verbose=False, prefetch_threads=2).process()
+        assert read_tree(tdir / "prefetched")==read_tree(tdir / "serial")
+        assert len(hits)==12 and hits[-1] >= 5		# section pages prefetched; video pages parsed on demand
+    finally:
+        shutil.rmtree(tdir)
+
+def test_delta_export():
+    '''
+    Converting again to the same output directory rewrites only changed files, and removes orphaned ones.
+    '''
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        cdir = make_test_course(tdir / "a", nsections=3, shared_pdf=False)
+        ofn = tdir / "out"
+        OCWCourse(fn=cdir, ofn=ofn, verbose=False).process()
+        first = read_tree(ofn)
+        for fn in ofn.walkfiles():
+            os.utime(fn, (1, 1))
+        ocwc = OCWCourse(fn=cdir, ofn=ofn, verbose=False)
+        ocwc.process()
+        report = ocwc.export_reports[ofn]
+        assert (report['added'], report['changed'], report['removed'])==([], [], [])
+        assert all(os.path.getmtime(fn)==1 for fn in ofn.walkfiles())
+
+        cdir = make_test_course(tdir / "b", nsections=2, shared_pdf=False)	# one section less
+        ocwc = OCWCourse(fn=cdir, ofn=ofn, verbose=False)
+        ocwc.process()
+        report = ocwc.export_reports[ofn]
+        assert 'static/lecture-notes/notes3.pdf' in report['removed']
+        assert report['added']==[] and 'static/lecture-notes/notes1.pdf' not in report['changed']
+        OCWCourse(fn=cdir, ofn=tdir / "fresh", verbose=False).process()
+        assert read_tree(ofn)==read_tree(tdir / "fresh")
+        assert read_tree(ofn)!=first
+    finally:
+        shutil.rmtree(tdir)
+
+def test_concurrent_conversions():
+    '''
+    Many conversions running at once in one process give the same output as when run one at a time.
+    '''
+    import threading
+    import tarfile
+    tdir = path(tempfile.mkdtemp(prefix="tmp_ocw2edx_test"))
+    try:
+        ncourses = 8
+        cdirs = [make_test_course(tdir / ("c%d" % k), nsections=2 + k) for k in range(ncourses)]
+        for k, cdir in enumerate(cdirs):
+            OCWCourse(fn=cdir, ofn=tdir / ("serial%d" % k), verbose=False).process()
+
+        errors = []
+        def convert(k):
+            try:
+                ofns = [tdir / ("parallel%d" % k), tdir / ("parallel%d.tar.gz" % k)]
+                OCWCourse(fn=cdirs[k], ofn=ofns, verbose=False).process()
+            except Exception as err:
+                errors.append(err)
+        threads = [threading.Thread(target=convert, args=(k,)) for k in range(ncourses)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+
+        for k in range(ncourses):
+            serial = read_tree(tdir / ("serial%d" % k))
+            assert read_tree(tdir / ("parallel%d" % k))==serial
+            tarfile.open(tdir / ("parallel%d.tar.gz" % k)).extractall(tdir / ("untar%d" % k))
+            assert read_tree(tdir / ("untar%d/course" % k))==serial
+    finally:
+        shutil.rmtree(tdir)
+
 #-----------------------------------------------------------------------------
 
 if __name__=='__main__':
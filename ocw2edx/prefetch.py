@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+# Parse OCW content pages ahead of their conversion.
+#
+# All the section pages of a course are known from the syllabus before any
+# of them is converted, and the media pages of a media gallery are known
+# when the gallery is reached.  A PagePrefetcher reads and parses such pages
+# ahead of use, in a bounded pool of threads (lxml releases the GIL while
+# parsing), so I/O and parsing overlap with conversion, which takes the
+# parsed pages in order.  At most `ahead` pages are parsed ahead of use at
+# any time, so memory use stays bounded.
+
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
+
+#-----------------------------------------------------------------------------
+
+class PagePrefetcher(object):
+    '''
+    Parse pages with parse(fn) in a pool of threads, ahead of their use with get(fn).
+    '''
+    def __init__(self, parse, nthreads=4, ahead=8):
+        '''
+        parse = function parsing a page, given its filename
+        nthreads = number of parsing threads
+        ahead = maximum number of scheduled pages being parsed, or parsed and waiting to be used
+        '''
+        self.parse = parse
+        self.ahead = ahead
+        self.pool = ThreadPool(nthreads)
+        self.pending = deque()		# scheduled pages, not yet being parsed
+        self.scheduled = set()		# pages in pending
+        self.ready = OrderedDict()	# page filename -> AsyncResult, for pages being parsed or parsed
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, fns, urgent=False):
+        '''
+        Schedule pages fns to be parsed, in order.  If urgent, start parsing them now, ahead of
+        pages already scheduled, and regardless of the ahead limit (e.g. for pages used next).
+        '''
+        for fn in fns:
+            if fn in self.ready or fn in self.scheduled:
+                continue
+            if urgent:
+                self.ready[fn] = self.pool.apply_async(self.parse, (fn,))
+            else:
+                self.pending.append(fn)
+                self.scheduled.add(fn)
+        self.fill()
+
+    def fill(self):
+        while self.pending and len(self.ready) < self.ahead:
+            fn = self.pending.popleft()
+            self.scheduled.discard(fn)
+            self.ready[fn] = self.pool.apply_async(self.parse, (fn,))
+
+    def get(self, fn):
+        '''
+        Return parsed page fn: the prefetched one, if it was scheduled, else parsed now.
+        Exceptions from parsing are raised here, as if the page were parsed now.
+        '''
+        result = self.ready.pop(fn, None)
+        if result is None:
+            self.misses += 1
+            self.discard([fn])
+            return self.parse(fn)
+        self.hits += 1
+        try:
+            return result.get()
+        finally:
+            self.fill()
+
+    def discard(self, fns):
+        '''
+        Unschedule pages fns, which will not be used (e.g. skipped as already converted)
+        '''
+        for fn in fns:
+            self.ready.pop(fn, None)
+            if fn in self.scheduled:
+                self.scheduled.discard(fn)
+                self.pending.remove(fn)
+        self.fill()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.pending.clear()
+        self.scheduled.clear()
+        self.ready.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    import threading
+    parsed = []
+    lock = threading.Lock()
+    def parse(fn):
+        if fn=="bad":
+            raise Exception("cannot parse %s" % fn)
+        with lock:
+            parsed.append(fn)
+        return fn.upper()
+
+    with PagePrefetcher(parse, nthreads=2, ahead=2) as pf:
+        pf.prefetch(["a", "b", "c", "d", "bad"])
+        assert len(pf.ready)==2 and list(pf.pending)==["c", "d", "bad"]	# only ahead pages parsed at once
+        assert pf.get("a")=="A"
+        pf.discard(["d"])						# skipped: never parsed
+        pf.prefetch(["m1", "m2"], urgent=True)
+        assert [pf.get(x) for x in ["m1", "m2", "b", "c"]]==["M1", "M2", "B", "C"]
+        assert pf.get("e")=="E"						# not scheduled: parsed now
+        try:
+            pf.get("bad")
+            assert False
+        except Exception as err:
+            assert "cannot parse bad" in str(err)
+        assert (pf.hits, pf.misses)==(6, 1)
+        assert "d" not in parsed and not pf.ready and not pf.pending
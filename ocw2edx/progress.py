@@ -0,0 +1,173 @@
+#!/usr/bin/python
+#
+# Progress and ETA reporting for a course conversion.
+#
+# The number of sections is counted from the syllabus before conversion
+# starts, so progress can be reported as sections done out of the total,
+# with an estimated time to completion.  Captions fetched, PDFs rendered,
+# and static file bytes copied are counted too.
+#
+# Progress is reported to any of: a terminal progress line (on stderr), a
+# progress file (JSON, rewritten at most every interval seconds, and
+# including the time of the last update, so stalled conversions can be
+# detected), and callbacks, which are called with (event name, progress
+# dict) for every event.
+
+import os
+import sys
+import json
+import time
+
+#-----------------------------------------------------------------------------
+
+class ProgressReporter(object):
+    '''
+    Count conversion progress, and report it to a terminal line, a progress file, and callbacks.
+    '''
+    def __init__(self, progress_fn=None, callbacks=None, terminal=False, interval=1.0, stream=None):
+        '''
+        progress_fn = filename of JSON progress file (default None: no file)
+        callbacks = list of functions called as callback(event, progress), with progress a dict
+        terminal = if True, show progress line on stream (default stderr)
+        interval = minimum seconds between updates of the progress file and terminal line
+        '''
+        self.progress_fn = progress_fn
+        self.callbacks = list(callbacks or [])
+        self.terminal = terminal
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.course = None
+        self.stage = 'starting'
+        self.sections_total = 0
+        self.sections_done = 0
+        self.captions = 0
+        self.pdfs = 0
+        self.bytes_copied = 0
+        self.started = time.time()
+        self.updated = self.started
+        self.last_output = 0
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    #----------------------------------------
+    # events
+
+    def start(self, sections_total, course=None):
+        self.sections_total = sections_total
+        self.course = course
+        self.started = time.time()
+        self.event('start', stage='converting')
+
+    def section_done(self):
+        self.sections_done += 1
+        self.event('section_done')
+
+    def caption_fetched(self):
+        self.captions += 1
+        self.event('caption_fetched')
+
+    def pdf_rendered(self):
+        self.pdfs += 1
+        self.event('pdf_rendered')
+
+    def file_copied(self, nbytes):
+        self.bytes_copied += nbytes
+        self.event('file_copied')
+
+    def set_stage(self, stage):
+        self.event('stage', stage=stage)
+
+    def finish(self):
+        self.event('finish', stage='done')
+
+    def failed(self):
+        self.event('failed', stage='failed')
+
+    def event(self, name, stage=None):
+        if stage:
+            self.stage = stage
+        self.updated = time.time()
+        if self.callbacks:
+            progress = self.get_progress()
+            for callback in self.callbacks:
+                callback(name, progress)
+        final = name in ['finish', 'failed']
+        if (self.progress_fn or self.terminal) and (final or self.updated - self.last_output >= self.interval):
+            self.last_output = self.updated
+            self.output(final)
+
+    #----------------------------------------
+    # reporting
+
+    def eta(self):
+        '''
+        Estimated seconds until all sections are done, or None if not yet known
+        '''
+        if not self.sections_done or not self.sections_total:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed / self.sections_done * max(self.sections_total - self.sections_done, 0)
+
+    def get_progress(self):
+        return {'course': self.course,
+                'stage': self.stage,
+                'sections_done': self.sections_done,
+                'sections_total': self.sections_total,
+                'captions_fetched': self.captions,
+                'pdfs_rendered': self.pdfs,
+                'bytes_copied': self.bytes_copied,
+                'elapsed': self.updated - self.started,
+                'eta': self.eta(),
+                'updated': self.updated,
+                'pid': os.getpid(),
+                }
+
+    def progress_line(self):
+        pct = 100.0 * self.sections_done / self.sections_total if self.sections_total else 0
+        eta = self.eta()
+        line = "[%s] %s: sections %d/%d (%d%%), captions %d, PDFs %d, copied %.1f MB" % (
+            self.course or "", self.stage, self.sections_done, self.sections_total, pct, self.captions,
+            self.pdfs, self.bytes_copied / 1e6)
+        if eta is not None and self.stage=='converting':
+            line += ", ETA %dm%02ds" % (eta / 60, eta % 60)
+        return line
+
+    def output(self, final=False):
+        if self.progress_fn:
+            tmpfn = self.progress_fn + ".tmp"
+            with open(tmpfn, 'w') as fp:
+                json.dump(self.get_progress(), fp, indent=4, sort_keys=True)
+            os.rename(tmpfn, self.progress_fn)
+        if self.terminal:
+            self.stream.write("\r" + self.progress_line() + ("\n" if final else ""))
+            self.stream.flush()
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    import shutil
+    import tempfile
+    import StringIO
+    tdir = tempfile.mkdtemp(prefix="tmp_progress_test")
+    try:
+        events = []
+        stream = StringIO.StringIO()
+        pfn = os.path.join(tdir, "progress.json")
+        pr = ProgressReporter(pfn, callbacks=[lambda e, p: events.append((e, p['sections_done']))],
+                              terminal=True, interval=3600, stream=stream)
+        pr.start(4, course="8.01")
+        pr.section_done()
+        pr.caption_fetched()
+        pr.file_copied(1000)
+        assert pr.eta() is not None
+        assert json.load(open(pfn))['sections_done']==0	# throttled: only written at start
+        pr.section_done()
+        pr.finish()
+        data = json.load(open(pfn))
+        assert (data['sections_done'], data['sections_total'], data['stage'])==(2, 4, 'done')
+        assert (data['captions_fetched'], data['bytes_copied'])==(1, 1000)
+        assert events[0]==('start', 0) and events[-1]==('finish', 2)
+        assert stream.getvalue().endswith("[8.01] done: sections 2/4 (50%), captions 1, PDFs 0, copied 0.0 MB\n")
+    finally:
+        shutil.rmtree(tdir)
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+#
+# Scratch space for a course conversion.
+#
+# Each conversion gets its own scratch directory (for the unpacked OCW zip
+# file, and for staging .tar.gz output), made under a configurable base
+# directory (e.g. a tmpfs), and removed when the conversion finishes or
+# fails.  The scratch space may be limited by a disk quota, and the high
+# water mark of its usage is recorded.
+
+import os
+import shutil
+import tempfile
+
+from path import path	# needs path.py
+
+#-----------------------------------------------------------------------------
+
+class ScratchSpace(object):
+    '''
+    Private scratch directory, with a quota, removed by close() or on exit from a with block.
+    '''
+    def __init__(self, base_dir=None, quota=None, prefix="tmp_ocw2edx"):
+        '''
+        base_dir = directory in which to make the scratch directory (default: system temporary directory)
+        quota = maximum scratch space usage, in bytes (default None: unlimited)
+        '''
+        if base_dir and not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+        self.root = path(tempfile.mkdtemp(prefix=prefix, dir=base_dir))
+        self.quota = quota
+        self.high_water = 0
+
+    def mkdtemp(self, prefix="tmp"):
+        '''
+        Make a new directory within the scratch space, and return its path
+        '''
+        return path(tempfile.mkdtemp(prefix=prefix, dir=self.root))
+
+    def usage(self):
+        '''
+        Return number of bytes currently used in the scratch space
+        '''
+        nbytes = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for fn in filenames:
+                fn = os.path.join(dirpath, fn)
+                if not os.path.islink(fn):
+                    nbytes += os.path.getsize(fn)
+        return nbytes
+
+    def reserve(self, nbytes):
+        '''
+        Check that nbytes more can be written to the scratch space without exceeding the quota,
+        before writing them.  Raises an Exception if not.
+        '''
+        self.check(self.usage() + nbytes)
+
+    def check(self, nbytes=None):
+        '''
+        Update the high water mark with the current usage (or nbytes, if given), and raise an
+        Exception if it exceeds the quota.
+        '''
+        if nbytes is None:
+            nbytes = self.usage()
+        self.high_water = max(self.high_water, nbytes)
+        if self.quota is not None and nbytes > self.quota:
+            raise Exception("[ScratchSpace] Scratch space quota exceeded in %s: %d bytes needed, quota is %d bytes"
+                            % (self.root, nbytes, self.quota))
+        return nbytes
+
+    def close(self):
+        '''
+        Remove the scratch directory and everything in it
+        '''
+        if self.root is not None and self.root.exists():
+            shutil.rmtree(self.root, ignore_errors=True)
+        self.root = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    base = tempfile.mkdtemp(prefix="tmp_scratch_test")
+    try:
+        with ScratchSpace(base, quota=1000) as scratch:
+            root = scratch.root
+            sdir = scratch.mkdtemp()
+            open(sdir / "a", "w").write("x" * 600)
+            assert scratch.check()==600
+            try:
+                scratch.reserve(600)
+                assert False, "quota not enforced"
+            except Exception as err:
+                assert "quota exceeded" in str(err)
+            assert scratch.high_water==1200
+            os.remove(sdir / "a")
+            scratch.check()
+            assert scratch.high_water==1200
+        assert not os.path.exists(root)
+    finally:
+        shutil.rmtree(base)
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+#
+# Long-running conversion service.
+#
+# "ocw2edx serve" starts a service which accepts conversion jobs over
+# localhost HTTP, and runs them on a pool of worker threads.  Everything a
+# one-off ocw2edx run has to set up again each time - module imports, the
+# compiled PDF viewer template, the caption cache, and the result cache -
+# stays warm between jobs.
+#
+# Jobs name files to read and write with the service's permissions, and
+# there is no authentication, so the service only listens on a loopback
+# address.
+#
+# HTTP API (request and response bodies are JSON):
+#
+#   POST /jobs       submit job: {"zip": <OCW zip file or content directory>,
+#                                 "output": <output filename, or list of output filenames>,
+#                                 "include_media": true, "video_start_offset": 0}
+#                    returns the job, including its "id"
+#   GET  /jobs       list all jobs (finished jobs are only kept until there are
+#                    keep_finished newer finished ones)
+#   GET  /jobs/<id>  job status: "queued", "running", "done", or "failed", with
+#                    timings (seconds) for time spent queued and running, and
+#                    progress (sections done and total, ETA, time of last update)
+#   GET  /status     service status: workers, queue length, cache statistics
+
+import json
+import time
+import Queue
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from collections import OrderedDict
+
+from captions import CaptionCache
+from progress import ProgressReporter
+from cache import ResultCache
+
+#-----------------------------------------------------------------------------
+
+def is_loopback(host):
+    '''
+    True if host (name or IPv4 address) is a loopback address, so only reachable from this machine
+    '''
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+class ConversionService(object):
+    '''
+    Queue of conversion jobs, run by a pool of worker threads sharing warm caches.
+    '''
+    def __init__(self, nworkers=2, cache_dir=None, cache_size=None, scratch_dir=None, verbose=False,
+                 keep_finished=1000):
+        '''
+        keep_finished = number of finished (done or failed) jobs kept for status requests; older
+                        finished jobs are forgotten
+        '''
+        self.caption_cache = CaptionCache()
+        self.cache = ResultCache(cache_dir, max_bytes=cache_size, verbose=verbose) if cache_dir else None
+        self.scratch_dir = scratch_dir
+        self.verbose = verbose
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()
+        self.last_id = 0
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.workers = []
+        for k in range(nworkers):
+            worker = threading.Thread(target=self.work, name="ocw2edx-worker-%d" % k)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, zfn, output=None, include_media=True, video_start_offset=0):
+        '''
+        Queue a conversion job, and return the job (dict)
+        '''
+        if isinstance(output, basestring):
+            output = [output]
+        with self.lock:
+            self.last_id += 1
+            job = {'id': self.last_id,
+                   'zip': zfn,
+                   'output': output,
+                   'options': dict(include_media=include_media, video_start_offset=video_start_offset),
+                   'status': 'queued',
+                   'submitted': time.time(),
+                   }
+            self.jobs[job['id']] = job
+        self.queue.put(job)
+        return dict(job)
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def status(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'workers': len(self.workers),
+                'queued': self.queue.qsize(),
+                'jobs': counts,
+                'caption_cache': self.caption_cache.summary(),
+                'result_cache': self.cache.summary() if self.cache else None,
+                }
+
+    def work(self):
+        '''
+        Worker thread: run jobs from the queue, until a None job is taken (see stop)
+        '''
+        from main import convert
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            with self.lock:
+                job['status'] = 'running'
+                job['started'] = time.time()
+                job['queue_time'] = job['started'] - job['submitted']
+            def update_progress(event, progress, job=job):
+                with self.lock:
+                    job['progress'] = progress
+            try:
+                ocwc = convert(job['zip'], job['output'], job['options'], cache=self.cache,
+                               caption_cache=self.caption_cache, scratch_dir=self.scratch_dir, verbose=self.verbose,
+                               progress=ProgressReporter(callbacks=[update_progress]))
+                result = {'status': 'done',
+                          'from_cache': ocwc is None,
+                          'output': ocwc.outfns if ocwc else job['output'],
+                          }
+            except Exception as err:
+                result = {'status': 'failed',
+                          'error': str(err),
+                          }
+            with self.lock:
+                job.update(result)
+                job['finished'] = time.time()
+                job['run_time'] = job['finished'] - job['started']
+                self.prune()
+
+    def prune(self):
+        '''
+        Forget the oldest finished jobs, beyond the newest keep_finished of them (call with the lock held)
+        '''
+        finished = [x['id'] for x in self.jobs.values() if x['status'] in ['done', 'failed']]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self.jobs[job_id]
+
+    def stop(self):
+        '''
+        Stop the worker threads, once the jobs already queued are done
+        '''
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def make_server(self, host="127.0.0.1", port=8765):
+        '''
+        Return HTTP server for this service; call its serve_forever() method to start serving.
+        host must be a loopback address (see is_loopback).
+        '''
+        if not is_loopback(host):
+            raise ValueError("conversion service only listens on loopback addresses, not %s" % host)
+        server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+        server.service = self
+        return server
+
+#-----------------------------------------------------------------------------
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ServiceRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    JSON over HTTP interface to a ConversionService
+    '''
+    def send_json(self, data, code=200):
+        body = json.dumps(data, indent=4)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip('/').split('/')
+        if parts==['status']:
+            return self.send_json(service.status())
+        if parts==['jobs']:
+            return self.send_json(service.list_jobs())
+        if len(parts)==2 and parts[0]=='jobs' and parts[1].isdigit():
+            job = service.get_job(int(parts[1]))
+            if job:
+                return self.send_json(job)
+        self.send_json({'error': 'not found: %s' % self.path}, 404)
+
+    def do_POST(self):
+        if self.path.strip('/')!='jobs':
+            return self.send_json({'error': 'not found: %s' % self.path}, 404)
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            job = self.server.service.submit(data['zip'], data.get('output'),
+                                             include_media=data.get('include_media', True),
+                                             video_start_offset=data.get('video_start_offset', 0))
+        except Exception as err:
+            return self.send_json({'error': 'bad job request: %s' % err}, 400)
+        self.send_json(job, 202)
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    import os
+    import shutil
+    import urllib2
+    import tempfile
+    from path import path
+    from ocw2xbundle import OCWCourse, make_test_course, read_tree
+
+    assert is_loopback("localhost") and is_loopback("127.0.0.1")
+    assert not is_loopback("0.0.0.0") and not is_loopback("no.such.host.invalid")
+
+    tdir = path(tempfile.mkdtemp(prefix="tmp_service_test"))
+    service = ConversionService(nworkers=2)
+    server = service.make_server(port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = "http://%s:%d" % server.server_address
+        def request(rpath, data=None):
+            return json.loads(urllib2.urlopen(url + rpath, json.dumps(data) if data else None).read())
+
+        cdir = make_test_course(tdir, nsections=2)
+        ids = [request("/jobs", {"zip": cdir, "output": tdir / ("out%d" % k)})['id'] for k in range(3)]
+        bad_id = request("/jobs", {"zip": tdir / "missing"})['id']
+        for k in range(100):
+            jobs = request("/jobs")
+            if all(job['status'] in ['done', 'failed'] for job in jobs):
+                break
+            time.sleep(0.2)
+        assert [request("/jobs/%d" % x)['status'] for x in ids]==['done'] * 3
+        assert request("/jobs/%d" % bad_id)['status']=='failed'
+        assert request("/jobs/%d" % ids[0])['run_time'] > 0
+        assert request("/jobs/%d" % ids[0])['progress']['sections_done']==2
+        assert request("/status")['jobs']=={'done': 3, 'failed': 1}
+
+        service.keep_finished = 2
+        last_id = request("/jobs", {"zip": tdir / "missing"})['id']
+        for k in range(100):
+            if request("/jobs")[-1]['status']=='failed':
+                break
+            time.sleep(0.1)
+        assert [x['id'] for x in request("/jobs")]==[bad_id, last_id]		# older finished jobs forgotten
+        assert service.submit(tdir / "missing")['id']==last_id + 1			# ids are not reused
+        service.keep_finished = 1000
+
+        OCWCourse(fn=cdir, ofn=tdir / "serial", verbose=False).process()
+        serial = read_tree(tdir / "serial")
+        for k in range(3):
+            assert read_tree(tdir / ("out%d" % k))==serial
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+        shutil.rmtree(tdir)
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+#
+# Statistics of a converted edX course, for capacity planning of Studio
+# imports: element counts and maximum depth, and where the bytes go - the
+# static files (PDFs among them), videos, and caption files used by each
+# chapter and sequential.  All are collected in a single traversal of the
+# course XML.  The statistics are a plain dict, to be saved as JSON and
+# compared across runs.
+
+import re
+
+STATIC_REF = re.compile(r'''/static/([^"'\s<>?#]+)''')
+CAPTION_FILE = "static/subs_%s.srt.sjson"		# as written by OCWCourse.get_caption_file
+
+#-----------------------------------------------------------------------------
+
+def new_record(elem):
+    return {'display_name': elem.get('display_name', ''), 'static_files': 0, 'static_bytes': 0, 'pdfs': 0,
+            'videos': 0, 'caption_bytes': 0}
+
+def finish_record(record, refs, static_sizes):
+    '''
+    Fill in the static file totals of record, from refs (set of static paths it uses)
+    '''
+    for ref in refs:
+        size = static_sizes[ref]
+        record['static_files'] += 1
+        record['static_bytes'] += size
+        if ref.lower().endswith('.pdf'):
+            record['pdfs'] += 1
+        if ref.startswith('static/subs_'):
+            record['caption_bytes'] += size
+
+def course_statistics(course, static_sizes):
+    '''
+    Return statistics of course (<course> element of an xbundle), with static_sizes = dict of
+    edX static path (e.g. "static/images/course_image.jpg") -> size in bytes of the static files:
+
+      counts     = dict of tag -> number of elements
+      max_depth  = depth of the most deeply nested element (the course is at depth 1)
+      static_files, static_bytes = number and total size of all the static files
+      course     = totals for the course: static files used (referenced as /static/... in the
+                   XML, or captions of its videos), and their bytes, PDFs, videos, and caption bytes
+      chapters   = list of the same totals for each chapter, with a list of those for each of
+                   its sequentials
+
+    A static file used several times within a chapter or sequential is counted once for it.
+    '''
+    counts = {}
+    max_depth = 0
+    total = new_record(course)
+    chapters = []
+    refs = {id(total): set()}
+
+    def add_refs(paths, records, prefix='static/'):
+        for ref in paths:
+            ref = prefix + ref
+            if ref in static_sizes:
+                for record in records:
+                    refs[id(record)].add(ref)
+
+    stack = [(course, 1, (total,))]
+    while stack:
+        elem, depth, records = stack.pop()
+        tag = elem.tag
+        if not isinstance(tag, basestring):		# comment or processing instruction
+            continue
+        counts[tag] = counts.get(tag, 0) + 1
+        max_depth = max(max_depth, depth)
+
+        if elem.tail and '/static/' in elem.tail:	# the tail is content of the parent
+            add_refs(STATIC_REF.findall(elem.tail), records)
+
+        if tag=='chapter' and len(records)==1:
+            record = new_record(elem)
+            record['sequentials'] = []
+            chapters.append(record)
+            records = records + (record,)
+            refs[id(record)] = set()
+        elif tag=='sequential' and len(records)==2:
+            record = new_record(elem)
+            records[1]['sequentials'].append(record)
+            records = records + (record,)
+            refs[id(record)] = set()
+
+        for text in [elem.text] + elem.attrib.values():
+            if text and '/static/' in text:
+                add_refs(STATIC_REF.findall(text), records)
+        if tag=='video':
+            for record in records:
+                record['videos'] += 1
+            ytid = elem.get('youtube', '').split(':', 1)[-1]
+            if ytid:
+                add_refs([CAPTION_FILE % ytid], records, prefix='')
+
+        stack.extend((child, depth + 1, records) for child in reversed(elem))
+
+    for record in [total] + chapters + [seq for chapter in chapters for seq in chapter['sequentials']]:
+        finish_record(record, refs[id(record)], static_sizes)
+    del total['display_name']
+    return {'counts': counts,
+            'max_depth': max_depth,
+            'static_files': len(static_sizes),
+            'static_bytes': sum(static_sizes.values()),
+            'course': total,
+            'chapters': chapters,
+            }
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    from lxml import etree
+    course = etree.XML('''<course>
+  <chapter display_name="Week 1">
+    <sequential display_name="Lecture 1">
+      <vertical>
+        <html><p><a href="/static/notes1.pdf">notes</a> <img src="/static/fig.png"/></p>
+          <p>see <a href="/static/notes1.pdf#page=2">page 2</a></p></html>
+        <video youtube="1.0:abc" display_name="Video"/>
+      </vertical>
+    </sequential>
+    <sequential display_name="Lecture 2">
+      <html><script>var pdf = '/static/notes2.pdf';</script>also /static/fig.png</html>
+    </sequential>
+  </chapter>
+  <chapter display_name="Week 2"><!-- nothing --></chapter>
+</course>''')
+    sizes = {'static/notes1.pdf': 1000, 'static/notes2.pdf': 2000, 'static/fig.png': 300,
+             'static/subs_abc.srt.sjson': 40, 'static/unused.pdf': 5}
+    stats = course_statistics(course, sizes)
+    assert stats['counts']['sequential']==2 and stats['counts']['p']==2 and 'vertical' in stats['counts']
+    assert stats['max_depth']==7				# course chapter sequential vertical html p a
+    assert (stats['static_files'], stats['static_bytes'])==(5, 3345)
+    assert stats['course']=={'static_files': 4, 'static_bytes': 3340, 'pdfs': 2, 'videos': 1, 'caption_bytes': 40}
+    week1, week2 = stats['chapters']
+    assert (week1['static_bytes'], week1['pdfs'], week1['videos']) == (3340, 2, 1)
+    lec1, lec2 = week1['sequentials']
+    assert (lec1['display_name'], lec1['static_files'], lec1['static_bytes'], lec1['caption_bytes'])==('Lecture 1', 3, 1340, 40)
+    assert (lec2['static_files'], lec2['static_bytes'], lec2['pdfs'], lec2['videos'])==(2, 2300, 1, 0)
+    assert week2=={'display_name': 'Week 2', 'static_files': 0, 'static_bytes': 0, 'pdfs': 0, 'videos': 0,
+                   'caption_bytes': 0, 'sequentials': []}
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#
+# Compact model of the structure of an edX course.
+#
+# The structural nodes of a course (course, chapter, sequential, vertical,
+# descriptor, ...) are Node instances with __slots__, parent and children
+# pointers, and interned tag names, instead of lxml elements; the content
+# (html, problem, video, ...) stays as opaque payloads, either lxml elements
+# or their serialized bytes.  This is for operations which only look at the
+# course structure (url_names, descriptors, statistics, comparisons), which on
+# lxml elements pay for a proxy object and a C call per findall, getparent,
+# and attribute access.  See benchmarks.bench_structure for how the two
+# compare, in memory and traversal time.
+
+from copy import deepcopy
+
+from lxml import etree
+
+#-----------------------------------------------------------------------------
+
+STRUCTURE_TAGS = ['course', 'chapter', 'sequential', 'vertical', 'descriptor', 'section', 'videosequence',
+                  'problemset', 'wrapper', 'conditional', 'randomize', 'split_test', 'library_content']
+
+def itag(tag):
+    '''
+    Interned tag name, so all nodes with the same tag share one string
+    '''
+    return intern(str(tag))
+
+class Node(object):
+    '''
+    Structural node of a course: tag, attributes (dict, or None if there are none), parent Node,
+    list of children Nodes, and payload (None for structural nodes; lxml element or serialized
+    XML bytes for content).  Nodes with tags in STRUCTURE_TAGS must be structural.
+    '''
+    __slots__ = ['tag', 'attrib', 'parent', 'children', 'payload']
+
+    def __init__(self, tag, attrib=None, payload=None):
+        self.tag = itag(tag)
+        self.attrib = dict((itag(k), v) for k, v in attrib.items()) if attrib else None
+        self.parent = None
+        self.children = [] if payload is None else ()	# payloads have no child nodes
+        self.payload = payload
+
+    def __repr__(self):
+        return "<Node %s %s>" % (self.tag, self.get('display_name', ''))
+
+    def get(self, key, default=None):
+        if self.attrib is None:
+            return default
+        return self.attrib.get(key, default)
+
+    def set(self, key, value):
+        if self.attrib is None:
+            self.attrib = {}
+        self.attrib[itag(key)] = value
+
+    def append(self, child):
+        if child.parent is not None:
+            child.parent.children.remove(child)
+        child.parent = self
+        self.children.append(child)
+        return child
+
+    def insert(self, index, child):
+        if child.parent is not None:
+            child.parent.children.remove(child)
+        child.parent = self
+        self.children.insert(index, child)
+        return child
+
+    def iter(self, tag=None):
+        '''
+        Iterate over this node and its descendants, depth first, in document order; only those
+        with the given tag, if given.
+        '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if tag is None or node.tag==tag:
+                yield node
+            stack.extend(reversed(node.children))
+
+    def structure(self):
+        '''
+        Iterate over this node and its structural descendants, depth first, in document order,
+        without visiting payloads (usually most of the nodes)
+        '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend([x for x in reversed(node.children) if x.payload is None])
+
+    def findall(self, tag):
+        '''
+        List of descendants with the given tag (like lxml's findall('.//tag')); for a structural
+        tag, only the structural nodes are searched
+        '''
+        nodes = self.structure() if tag in STRUCTURE_TAGS else self.iter()
+        return [x for x in nodes if x.tag==tag and x is not self]
+
+    def ancestors(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def depth(self):
+        '''
+        Depth of this node in its tree (the root is at depth 1)
+        '''
+        return sum(1 for x in self.ancestors()) + 1
+
+    def is_structure(self):
+        return self.payload is None
+
+    def to_xml(self):
+        '''
+        Return lxml element tree for this node; payloads are copied, so this tree is left unchanged
+        '''
+        if self.payload is not None:
+            if isinstance(self.payload, basestring):
+                return etree.fromstring(self.payload)
+            return deepcopy(self.payload)
+        elem = etree.Element(self.tag, self.attrib or {})
+        for child in self.children:
+            elem.append(child.to_xml())
+        return elem
+
+
+def from_xml(xml, as_bytes=False, structure_tags=STRUCTURE_TAGS):
+    '''
+    Return Node tree for xml (lxml element, e.g. XBundle.course).  Elements with tags in
+    structure_tags become structural nodes; all others (and their subtrees) become payloads,
+    which are copies of the lxml elements, or their serialized XML, if as_bytes is True.
+    Comments between structural elements are dropped.
+    '''
+    root = Node(xml.tag, xml.attrib)
+    stack = [(xml, root)]
+    while stack:
+        elem, node = stack.pop()
+        for child in elem:
+            if not isinstance(child.tag, basestring):	# comment or processing instruction
+                continue
+            if child.tag in structure_tags:
+                cnode = node.append(Node(child.tag, child.attrib))
+                stack.append((child, cnode))
+            else:
+                payload = etree.tostring(child, with_tail=False) if as_bytes else deepcopy(child)
+                if not as_bytes:
+                    payload.tail = None
+                node.append(Node(child.tag, payload=payload))
+    return root
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    xml = etree.XML('''<course semester="2013_Spring">
+  <chapter display_name="Week 1">
+    <!-- comment -->
+    <sequential display_name="Lecture 1">
+      <vertical display_name="Part 1"><html display_name="Notes"><p>Some <b>text</b></p></html></vertical>
+      <vertical><video youtube="1.0:abc"/><problem><p>Q</p></problem></vertical>
+    </sequential>
+  </chapter>
+</course>''')
+    for as_bytes in [False, True]:
+        root = from_xml(xml, as_bytes=as_bytes)
+        assert [x.tag for x in root.iter()]==['course', 'chapter', 'sequential', 'vertical', 'html', 'vertical',
+                                              'video', 'problem']
+        assert [x.get('display_name') for x in root.findall('vertical')]==['Part 1', None]
+        assert [x.tag for x in root.structure()]==['course', 'chapter', 'sequential', 'vertical', 'vertical']
+        html = root.findall('html')[0]
+        assert not html.is_structure() and html.children==()
+        assert [x.tag for x in html.ancestors()]==['vertical', 'sequential', 'chapter', 'course'] and html.depth()==5
+        assert root.findall('chapter')[0].tag is root.findall('sequential')[0].parent.tag	# interned
+        rebuilt = root.to_xml()
+        strip = lambda s: ''.join(s.split())
+        expected = etree.tostring(xml).replace('<!-- comment -->', '')
+        assert strip(etree.tostring(rebuilt))==strip(expected)
+        assert root.to_xml() is not rebuilt and html.to_xml() is not html.to_xml()
+
+    seq = root.findall('sequential')[0]
+    vert = Node('vertical', {'display_name': 'Part 0'})
+    seq.insert(0, vert)
+    vert.append(seq.children[1].children[0])		# move html from Part 1 to Part 0
+    assert [len(x.children) for x in seq.children]==[1, 0, 2] and html.parent is vert
+    assert not hasattr(vert, '__dict__')
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+#
+# Watch-folder mode: convert OCW zip files as they arrive in a directory.
+#
+# New and changed zip files in the watched directory are converted, once
+# they have finished being written (their size and modification time have
+# stayed the same for a settling time, and they are complete zip files).
+# Conversions run on the bounded worker pool of a ConversionService.  Each
+# zip file's output goes to <output dir>/<zip file name>.tar.gz, and the
+# status of every zip file seen is kept in a ledger, <output dir>/ledger.json,
+# so zip files already converted are not converted again when the watcher
+# is restarted.
+#
+# inotify (via pyinotify, if installed) is used to notice new files
+# promptly; otherwise the directory is polled.
+
+import os
+import json
+import time
+import zipfile
+
+from path import path	# needs path.py
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from service import ConversionService
+from log import get_logger
+
+log = get_logger("watch")
+
+#-----------------------------------------------------------------------------
+
+class FolderWatcher(object):
+    '''
+    Convert new and changed zip files in a watched directory, keeping a status ledger.
+    '''
+    def __init__(self, watch_dir, output_dir=None, service=None, settle_time=2.0, poll_interval=2.0,
+                 use_inotify=True, verbose=True):
+        '''
+        watch_dir = directory to watch for OCW zip files
+        output_dir = directory for output files and ledger.json (default: <watch_dir>/ocw2edx_output)
+        service = ConversionService which runs the conversions (default: one with 2 workers)
+        settle_time = seconds a zip file's size and modification time must stay the same before it is converted
+        poll_interval = seconds between scans of the directory (when not woken up by inotify)
+        '''
+        self.dir = path(watch_dir).abspath()
+        self.output_dir = path(output_dir or self.dir / "ocw2edx_output").abspath()
+        if not self.output_dir.exists():
+            os.makedirs(self.output_dir)
+        self.service = service or ConversionService()
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+        self.ledger_fn = self.output_dir / "ledger.json"
+        self.ledger = json.load(open(self.ledger_fn)) if self.ledger_fn.exists() else {}
+        for entry in self.ledger.values():
+            if entry['status'] in ['queued', 'running']:	# interrupted last time: convert again
+                entry['status'] = 'interrupted'
+        self.pending = {}		# zip filename -> (stat signature, time it was first seen with that signature)
+        self.notifier = None
+        if use_inotify and pyinotify is not None:
+            wm = pyinotify.WatchManager()
+            wm.add_watch(self.dir, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+            self.notifier = pyinotify.Notifier(wm, lambda event: None)
+
+    @staticmethod
+    def signature(fn):
+        st = os.stat(fn)
+        return [st.st_size, st.st_mtime]
+
+    def save_ledger(self):
+        tmpfn = self.ledger_fn + ".tmp"
+        with open(tmpfn, 'w') as fp:
+            json.dump(self.ledger, fp, indent=4, sort_keys=True)
+        os.rename(tmpfn, self.ledger_fn)
+
+    def scan(self):
+        '''
+        Submit conversion jobs for zip files which are new or changed, and have finished being written.
+        Returns number of jobs submitted.
+        '''
+        now = time.time()
+        nsubmitted = 0
+        for fn in sorted(self.dir.files("*.zip")):
+            name = str(fn.basename())
+            try:
+                sig = self.signature(fn)
+            except OSError:			# removed since listed
+                continue
+            entry = self.ledger.get(name)
+            if entry and entry['signature']==sig and entry['status']!='interrupted':
+                continue			# already converted, or being converted
+            seen_sig, seen_time = self.pending.get(name, (None, None))
+            if seen_sig!=sig:
+                self.pending[name] = (sig, now)	# new, or still being written
+                continue
+            if now - seen_time < self.settle_time or not zipfile.is_zipfile(fn):
+                continue
+            del self.pending[name]
+            ofn = self.output_dir / (fn.namebase + ".tar.gz")
+            job = self.service.submit(fn, str(ofn))
+            self.ledger[name] = {'signature': sig,
+                                 'status': 'queued',
+                                 'job': job['id'],
+                                 'output': str(ofn),
+                                 'submitted': job['submitted'],
+                                 }
+            nsubmitted += 1
+            if self.verbose:
+                log.info("Queued %s -> %s", fn, ofn)
+        return nsubmitted
+
+    def update(self):
+        '''
+        Update ledger with the status of submitted jobs.  Returns number of jobs still queued or running.
+        '''
+        nactive = 0
+        for name, entry in self.ledger.items():
+            if entry['status'] not in ['queued', 'running']:
+                continue
+            job = self.service.get_job(entry['job'])
+            if job is None:					# finished, and forgotten by the service
+                job = {'status': 'failed', 'error': "job record no longer kept by the service"}
+            for key in ['status', 'queue_time', 'run_time', 'error']:
+                if key in job:
+                    entry[key] = job[key]
+            if entry['status'] in ['queued', 'running']:
+                nactive += 1
+            elif self.verbose:
+                log.info("%s: %s", name, entry['status'])
+        return nactive
+
+    def poll(self):
+        '''
+        One round of watching: scan the directory, and update and save the ledger.
+        Returns number of jobs still queued or running.
+        '''
+        self.scan()
+        nactive = self.update()
+        self.save_ledger()
+        return nactive
+
+    def wait(self):
+        '''
+        Wait until a file in the watched directory is written (with inotify), or the poll interval passes
+        '''
+        if self.notifier is not None:
+            if self.notifier.check_events(timeout=int(self.poll_interval * 1000)):
+                self.notifier.read_events()
+                self.notifier.process_events()
+        else:
+            time.sleep(self.poll_interval)
+
+    def run(self):
+        '''
+        Watch the directory until interrupted
+        '''
+        if self.verbose:
+            log.info("Watching %s (%s), output to %s", self.dir, "inotify" if self.notifier else "polling", self.output_dir)
+        try:
+            while True:
+                self.poll()
+                self.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.service.stop()
+            self.update()
+            self.save_ledger()
+
+#-----------------------------------------------------------------------------
+
+def test1():
+    import shutil
+    import tarfile
+    import tempfile
+    from ocw2xbundle import make_test_course
+
+    tdir = path(tempfile.mkdtemp(prefix="tmp_watch_test"))
+    try:
+        cdir = make_test_course(tdir, nsections=2)
+        wdir = tdir / "incoming"
+        os.mkdir(wdir)
+        def make_zip(zfn):
+            zf = zipfile.ZipFile(zfn, 'w')
+            for fn in cdir.walkfiles():
+                zf.write(fn, tdir.relpathto(fn))
+            zf.close()
+
+        watcher = FolderWatcher(wdir, settle_time=0, use_inotify=False, verbose=False)
+        open(wdir / "partial.zip", 'w').write("PK")		# not a complete zip file
+        make_zip(wdir / "course.zip")
+        assert watcher.scan()==0			# first sighting: wait to see the file is not still growing
+        assert watcher.scan()==1
+        while watcher.poll():
+            time.sleep(0.1)
+        assert watcher.ledger['course.zip']['status']=='done'
+        assert 'partial.zip' not in watcher.ledger
+        ofn = watcher.output_dir / "course.tar.gz"
+        assert 'course/course.xml' in tarfile.open(ofn).getnames()
+
+        watcher.service.stop()
+        watcher = FolderWatcher(wdir, settle_time=0, use_inotify=False, verbose=False)	# restart: ledger is kept
+        watcher.scan()
+        assert watcher.scan()==0
+        os.utime(wdir / "course.zip", (1, 1))		# changed
+        watcher.scan()
+        assert watcher.scan()==1
+        while watcher.poll():
+            time.sleep(0.1)
+        assert json.load(open(watcher.ledger_fn))['course.zip']['status']=='done'
+        watcher.service.stop()
+    finally:
+        shutil.rmtree(tdir)
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# Write a converted course (an XBundle plus its static files) out in one of
+# the output formats:
+#
+#   *.xml           xbundle file, with static files in static/ next to it
+#   *.tar.gz, *.tgz tarball of edX course directory, for Studio import
+#   otherwise       edX course directory
+#
+# Used both by OCWCourse.export, and by "ocw2edx emit" from a saved
+# intermediate course artifact.
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+
+from path import path	# needs path.py
+from log import get_logger
+
+def get_writer_logger(verbose):
+    return get_logger("writer", min_level=(logging.NOTSET if verbose else logging.WARNING))
+
+#-----------------------------------------------------------------------------
+
+def file_digest(fn):
+    h = hashlib.sha1()
+    with open(fn, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), ''):
+            h.update(chunk)
+    return h.digest()
+
+def same_content(src, dfn):
+    return os.path.getsize(src)==os.path.getsize(dfn) and file_digest(src)==file_digest(dfn)
+
+def copy_static_files(files_to_copy, destdir, verbose=True, progress=None):
+    '''
+    Copy static files specified in files_to_copy (dict of source filename -> edX static destination)
+    to the destdir, skipping those already there with the same content.  The bytes copied are reported
+    to progress (ProgressReporter), if given.  Returns report dict, with lists of static files added
+    and changed, and the number unchanged.
+    '''
+    log = get_writer_logger(verbose)
+    report = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0}
+    for src, dst in files_to_copy.items():
+        dd = os.path.join(destdir, os.path.dirname(dst))
+        if not os.path.exists(dd):
+            log.debug("    mkdir -p '%s'", dd)
+            os.makedirs(dd)
+        dfn = os.path.join(destdir, dst)
+        try:
+            exists = os.path.exists(dfn)
+            if exists and same_content(src, dfn):
+                report['unchanged'] += 1
+                continue
+            log.debug("    cp '%s' '%s'", src, dfn)
+            shutil.copy(src, dfn)
+            report['changed' if exists else 'added'].append(dst)
+            if progress is not None:
+                progress.file_copied(os.path.getsize(dfn))
+        except (IOError, OSError) as err:
+            log.error("failed to copy %s to %s: %s", src, dfn, err)
+    return report
+
+
+def remove_orphaned_static_files(files_to_copy, destdir):
+    '''
+    Remove files in destdir/static which are not in files_to_copy (left over from an earlier
+    export), with any directories left empty.  Returns list of the files removed.
+    '''
+    keep = set(os.path.normpath(dst) for dst in files_to_copy.values())
+    removed = []
+    for root, dirs, files in os.walk(os.path.join(destdir, 'static'), topdown=False):
+        for fn in files:
+            rel = os.path.normpath(os.path.relpath(os.path.join(root, fn), destdir))
+            if rel not in keep:
+                os.unlink(os.path.join(root, fn))
+                removed.append(rel)
+        if not os.listdir(root):
+            os.rmdir(root)
+    return sorted(removed)
+
+
+def write_output(xb, files_to_copy, outfn, verbose=True, scratch=None, progress=None):
+    '''
+    Write XBundle xb, with static files files_to_copy, to outfn; the output format is
+    determined by the filename.  For xbundle .xml output, the static files go into
+    the static directory next to the .xml file.
+
+    scratch = ScratchSpace in which to stage .tar.gz output (default: system temporary directory)
+    progress = ProgressReporter to which bytes of static files copied are reported
+
+    For directory output, only files whose content has changed are rewritten, and files left over
+    from an earlier export are removed.  Returns report dict, with lists of the files added, changed,
+    and removed, and the number of files unchanged.
+    '''
+    log = get_writer_logger(verbose)
+    if progress is not None:
+        progress.set_stage('writing %s' % os.path.basename(outfn))
+    outfn = os.path.abspath(outfn)
+    if outfn.endswith(".xml"):
+        xb.save(outfn)
+        report = copy_static_files(files_to_copy, os.path.dirname(outfn), verbose=verbose, progress=progress)
+    elif outfn.endswith(".tar.gz") or outfn.endswith(".tgz"):
+        if scratch is not None:
+            tempd = scratch.mkdtemp(prefix="tmp_ocw2xbundle")
+        else:
+            tempd = tempfile.mkdtemp(prefix="tmp_ocw2xbundle")
+        try:
+            cdir = path(tempd) / "course"
+            os.mkdir(cdir)
+            report = copy_static_files(files_to_copy, cdir, verbose=verbose, progress=progress)
+            xb.export_to_directory(cdir, dir_include_course_id=False)
+            if scratch is not None:
+                scratch.check()
+            cmd = ['tar', 'czf', outfn, '-C', tempd, 'course']
+            log.info("%s", ' '.join(cmd))
+            subprocess.check_call(cmd)
+        finally:
+            shutil.rmtree(tempd)
+    else:
+        if not os.path.exists(outfn):
+            log.info("Making directory for output: %s", outfn)
+            os.mkdir(outfn)
+        report = copy_static_files(files_to_copy, outfn, verbose=verbose, progress=progress)
+        report['removed'] = remove_orphaned_static_files(files_to_copy, outfn)
+        olx_report = xb.export_to_directory(outfn, dir_include_course_id=False)
+        for key in ['added', 'changed', 'removed']:
+            report[key] = sorted(report[key] + olx_report[key])
+        report['unchanged'] += olx_report['unchanged']
+        log.info("Updated %s: %d files added, %d changed, %d removed, %d unchanged", outfn, len(report['added']),
+                 len(report['changed']), len(report['removed']), report['unchanged'])
+    return report
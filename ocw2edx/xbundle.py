@@ -18,14 +18,22 @@
 import os
 import sys
 import re
+import json
 import string
 import glob
+import hashlib
 import tempfile
+import time
+import logging
+
+from copy import deepcopy
 
 from lxml import etree
-from lxml.html.soupparser import fromstring as fsbs
 from path import path	# needs path.py
 
+log = logging.getLogger("ocw2edx.xbundle")	# reported with the converter's log, when run by ocw2edx
+log.addHandler(logging.NullHandler())		# silent unless the application configures logging
+
 #-----------------------------------------------------------------------------
 
 DEF_POLICY_JSON = """
@@ -120,12 +128,31 @@ class XBundle(object):
     PolicyTagMap = {'policy' : 'policy', 'gradingpolicy': 'grading_policy'}
     html_parser = etree.HTMLParser(compact=False,recover=True,remove_blank_text=True)
 
-    def __init__(self, keep_urls=False, force_studio_format=False, skip_hidden=False, keep_studio_urls=False):
+    CompactTags = ['html', 'problem']			# payloads written compactly, with compact_olx
+    CompactPreserveTags = ['pre', 'script', 'style', 'textarea', 'answer']	# whitespace kept as is in these
+    CompactBlockTags = ['address', 'article', 'aside', 'blockquote', 'body', 'caption', 'center', 'dd', 'div',
+                        'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4',
+                        'h5', 'h6', 'head', 'header', 'hr', 'html', 'legend', 'li', 'nav', 'ol', 'p', 'pre',
+                        'section', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul',
+                        # capa problems
+                        'additional_answer', 'checkboxgroup', 'choice', 'choicegroup', 'choiceresponse',
+                        'coderesponse', 'customresponse', 'demandhint', 'formulaequationinput',
+                        'formularesponse', 'hint', 'hintgroup', 'imageinput', 'imageresponse', 'jsinput',
+                        'multiplechoiceresponse', 'numericalresponse', 'optioninput', 'optionresponse',
+                        'problem', 'responseparam', 'schematicresponse', 'solution', 'stringresponse',
+                        'text', 'textline']		# whitespace around other (or unknown) tags is kept
+    ImportNormalizers = ['fix_old_course_section', 'fix_old_descriptor_name']	# run in this order on import
+
+    def __init__(self, keep_urls=False, force_studio_format=False, skip_hidden=False, keep_studio_urls=False,
+                 compact_olx=False):
         '''
         if keep_urls=True then the original url_name attributes are kept upon import and export,
         if nonrandom (ie non-Studio).
         
         if keep_studio_urls=True and keep_urls=True, then keep random urls.
+        
+        if compact_olx=True then html and problem files are exported without insignificant
+        whitespace and comments, instead of pretty-printed (see compact_xml).
         '''
         self.course = etree.Element('course')
         self.metadata = etree.Element('metadata')
@@ -134,7 +161,11 @@ class XBundle(object):
         self.keep_urls = keep_urls
         self.force_studio_format = force_studio_format	# sequential must be followed by vertical in export
         self.skip_hidden = skip_hidden
+        self.policy = {}			# policy index: tag/url_name -> dict of metadata (see load_policy_index)
         self.keep_studio_urls = keep_studio_urls
+        self.compact_olx = compact_olx
+        self.normalizers = [(name, getattr(self, name)) for name in self.ImportNormalizers]
+        self.normalize_timing = {}		# normalizer name -> seconds spent in it
         return
 
         
@@ -224,14 +255,16 @@ class XBundle(object):
     def import_metadata_from_directory(self, dir):
         # load policies
         # print "ppath = ", (path(dir) / 'policies/*')
-        for pdir in glob.glob(path(dir) / 'policies/*'):
+        for pdir in sorted(glob.glob(path(dir) / 'policies/*')):
             # print "pdir=",pdir
             policies = etree.Element('policies')
             policies.set('semester',os.path.basename(pdir))
-            for fn in glob.glob(path(pdir) / '*.json'):
+            for fn in sorted(glob.glob(path(pdir) / '*.json')):
                 x = etree.SubElement(policies,os.path.basename(fn).replace('_','').replace('.json',''))
                 x.text = open(fn).read()
             self.add_policies(policies)
+        if self.skip_hidden:			# the index is only used to find hidden elements
+            self.policy = self.load_policy_index(dir)
         
         # load about files
         for afn in glob.glob(dir / 'about/*'):
@@ -241,6 +274,33 @@ class XBundle(object):
                 print "Oops, failed to add file %s, error=%s" % (afn, err)
 
                 
+    def load_policy_index(self, dir):
+        '''
+        Return the policy index for the course in directory dir: dict of tag/url_name -> dict of
+        metadata, with values as strings, from the policy.json of the course's semester (the
+        url_name of its course.xml), parsed once here, instead of for each element.
+        '''
+        cfn = path(dir) / 'course.xml'
+        semester = etree.parse(cfn).getroot().get('url_name','') if os.path.exists(cfn) else ''
+        pxmls = self.metadata.findall('policies')
+        pxml = ([x for x in pxmls if x.get('semester')==semester] or pxmls[:1] or [None])[0]
+        if pxml is None or pxml.find('policy') is None:
+            return {}
+        try:
+            policy = json.loads(pxml.find('policy').text or '{}')
+        except Exception as err:
+            log.warning("Cannot parse policy.json for semester %s, ignoring it: %s", pxml.get('semester'), err)
+            return {}
+        def as_string(v):
+            return v if isinstance(v, basestring) else json.dumps(v)	# e.g. true -> "true"
+        return {key: {k: as_string(v) for k, v in meta.items()} for key, meta in policy.items() if isinstance(meta, dict)}
+
+    def is_hidden(self, xml, pkey):
+        '''
+        True if xml (or its policy metadata, with key pkey) has hide_from_toc=true
+        '''
+        return xml.get('hide_from_toc','')=='true' or self.policy.get(pkey, {}).get('hide_from_toc')=='true'
+
     def import_course_from_directory(self, dir):
         '''load course tree, removing intermediate descriptors with url_name'''
         dir = path(dir)
@@ -249,34 +309,64 @@ class XBundle(object):
         cxml = self.import_xml_removing_descriptor(dir, x)
         cxml.set('semester',semester)
         self.course = cxml
-        self.fix_old_course_section()
-        self.fix_old_descriptor_name(self.course)
+        self.normalize(self.course)
         # print self.pp_xml(self.course)
 
-        
+
+    def add_normalizer(self, name, handler):
+        '''
+        Add handler to the normalizers run on import (after the others); see normalize
+        '''
+        self.normalizers.append((name, handler))
+
+
+    def normalize(self, xml):
+        '''
+        Run all the normalizers on xml and its descendants, in a single (depth first) traversal.
+
+        Each normalizer is called as handler(elem), before elem's children are visited, and may
+        change elem and its children.  If it returns False, it is not called on elem's descendants.
+        The time spent in each normalizer is added up in self.normalize_timing.
+        '''
+        timing = self.normalize_timing
+        stack = [(xml, self.normalizers)]
+        while stack:
+            elem, handlers = stack.pop()
+            if not isinstance(elem.tag, basestring):	# comment or processing instruction
+                continue
+            active = []
+            for name, handler in handlers:
+                t0 = time.time()
+                ret = handler(elem)
+                timing[name] = timing.get(name, 0) + time.time() - t0
+                if ret is not False:
+                    active.append((name, handler))
+            if active:
+                stack.extend((child, active) for child in reversed(elem))
+
+
     def fix_old_descriptor_name(self, xml):
         '''
-        Turn name -> display_name on descriptor tags
+        Turn name -> display_name on descriptor tags (normalizer; not run below other tags)
         '''
-        if xml.tag in self.DescriptorTags:
-            if 'name' in xml.attrib and not xml.get('display_name',''):
-                xml.set('display_name',xml.get('name'))
-                xml.attrib.pop('name')
-            for child in xml:
-                self.fix_old_descriptor_name(child)
+        if xml.tag not in self.DescriptorTags:
+            return False
+        if 'name' in xml.attrib and not xml.get('display_name',''):
+            xml.set('display_name',xml.get('name'))
+            xml.attrib.pop('name')
 
 
-    def fix_old_course_section(self):
+    def fix_old_course_section(self, xml):
         '''
-        Remove <section>
+        Turn <section> into <sequential>, moving up the content of sequentials inside it (normalizer)
         '''
-        for sect in self.course.findall('.//section'):
-            for seq in sect.findall('.//sequential'):
+        if xml.tag=='section':
+            for seq in xml.findall('.//sequential'):
                 for k in seq:
                     seq.addprevious(k)
-                sect.remove(seq)		# remove sequential from inside section
-            sect.tag = 'sequential'
-        
+                xml.remove(seq)		# remove sequential from inside section
+            xml.tag = 'sequential'
+
 
     def is_not_random_urlname(self, un):
         if self.keep_studio_urls:		# keep url even if random looking
@@ -291,17 +381,12 @@ class XBundle(object):
         return False	# ie seems to be random
 
         
-    def update_metadata_from_policy(self, xml):
-        # update metadaa for this element from policy, if exists
-        policy = getattr(self,'policy')
-        pkey = '%s/%s' % (xml.tag, xml.get('url_name',xml.get('url_name_orig','<no_url_name>')))
-        if policy and pkey in policy:
-            #print "policy match for %s" % pkey
-            for (k,v) in policy[pkey].iteritems():
-                #if 'hide' in k:
-                #    print "metadata: %s" % [k,v]
-                if xml.get(k,None) is None:	# don't overwrite xml's metadata setting, if exists already
-                    xml.set(k,str(v))
+    def update_metadata_from_policy(self, xml, pkey=None):
+        # update metadata for this element from policy index, if exists; pkey = its policy key, if known
+        pkey = pkey or '%s/%s' % (xml.tag, xml.get('url_name',xml.get('url_name_orig','<no_url_name>')))
+        for (k,v) in self.policy.get(pkey, {}).iteritems():
+            if xml.get(k,None) is None:	# don't overwrite xml's metadata setting, if exists already
+                xml.set(k,v)
 
         
     def import_xml_removing_descriptor(self, dir, xml):
@@ -313,9 +398,17 @@ class XBundle(object):
         use its url_name, if that is available.
 
         dir should be a path.
+
+        With skip_hidden, elements hidden by hide_from_toc=true (in the element, or in the policy)
+        are left as they are, and for descriptors, their files are not even read.
         '''
         un = xml.get('url_name','')
+        pkey = None
         if xml.tag in self.DescriptorTags and 'url_name' in xml.attrib and un:
+            pkey = '%s/%s' % (xml.tag, un)
+            if self.skip_hidden and self.is_hidden(xml, pkey):
+                print "[xbundle] Skipping %s (%s), it has hide_from_toc=true" % (xml.tag, xml.get('display_name','<noname>'))
+                return xml
             unfn = un.replace(':','/')		# colon -> subdir slash in url_name
             fn = dir / xml.tag / (unfn+'.xml')
             if not os.path.exists(fn):
@@ -343,14 +436,7 @@ class XBundle(object):
                 if not dxml.tag=='course':	# special case: don't add display_name to course
                     dxml.set('display_name',un)
 
-            if self.skip_hidden:
-                self.update_metadata_from_policy(dxml)
-                if xml.get('hide_from_toc','')=='true':
-                    print "[xbundle] Skipping %s (%s), it has hide_from_toc=true" % (xml.tag, xml.get('display_name','<noname>'))
-                else:
-                    xml = dxml
-            else:
-                xml = dxml
+            xml = dxml
 
         fn = xml.get('filename','')
         if xml.tag in ['html','problem'] and fn: # special for <html filename="..." display_name="..."/>
@@ -387,7 +473,7 @@ class XBundle(object):
                 xml = dxml
             
         if self.skip_hidden:
-            self.update_metadata_from_policy(xml)
+            self.update_metadata_from_policy(xml, pkey)
             if xml.get('hide_from_toc','')=='true':
                 print "[xbundle] Skipping %s (%s), it has hide_from_toc=true" % (xml.tag, xml.get('display_name','<noname>'))
                 return xml
@@ -405,6 +491,13 @@ class XBundle(object):
         Export xbundle to edX xml directory
         First insert all the intermediate descriptors needed.
         Do about and XML separately.
+
+        The export is done on a copy of the course, and url_names are assigned afresh,
+        so the xbundle is left intact, and can be saved or exported again.
+
+        Files whose content is unchanged are not rewritten (so their mtimes are kept), and files
+        left over from an earlier export, in the directories the export writes to, are removed.
+        The files added, changed, and removed are listed in self.export_report.
         '''
         coursex = etree.Element('course')
         semester = self.course.get('semester')
@@ -412,9 +505,13 @@ class XBundle(object):
         coursex.set('org',self.course.get('org'))
         coursex.set('course',self.course.get('course'))
 
-        self.export = self.make_descriptor(self.course, semester)
-        self.export.append(self.course)
-        self.add_descriptors(self.course)
+        course = deepcopy(self.course)
+        urlnames = self.urlnames
+        self.urlnames = list(urlnames)
+        self.export = self.make_descriptor(course, semester)
+        self.export.append(course)
+        self.add_descriptors(course)
+        self.urlnames = urlnames
 
         # print self.pp_xml(self.export)
 
@@ -422,12 +519,55 @@ class XBundle(object):
             self.dir = self.mkdir(path(exdir) / self.course_id())
         else:
             self.dir = self.mkdir(path(exdir))
+        self.export_report = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0}
+        self.export_written = set()
         self.export_meta_to_directory()
         self.export_xml_to_directory(self.export[0])
 
         # write out top-level course.xml
 
-        open(self.dir/'course.xml','w').write(self.pp_xml(coursex))
+        self.write_file(self.dir/'course.xml', self.pp_xml(coursex))
+        self.remove_orphaned_files()
+        return self.export_report
+
+
+    def write_file(self, fn, data):
+        '''
+        Write data to file fn in the export directory, unless fn already has exactly that content
+        '''
+        rel = os.path.normpath(self.dir.relpathto(fn))
+        self.export_written.add(rel)
+        if os.path.exists(fn):
+            if os.path.getsize(fn)==len(data) and \
+               hashlib.sha1(open(fn, 'rb').read()).digest()==hashlib.sha1(data).digest():
+                self.export_report['unchanged'] += 1
+                return
+            self.export_report['changed'].append(rel)
+        else:
+            self.export_report['added'].append(rel)
+        with open(fn, 'w') as fp:
+            fp.write(data)
+
+
+    def remove_orphaned_files(self):
+        '''
+        Remove files not written by this export from the directories it writes to (descriptor tag
+        directories, policies, and about), with any directories left empty
+        '''
+        for sub in self.DescriptorTags + ['policies', 'about']:
+            sdir = self.dir / sub
+            if not sdir.isdir():
+                continue
+            for fn in sorted(sdir.walkfiles()):
+                rel = os.path.normpath(self.dir.relpathto(fn))
+                if rel not in self.export_written:
+                    os.unlink(fn)
+                    self.export_report['removed'].append(rel)
+            for dn in sorted(sdir.walkdirs(), reverse=True):
+                if not os.listdir(dn):
+                    os.rmdir(dn)
+            if not os.listdir(sdir) and sub not in ['policies', 'about']:
+                os.rmdir(sdir)
 
 
     def export_meta_to_directory(self):
@@ -440,16 +580,13 @@ class XBundle(object):
             dir = self.mkdir(pdir / semester)
             for k in pxml:
                 fn = self.PolicyTagMap.get(k.tag,k.tag) + '.json'
-                open(dir/fn,'w').write(k.text)	# write out content to policy directory file
+                self.write_file(dir/fn, k.text)	# write out content to policy directory file
         
         adir = self.mkdir(self.dir/'about')
         for fxml in self.metadata.findall('about/file'):
             fn = fxml.get('filename')
             try:
-                fp = open(adir/fn,'w')
-                if fxml.text is not None and len(fxml.text):
-                    fp.write(fxml.text)
-                fp.close()
+                self.write_file(adir/fn, fxml.text or '')
             except Exception as err:
                 self.errlog('failed to write about file %s, error %s' % (adir/fn, err))
 
@@ -468,7 +605,10 @@ class XBundle(object):
             if 'url_name_orig' in elem.attrib and self.keep_urls:
                 elem.attrib.pop('url_name_orig')
             edir = self.mkdir(self.dir / x.tag)
-            open(edir/un + '.xml','w').write(self.pp_xml(x))
+            if self.compact_olx and x.tag in self.CompactTags:
+                self.write_file(edir/un + '.xml', self.compact_xml(x))
+            else:
+                self.write_file(edir/un + '.xml', self.pp_xml(x))
             return un
 
         #print elem
@@ -514,6 +654,59 @@ class XBundle(object):
             os.popen('xmllint --format -o %s -' % tf.name, 'w').write(etree.tostring(xml))
             return open(tf.name).read()
 
+    def compact_xml(self, xml):
+        '''
+        Serialize xml (an html or problem payload) compactly, without insignificant whitespace and
+        comments.  Runs of whitespace become a single newline (if they contain one, so line-based
+        content like TeX comments keeps its meaning) or space, and are dropped next to the start
+        or end of block elements.  The content of <pre>, <script>, <style>, <textarea> and <answer>
+        is kept as is.  Changes xml.
+        '''
+        self.compact_element(xml, True)
+        return '<?xml version="1.0"?>\n' + etree.tostring(xml, encoding='utf-8') + '\n'
+
+    def compact_element(self, elem, block):
+        '''
+        Remove insignificant whitespace and comments within elem (recursively); block = True if elem is a block element
+        '''
+        if elem.tag in self.CompactPreserveTags or elem.get('{http://www.w3.org/XML/1998/namespace}space')=='preserve':
+            return
+        for child in list(elem):
+            if child.tag is etree.Comment:
+                self.remove_keeping_tail(child)
+
+        def is_block(x):
+            return x.tag in self.CompactBlockTags
+
+        children = list(elem)
+        elem.text = self.squeeze_space(elem.text, block, is_block(children[0]) if children else block)
+        for k, child in enumerate(children):
+            self.compact_element(child, is_block(child))
+            right = is_block(children[k + 1]) if k + 1 < len(children) else block
+            child.tail = self.squeeze_space(child.tail, is_block(child), right)
+
+    @staticmethod
+    def squeeze_space(text, strip_left, strip_right):
+        if not text:
+            return text
+        text = re.sub('[ \t\r\n]+', lambda m: '\n' if '\n' in m.group(0) else ' ', text)
+        if strip_left:
+            text = text.lstrip(' \n')
+        if strip_right:
+            text = text.rstrip(' \n')
+        return text or None
+
+    @staticmethod
+    def remove_keeping_tail(elem):
+        parent = elem.getparent()
+        if elem.tail:
+            prev = elem.getprevious()
+            if prev is not None:
+                prev.tail = (prev.tail or '') + elem.tail
+            else:
+                parent.text = (parent.text or '') + elem.tail
+        parent.remove(elem)
+
     def make_urlname(self, xml, parent=''):
         dn = xml.get('display_name','')
         s = dn
@@ -644,6 +837,194 @@ def RunTests():
 
             self.assertEqual(xbin,xbreloaded)
 
+        def testExportIsNonDestructive(self):
+
+            print "Testing XBundle export leaves the xbundle intact"
+            xb = XBundle(force_studio_format=True)
+            xb.set_course(etree.XML('''
+<course semester="2013_Spring" course="mitx.01">
+  <chapter display_name="Intro">
+    <sequential display_name="Overview">
+      <html display_name="Overview text">hello world</html>
+    </sequential>
+  </chapter>
+</course>'''))
+            xbin = str(xb)
+            tdir = path(tempfile.mkdtemp(prefix="tmp_xbundle_test"))
+            xb.export_to_directory(xb.mkdir(tdir / 'a'))
+            self.assertEqual(xbin, str(xb))
+            xb.export_to_directory(xb.mkdir(tdir / 'b'))
+            for fn in ['course.xml', 'chapter/Intro_chapter.xml', 'sequential/Overview_sequential.xml',
+                       'html/Overview_text_html.xml']:
+                self.assertEqual(open(tdir / 'a/mitx.01' / fn).read(), open(tdir / 'b/mitx.01' / fn).read())
+            os.system("rm -rf '%s'" % tdir)
+
+        def testCompactOLX(self):
+
+            print "Testing XBundle compact OLX export keeps html and problem content"
+            cxmls = '''
+<course semester="2013_Spring" course="mitx.01">
+  <chapter display_name="Intro">
+    <sequential display_name="Overview">
+      <html display_name="Overview text">
+        <!-- a comment -->
+        <h2>  Title  </h2>
+        <p>Some    <b>bold</b>   text,
+           on two lines <!-- inline comment --> and \\(x^2\\)</p>
+        <p>Old <del>text</del> removed, <mark>new</mark> added</p>
+        <pre>  keep
+    this   </pre>
+        <script type="text/javascript">
+  var x = 1;   // spacing kept
+        </script>
+      </html>
+      <problem display_name="Quiz">
+        <p>  Question  </p>
+        <script type="loncapa/python">
+def check(expect, ans):
+    return ans == expect
+        </script>
+      </problem>
+    </sequential>
+  </chapter>
+</course>'''
+            def text_of(xml):
+                xml = deepcopy(xml)
+                for c in xml.xpath('//comment()'):
+                    XBundle.remove_keeping_tail(c)
+                for x in xml.iter(*XBundle.CompactBlockTags):	# a space at each block boundary
+                    x.text = ' ' + (x.text or '')
+                    x.tail = ' ' + (x.tail or '')
+                return ' '.join(''.join(xml.itertext()).split())
+
+            tdir = path(tempfile.mkdtemp(prefix="tmp_xbundle_test"))
+            try:
+                sizes = {}
+                reloaded = {}
+                for compact in [False, True]:
+                    xb = XBundle(force_studio_format=True, compact_olx=compact)
+                    xb.set_course(etree.XML(cxmls))
+                    edir = xb.mkdir(tdir / str(compact))
+                    xb.export_to_directory(edir)
+                    sizes[compact] = sum(os.path.getsize(fn) for fn in (edir / 'mitx.01').walkfiles())
+                    xb2 = XBundle()
+                    xb2.import_from_directory(edir / 'mitx.01')
+                    reloaded[compact] = xb2.course
+                self.assertTrue(sizes[True] < sizes[False])
+                for tag in ['html', 'problem']:
+                    orig, compacted = [x.find('.//%s' % tag) for x in [reloaded[False], reloaded[True]]]
+                    self.assertEqual(text_of(orig), text_of(compacted))
+                    for keep in ['pre', 'script']:
+                        for a, b in zip(orig.findall('.//%s' % keep), compacted.findall('.//%s' % keep)):
+                            self.assertEqual(a.text, b.text)
+                self.assertEqual(compacted.xpath('//comment()'), [])
+                html = reloaded[True].find('.//html')
+                self.assertEqual(html.find('h2').text, 'Title')
+                self.assertEqual(etree.tostring(html.find('p')), '<p>Some <b>bold</b> text,\non two lines and \\(x^2\\)</p>')
+                self.assertEqual(etree.tostring(html.findall('p')[1]), '<p>Old <del>text</del> removed, <mark>new</mark> added</p>')
+            finally:
+                os.system("rm -rf '%s'" % tdir)
+
+        def testDeltaExport(self):
+
+            print "Testing XBundle export only rewrites changed files, and removes orphaned files"
+            cxmls = '''
+<course semester="2013_Spring" course="mitx.01">
+  <chapter display_name="Intro">
+    <sequential display_name="Overview">
+      <html display_name="Overview text">hello world</html>
+    </sequential>
+  </chapter>
+  <chapter display_name="Second">
+    <sequential display_name="More">
+      <problem display_name="Quiz"><p>Question</p></problem>
+    </sequential>
+  </chapter>
+</course>'''
+            tdir = path(tempfile.mkdtemp(prefix="tmp_xbundle_test"))
+            try:
+                xb = XBundle(force_studio_format=True)
+                xb.set_course(etree.XML(cxmls))
+                report = xb.export_to_directory(tdir, dir_include_course_id=False)
+                self.assertEqual((len(report['added']), report['unchanged']), (10, 0))
+                for fn in tdir.walkfiles():
+                    os.utime(fn, (1, 1))
+                self.assertEqual(xb.export_to_directory(tdir, dir_include_course_id=False),
+                                 {'added': [], 'changed': [], 'removed': [], 'unchanged': 10})
+
+                xb.course.find('.//html').text = "hello again"
+                xb.course.remove(xb.course.findall('chapter')[1])
+                report = xb.export_to_directory(tdir, dir_include_course_id=False)
+                self.assertEqual(sorted(report['changed']), ['course/2013_Spring.xml', 'html/Overview_text_html.xml'])
+                self.assertEqual(sorted(report['removed']), ['chapter/Second_chapter.xml', 'problem/Quiz_problem.xml',
+                                                     'sequential/More_sequential.xml', 'vertical/More_vertical.xml'])
+                self.assertEqual(report['added'], [])
+                self.assertFalse(os.path.exists(tdir / 'problem'))
+                self.assertEqual(os.path.getmtime(tdir / 'chapter/Intro_chapter.xml'), 1)
+                self.assertEqual(open(tdir / 'html/Overview_text_html.xml').read().count("hello again"), 1)
+            finally:
+                os.system("rm -rf '%s'" % tdir)
+
+        def testNormalize(self):
+
+            print "Testing XBundle normalizers run in one pass"
+            xb = XBundle()
+            xml = etree.XML('''
+<course>
+  <chapter name="Week 1">
+    <section name="Lecture">
+      <sequential><html name="Notes"><p name="x">text</p></html></sequential>
+      <!-- a comment -->
+    </section>
+  </chapter>
+</course>''')
+            visited = []
+            xb.add_normalizer('count', lambda x: visited.append(x.tag))
+            xb.normalize(xml)
+            self.assertEqual(re.sub('\\s+', '', etree.tostring(xml.find('chapter'))),
+                             '<chapterdisplay_name="Week1"><sequentialdisplay_name="Lecture">'
+                             '<htmldisplay_name="Notes"><pname="x">text</p></html><!--acomment-->'
+                             '</sequential></chapter>')
+            self.assertEqual(visited, ['course', 'chapter', 'sequential', 'html', 'p'])
+            self.assertEqual(sorted(xb.normalize_timing), ['count', 'fix_old_course_section', 'fix_old_descriptor_name'])
+
+        def testSkipHidden(self):
+
+            print "Testing XBundle import with skip_hidden prunes hidden subtrees without reading them"
+            xb = XBundle(force_studio_format=True)
+            xb.set_course(etree.XML('''
+<course semester="2013_Spring" course="mitx.01">
+  <chapter display_name="Public">
+    <sequential display_name="Open"><html display_name="Open text">hello</html></sequential>
+  </chapter>
+  <chapter display_name="Staff">
+    <sequential display_name="Hidden"><html display_name="Hidden text">secret</html></sequential>
+  </chapter>
+</course>'''))
+            xb.add_policies(etree.XML('''<policies semester="2013_Spring"><policy>{
+  "course/2013_Spring": {"start": "2013-02-01T00:00"},
+  "chapter/Staff_chapter": {"hide_from_toc": true},
+  "sequential/Open_sequential": {"graded": true, "format": "Homework"}
+}</policy></policies>'''))
+            tdir = path(tempfile.mkdtemp(prefix="tmp_xbundle_test"))
+            try:
+                xb.export_to_directory(tdir)
+                cdir = tdir / 'mitx.01'
+                xb1 = XBundle()
+                xb1.import_from_directory(cdir)
+                self.assertEqual(xb1.policy, {})			# the index is only built with skip_hidden
+                open(cdir / 'sequential/Hidden_sequential.xml', 'w').write("<not xml")	# never read, if pruned
+
+                xb2 = XBundle(skip_hidden=True)
+                xb2.import_from_directory(cdir)
+                self.assertEqual(xb2.policy['chapter/Staff_chapter'], {'hide_from_toc': 'true'})
+                self.assertEqual([x.get('display_name') for x in xb2.course.findall('.//html')], ['Open text'])
+                seq = xb2.course.find('.//sequential')
+                self.assertEqual((seq.get('graded'), seq.get('format')), ('true', 'Homework'))
+                self.assertEqual(xb2.course.findall('chapter')[1].get('url_name'), 'Staff_chapter')
+            finally:
+                os.system("rm -rf '%s'" % tdir)
+
     ts = unittest.makeSuite(TestXBundle)
     ttr = unittest.TextTestRunner()
     ttr.run(ts)
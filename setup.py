@@ -12,7 +12,7 @@ data_files = [
 
 setup(
     name='ocw2edx',
-    version='0.1',
+    version='0.2',
     author='I. Chuang',
     author_email='ichuang@mit.edu',
     packages=['ocw2edx'],